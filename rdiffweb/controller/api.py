@@ -72,6 +72,7 @@ class ApiPage(Controller):
                 "display_name": repo_obj.display_name,
                 "last_backup_date": repo_obj.last_backup_date,
                 "status": repo_obj.status[0],
+                "status_time": repo_obj.status_time,
                 "encoding": repo_obj.encoding} for repo_obj in u.repo_objs],
         }
         
@@ -33,7 +33,7 @@ import psutil
 
 from rdiffweb.controller import Controller, validate_int, validate
 from rdiffweb.core import RdiffError, RdiffWarning
-from rdiffweb.core.config import Option
+from rdiffweb.core.config import Option, IntOption
 from rdiffweb.core.i18n import ugettext as _
 from rdiffweb.core.rdw_templating import do_format_filesize as filesize
 from rdiffweb.core.store import ROLES
@@ -118,6 +118,7 @@ class AdminPage(Controller):
 
     logfile = Option('logfile')
     logaccessfile = Option('logaccessfile')
+    _repos_page_size = IntOption('AdminReposPageSize', 100)
 
     def _check_user_root_dir(self, directory):
         """Raised an exception if the directory is not valid."""
@@ -200,11 +201,18 @@ class AdminPage(Controller):
         return self._compile_template("admin_users.html", **params)
 
     @cherrypy.expose
-    def repos(self, criteria=u"", search=u""):
+    def repos(self, criteria=u"", search=u"", page=u"1"):
+        page = max(1, validate_int(page))
+        page_size = max(1, self._repos_page_size)
+        count = self.app.store.count_repos(search=search, criteria=criteria)
         params = {
             "criteria": criteria,
             "search": search,
-            "repos": list(self.app.store.repos(search=search, criteria=criteria))
+            "repos": list(self.app.store.repos(
+                search=search, criteria=criteria,
+                limit=page_size, offset=(page - 1) * page_size)),
+            "page": page,
+            "pages": (count + page_size - 1) // page_size,
         }
         return self._compile_template("admin_repos.html", **params)
 
@@ -19,11 +19,16 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import base64
 import logging
 import os
-from rdiffweb.controller import Controller, validate_isinstance, validate_int
+from rdiffweb.controller import Controller, validate, validate_isinstance, \
+    validate_int
 from rdiffweb.controller.dispatch import poppath
+from rdiffweb.core import quoting
+from rdiffweb.core.config import IntOption
 from rdiffweb.core.i18n import ugettext as _
+from rdiffweb.core.restore import ARCHIVERS
 
 from builtins import str
 import cherrypy
@@ -32,6 +37,29 @@ import cherrypy
 # Define the logger
 logger = logging.getLogger(__name__)
 
+SORT_KEYS = ['name', 'size', 'date']
+
+
+def _encode_cursor(key):
+    """
+    Convert the sort key of an entry into an opaque value to be used in URL.
+    """
+    value = str(key[0]).encode('ascii') + b':' + os.path.basename(key[1])
+    return base64.urlsafe_b64encode(value).decode('ascii')
+
+
+def _decode_cursor(cursor, path):
+    """
+    Convert the cursor back into a sort key. Raise ValueError if the cursor
+    is invalid.
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        first, name = value.split(b':', 1)
+        return (int(first), os.path.join(path, name))
+    except (TypeError, UnicodeError) as e:
+        raise ValueError(str(e))
+
 
 @poppath()
 class BrowsePage(Controller):
@@ -39,11 +67,16 @@ class BrowsePage(Controller):
     """This contoller provide a browser view to the user. It displays file in a
     repository."""
 
+    _page_size = IntOption("BrowsePageSize", 1000)
+
     @cherrypy.expose
-    def default(self, path=b"", restore="", limit='10'):
+    def default(self, path=b"", restore="", limit='10', sort='name', order='asc', cursor=''):
         validate_isinstance(restore, str)
         limit = validate_int(limit)
         restore = bool(restore)
+        validate(sort in SORT_KEYS)
+        validate(order in ['asc', 'desc'])
+        validate_isinstance(cursor, str)
 
         # Check user access to the given repo & path
         (repo_obj, path_obj) = self.app.store.get_repo_path(path)
@@ -54,12 +87,12 @@ class BrowsePage(Controller):
         parents = []
         parents.append({"path": b"", "name": repo_obj.display_name})
         parent_path_b = b""
-        for part_b in path_obj.path.split(b'/'):
-            if part_b:
-                parent_path_b = os.path.join(parent_path_b, part_b)
-                display_name = repo_obj._decode(repo_obj.unquote(part_b))
-                parents.append({"path": parent_path_b,
-                                "name": display_name})
+        parts_b = [part_b for part_b in path_obj.path.split(b'/') if part_b]
+        for part_b, unquoted_b in zip(parts_b, quoting.unquote_all(parts_b)):
+            parent_path_b = os.path.join(parent_path_b, part_b)
+            display_name = repo_obj._decode(unquoted_b)
+            parents.append({"path": parent_path_b,
+                            "name": display_name})
 
         # Set up warning about in-progress backups, if necessary
         warning = False
@@ -69,18 +102,48 @@ class BrowsePage(Controller):
 
         dir_entries = []
         restore_dates = []
+        next_cursor = None
         if restore:
             restore_dates = path_obj.change_dates[:-limit - 1:-1]
         else:
-            # Get list of actual directory entries
-            dir_entries = path_obj.dir_entries[::-1]
+            page_size = max(1, self._page_size)
+            reverse = order == 'desc'
+            if sort != 'name':
+                # Sorting by size or date require every entry of the
+                # directory. Only do it when the directory fits in a single
+                # page. Otherwise, fallback to sorting by name.
+                entries = [] if cursor else list(path_obj.iter_dir_entries(limit=page_size + 1))
+                if entries and len(entries) <= page_size:
+                    dir_entries = sorted(entries, key=lambda e: e.sort_key(sort), reverse=reverse)
+                else:
+                    sort = 'name'
+            if sort == 'name':
+                # Get one page of directory entries. Fetch one more entry to
+                # know if another page is available.
+                after = None
+                if cursor:
+                    try:
+                        after = _decode_cursor(cursor, path_obj.path)
+                    except ValueError:
+                        raise cherrypy.HTTPError(400, _("Invalid cursor."))
+                entries = path_obj.iter_dir_entries(reverse=reverse, after=after, limit=page_size + 1)
+                for entry in entries:
+                    if len(dir_entries) == page_size:
+                        next_cursor = _encode_cursor(dir_entries[-1].sort_key(sort))
+                        break
+                    dir_entries.append(entry)
 
         parms = {
             "repo" : repo_obj,
             "path" : path_obj,
             "limit": limit,
+            "sort": sort,
+            "order": order,
+            "cursor": cursor,
+            "next_cursor": next_cursor,
             "dir_entries": dir_entries,
             "parents": parents,
             "restore_dates": restore_dates,
+            "archivers": ARCHIVERS,
             "warning": warning}
         return self._compile_template("browse.html", **parms)
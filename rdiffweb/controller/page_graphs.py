@@ -20,14 +20,13 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from builtins import bytes
-from builtins import str
 import logging
 
 import cherrypy
-from future.utils import iteritems
-
-from rdiffweb.controller import Controller, validate_isinstance
+from rdiffweb.controller import Controller, validate, validate_isinstance, validate_int
 from rdiffweb.controller.dispatch import poppath
+from rdiffweb.core.librdiff import SESSION_STATISTICS_ATTRS, SESSION_STATISTICS_FLOATS, \
+    SESSION_STATISTICS_FUNCS, SESSION_STATISTICS_GROUPS
 
 
 _logger = logging.getLogger(__name__)
@@ -36,29 +35,44 @@ _logger = logging.getLogger(__name__)
 @poppath('graph')
 class GraphsPage(Controller):
 
-    def _data(self, repo_obj, **kwargs):
-        attrs = [
-            'starttime', 'endtime', 'elapsedtime', 'sourcefiles', 'sourcefilesize',
-            'mirrorfiles', 'mirrorfilesize', 'newfiles', 'newfilesize', 'deletedfiles',
-            'deletedfilesize', 'changedfiles', 'changedsourcesize', 'changedmirrorsize',
-            'incrementfiles', 'incrementfilesize', 'totaldestinationsizechange', 'errors']
+    def _data(self, repo_obj, start=None, end=None, points=None, metric=None, group=None, agg='sum', tzoffset=None, **kwargs):
+        """
+        Return the session statistics as CSV. Optionally limited to sessions
+        between `start` and `end` epoch and downsampled to `points` rows,
+        using the shape of `metric` if defined. When `group` is defined, the
+        sessions are aggregated by day, week, month or year using `agg`
+        in the timezone `tzoffset` (minutes between UTC and local time).
+        """
+        start = validate_int(start) if start else None
+        end = validate_int(end) if end else None
+        points = validate_int(points) if points else None
+        tzoffset = validate_int(tzoffset) if tzoffset else 0
+        validate(not metric or metric in SESSION_STATISTICS_ATTRS, 'invalid metric')
+        validate(not group or group in SESSION_STATISTICS_GROUPS, 'invalid group')
+        validate(agg in SESSION_STATISTICS_FUNCS, 'invalid agg')
+        columns = repo_obj.session_statistics_columns
+        if group:
+            rows = columns.aggregate(group, agg, start, end, tzoffset)
+            fmts = ['%.2f' if attr in SESSION_STATISTICS_FLOATS or agg == 'avg' else '%d' for attr in SESSION_STATISTICS_ATTRS]
+        else:
+            rows = columns.rows(start, end, points, metric)
+            fmts = ['%s' if attr in SESSION_STATISTICS_FLOATS else '%d' for attr in SESSION_STATISTICS_ATTRS]
 
         # Return a generator
         def func():
             # Header
-            yield 'date'
-            for attr in attrs:
-                yield ','
-                yield attr
-            yield '\n'
+            yield ','.join(['date'] + SESSION_STATISTICS_ATTRS) + '\n'
             # Content
-            for d, s in iteritems(repo_obj.session_statistics):
-                yield str(d.epoch())
-                for attr in attrs:
-                    yield ','
-                    yield str(getattr(s, attr))
-                yield '\n'
+            lines = []
+            for date, values in rows:
+                lines.append('%d,' % date + ','.join([fmt % v for fmt, v in zip(fmts, values)]) + '\n')
+                if len(lines) >= 256:
+                    yield ''.join(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines)
 
+        cherrypy.response.stream = True
         return func()
 
     def _page(self, repo_obj, graph, **kwargs):
@@ -26,6 +26,7 @@ import cherrypy
 from rdiffweb.controller import Controller, validate_int
 from rdiffweb.controller.dispatch import poppath
 from rdiffweb.core.i18n import ugettext as _
+from rdiffweb.core.restore import ARCHIVERS
 
 
 # Define the logger
@@ -52,6 +53,7 @@ class HistoryPage(Controller):
             "repo": repo_obj,
             "history_entries": repo_obj.get_history_entries(numLatestEntries=limit, reverse=True),
             "warning": warning,
+            "archivers": ARCHIVERS,
         }
 
         return self._compile_template("history.html", **parms)
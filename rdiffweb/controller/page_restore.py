@@ -22,15 +22,17 @@ from __future__ import unicode_literals
 import logging
 from rdiffweb.controller import Controller, validate_isinstance, validate
 from rdiffweb.controller.dispatch import poppath
-from rdiffweb.core.restore import ARCHIVERS
+from rdiffweb.core.config import IntOption
+from rdiffweb.core.restore import ARCHIVERS, call_restore
 from rdiffweb.core.i18n import ugettext as _
 from rdiffweb.core.librdiff import RdiffTime
+from rdiffweb.core.restore_queue import DONE, FAILED, QUEUED, RUNNING
 from rdiffweb.core.rdw_helpers import quote_url
 
 from builtins import bytes
 from builtins import str
 import cherrypy
-from cherrypy.lib.static import _serve_fileobj, mimetypes
+from cherrypy.lib.static import _serve_fileobj, mimetypes, serve_file
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -74,6 +76,13 @@ def _content_type(filename):
 class RestorePage(Controller):
     _cp_config = {"response.stream": True, "response.timeout": 3000}
 
+    _compression_workers = IntOption("RestoreCompressionWorkers", 1)
+
+    _compression_level = IntOption("RestoreCompressionLevel", None)
+
+    # Number of seconds before the queued page is refreshed.
+    _refresh = 5
+
     @cherrypy.expose
     @cherrypy.tools.gzip(on=False)
     def default(self, path=b"", date=None, kind=None, usetar=None):
@@ -83,7 +92,7 @@ class RestorePage(Controller):
         validate(usetar is None or isinstance(usetar, str))
 
         # Check user access to repo / path.
-        path_obj = self.app.store.get_repo_path(path)[1]
+        (repo_obj, path_obj) = self.app.store.get_repo_path(path)
 
         # Get the restore date
         try:
@@ -100,9 +109,57 @@ class RestorePage(Controller):
         if usetar is not None:
             kind = 'tar.gz'
 
-        # Restore file(s)
-        filename, fileobj = path_obj.restore(int(date), kind=kind)
-
+        # Restore a single file without rdiff-backup if possible.
+        filename, kind = path_obj.archive_name(kind)
+        if kind == 'raw':
+            fileobj = path_obj.restore_file(int(date))
+            if fileobj is not None:
+                return self._serve_fileobj(filename, fileobj)
+
+        # Otherwise, restore file(s) using the queue.
+        job = self.app.restore_queue.submit(
+            self.app.currentuser.username, path_obj.restore_path, int(date),
+            repo_obj._encoding.name, kind,
+            workers=max(1, self._compression_workers),
+            level=self._compression_level)
+
+        # Stream the archive directly when the cache is full.
+        if job is None:
+            fileobj = call_restore(
+                path_obj.restore_path, int(date), repo_obj._encoding.name, kind,
+                workers=max(1, self._compression_workers),
+                level=self._compression_level,
+                temp_window=self.app.restore_queue.temp_window)
+            return self._serve_fileobj(filename, fileobj)
+
+        # Serve the archive from cache. This support resume of download.
+        if job.state == DONE:
+            content_type = _content_type(filename)
+            cherrypy.response.headers["Content-Disposition"] = _content_disposition(filename)
+            return serve_file(job.archive, content_type=content_type)
+
+        if job.state == FAILED:
+            raise cherrypy.HTTPError(500, _("Fail to restore the data."))
+
+        # Let the user wait for other restore to complete. Browsers are
+        # shown the progress of the restore until the archive is completed.
+        accept_html = 'text/html' in cherrypy.request.headers.get('Accept', '')
+        if job.state == QUEUED or accept_html:
+            cherrypy.response.status = 202
+            cherrypy.response.headers['Retry-After'] = str(self._refresh)
+            cherrypy.response.headers['Cache-Control'] = 'no-cache'
+            return self._compile_template(
+                "restore_queued.html",
+                filename=filename,
+                running=job.state == RUNNING,
+                position=self.app.restore_queue.position(job),
+                size=job.size,
+                refresh=self._refresh)
+
+        # Stream the data as it's written to the archive.
+        return self._serve_fileobj(filename, job.follow())
+
+    def _serve_fileobj(self, filename, fileobj):
         # Define content-disposition.
         cherrypy.response.headers["Content-Disposition"] = _content_disposition(filename)
 
@@ -111,6 +168,8 @@ class RestorePage(Controller):
         cherrypy.response.headers['Content-Type'] = content_type
 
         # Stream the data.
+        if not hasattr(fileobj, 'read'):
+            return fileobj
         # Make use of _serve_fileobj() because the fsstat() function on a pipe
         # return a size of 0 for Content-Length. This behavior brake all the flow.
         return _serve_fileobj(fileobj, content_type=content_type, content_length=None)
@@ -25,10 +25,11 @@ from datetime import timedelta
 import logging
 
 import cherrypy
-from rdiffweb.controller import Controller, validate_isinstance
+from rdiffweb.controller import Controller, validate_isinstance, validate_int
 from rdiffweb.controller.dispatch import poppath
 from rdiffweb.core import librdiff
 from rdiffweb.core import rdw_helpers
+from rdiffweb.core.config import IntOption
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -37,10 +38,14 @@ logger = logging.getLogger(__name__)
 @poppath()
 class StatusPage(Controller):
 
+    _page_size = IntOption('StatusPageSize', 100)
+
     @cherrypy.expose
-    def default(self, path=b"", date="", failures=""):
+    def default(self, path=b"", date="", failures="", page="1"):
         validate_isinstance(date, str)
-        
+        page = max(1, validate_int(page))
+        page_size = max(1, self._page_size)
+
         # Validate date
         startTime = librdiff.RdiffTime() - timedelta(days=5)
         endTime = None
@@ -58,40 +63,48 @@ class StatusPage(Controller):
             endTime.set_time(23, 59, 59)
         
         # Limit the scope to the given path.
-        if path:
-            user_repos = [self.app.store.get_repo(path)]
-        else:
-            user_repos = self.app.currentuser.repo_objs
-        
+        repo_obj = self.app.store.get_repo(path) if path else None
+
+        # The backups are recorded in database when the status is refreshed
+        # in background. Otherwise, record the new backups now. Only the
+        # repositories modified since the last call are read.
+        if not self.app.status_refresher.enabled:
+            for r in [repo_obj] if repo_obj else self.app.currentuser.repo_objs:
+                try:
+                    r.update_backups()
+                except Exception:
+                    logger.warning("fail to update backups of [%r]", r, exc_info=1)
+
         failuresOnly = failures != ""
-        messages = self._getUserMessages(user_repos, not failuresOnly, True, startTime, endTime)
-        
+        criteria = {
+            "start": startTime.epoch(),
+            "end": endTime.epoch() if endTime else None,
+            "errors": True if failuresOnly else None}
+        count = self.app.store.count_backups(self.app.currentuser, repo_obj, **criteria)
+        backups = list(self.app.store.backups(
+            self.app.currentuser, repo_obj,
+            limit=page_size, offset=(page - 1) * page_size, **criteria))
+        messages = self._getUserMessages(backups, not failuresOnly, True)
+
         return self._compile_template(
             "status.html",
             messages=messages,
-            failuresOnly=failuresOnly)
+            failuresOnly=failuresOnly,
+            repo=repo_obj,
+            date=date,
+            page=page,
+            pages=(count + page_size - 1) // page_size)
 
     def _getUserMessages(self,
-                         repos,
+                         backups,
                          includeSuccess,
-                         includeFailure,
-                         earliest_date,
-                         latest_date):
+                         includeFailure):
 
         repoErrors = []
-        allBackups = []
-        for repo_obj in repos:
-            backups = repo_obj.get_history_entries(-1, earliest_date, latest_date)
-            allBackups += [{"repo": repo_obj,
-                            "date": backup.date,
-                            "size": backup.size,
-                            "errors": backup.errors} for backup in backups]
-
-        allBackups.sort(key=lambda x: x["date"])
-        failedBackups = [x for x in allBackups if x["errors"]]
+        failedBackups = [x for x in backups if x["errors"]]
 
         # group successful backups by day
-        successfulBackups = [x for x in allBackups if not x["errors"]]
+        successfulBackups = [x for x in backups if not x["errors"]]
         if successfulBackups:
             lastSuccessDate = successfulBackups[0]["date"]
         successfulBackups = rdw_helpers.groupby(
@@ -363,6 +363,9 @@ class AdminReposTest(WebCase):
         self.assertInBody("No repository found")
 
     def test_repos_with_criteria(self):
+        # Status is computed in background.
+        self.app.status_refresher.refresh_all()
+
         # Search something that exists
         self.getPage("/admin/repos?criteria=ok")
         self.assertStatus(200)
@@ -374,6 +377,18 @@ class AdminReposTest(WebCase):
         self.assertNotInBody(self.REPO)
         self.assertInBody("No repository found")
 
+    def test_repos_with_page(self):
+        self.getPage("/admin/repos?page=1")
+        self.assertStatus(200)
+        self.assertInBody(self.REPO)
+        # Page out of range
+        self.getPage("/admin/repos?page=2")
+        self.assertStatus(200)
+        self.assertInBody("No repository found")
+        # Invalid page
+        self.getPage("/admin/repos?page=invalid")
+        self.assertStatus(400)
+
 
 class AdminSysinfoTest(WebCase):
 
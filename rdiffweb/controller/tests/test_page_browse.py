@@ -26,6 +26,7 @@ from __future__ import unicode_literals
 
 import logging
 import os
+import re
 import unittest
 
 from rdiffweb.core.store import USER_ROLE
@@ -275,6 +276,60 @@ class BrowsePageTest(WebCase):
         self.assertStatus('403 Forbidden')
 
 
+class BrowsePagePaginationTest(WebCase):
+    """Check pagination of browse page."""
+
+    reset_app = True
+
+    reset_testcases = True
+
+    login = True
+
+    @classmethod
+    def setup_server(cls):
+        WebCase.setup_server(default_config={'BrowsePageSize': '3'})
+
+    def test_browse_pages(self):
+        self.getPage("/browse/" + self.USERNAME + "/" + self.REPO + "/")
+        self.assertStatus('200 OK')
+        self.assertInBody('id="files-more"')
+        # Follow the link to the next pages.
+        body = self.body.decode('utf8', 'replace')
+        pages = [body]
+        while 'id="files-more"' in body:
+            self.assertLess(len(pages), 20)
+            link = re.search(r'id="files-more".*?href="([^"]+)"', body, re.DOTALL).group(1)
+            self.getPage(link.replace('&amp;', '&'))
+            self.assertStatus('200 OK')
+            body = self.body.decode('utf8', 'replace')
+            pages.append(body)
+        self.assertGreater(len(pages), 1)
+        # Every entry should be listed once.
+        self.assertEqual(1, len([p for p in pages if "Revisions" in p]))
+        self.assertEqual(1, len([p for p in pages if "Fichier avec non asci char" in p]))
+
+    def test_browse_sort_by_size(self):
+        # Too many entries to sort by size, fallback to name.
+        self.getPage("/browse/" + self.USERNAME + "/" + self.REPO + "/?sort=size&order=desc")
+        self.assertStatus('200 OK')
+        self.assertInBody('id="files-more"')
+        self.assertInBody('order=desc&amp;sort=name')
+        self.assertNotInBody('sort=size')
+
+    def test_browse_sort_by_size_single_page(self):
+        self.getPage("/browse/" + self.USERNAME + "/" + self.REPO + "/Revisions/?sort=size&order=desc")
+        self.assertStatus('200 OK')
+        self.assertNotInBody('id="files-more"')
+
+    def test_browse_invalid_sort(self):
+        self.getPage("/browse/" + self.USERNAME + "/" + self.REPO + "/?sort=invalid")
+        self.assertStatus(400)
+
+    def test_browse_invalid_cursor(self):
+        self.getPage("/browse/" + self.USERNAME + "/" + self.REPO + "/?cursor=invalid")
+        self.assertStatus(400)
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     logging.basicConfig(level=logging.DEBUG)
@@ -49,14 +49,20 @@ class SettingsTest(WebCase):
     def test_files(self):
         self.getPage("/graphs/files/" + self.USERNAME + "/" + self.REPO + "/")
         self.assertStatus('200 OK')
+        # Data is downsampled to the width of the graph.
+        self.assertInBody('?metric=sourcefiles&points=" + width')
 
     def test_sizes(self):
         self.getPage("/graphs/sizes/" + self.USERNAME + "/" + self.REPO + "/")
         self.assertStatus('200 OK')
+        # Data is downsampled to the width of the graph.
+        self.assertInBody('?metric=mirrorfilesize&points=" + width')
 
     def test_times(self):
         self.getPage("/graphs/times/" + self.USERNAME + "/" + self.REPO + "/")
         self.assertStatus('200 OK')
+        # Data is downsampled to the width of the graph.
+        self.assertInBody('?metric=elapsedtime&points=" + width')
 
     def test_data(self):
         self.getPage("/graphs/data/" + self.USERNAME + "/" + self.REPO + "/")
@@ -88,6 +94,34 @@ class SettingsTest(WebCase):
 """
         self.assertEquals(expected, self.body)
 
+    def test_data_with_range(self):
+        self.getPage("/graphs/data/" + self.USERNAME + "/" + self.REPO + "/?start=1414873822&end=1415047607&points=3")
+        self.assertStatus('200 OK')
+        lines = self.body.splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[1].startswith(b'1414873850,'))
+        self.assertTrue(lines[3].startswith(b'1415047607,'))
+
+    def test_data_with_points(self):
+        self.getPage("/graphs/data/" + self.USERNAME + "/" + self.REPO + "/?metric=sourcefiles&points=4")
+        self.assertStatus('200 OK')
+        lines = self.body.splitlines()
+        self.assertEqual(5, len(lines))
+        # First and last sessions are kept.
+        self.assertTrue(lines[1].startswith(b'1414871387,'))
+        self.assertTrue(lines[4].startswith(b'1454448640,'))
+
+    def test_data_with_group(self):
+        self.getPage("/graphs/data/" + self.USERNAME + "/" + self.REPO + "/?group=month&agg=max")
+        self.assertStatus('200 OK')
+        lines = self.body.splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[1].startswith(b'1414800000,1415221507.00,'))
+
+    def test_data_with_invalid_group(self):
+        self.getPage("/graphs/data/" + self.USERNAME + "/" + self.REPO + "/?group=invalid")
+        self.assertStatus(400)
+
     def test_as_another_user(self):
         # Create a nother user with admin right
         user_obj = self.app.store.add_user('anotheruser', 'password')
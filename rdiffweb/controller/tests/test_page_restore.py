@@ -31,7 +31,10 @@ import tarfile
 import unittest
 import zipfile
 
+from mock import MagicMock, patch
+
 from rdiffweb.controller.page_restore import _content_disposition
+from rdiffweb.core.restore_queue import RUNNING
 from rdiffweb.core.store import USER_ROLE
 from rdiffweb.test import WebCase, AppTestCase
 
@@ -221,6 +224,29 @@ class RestoreTest(WebCase):
         #  Compare the tables.
         self.assertEqual(expected, actual)
 
+    def test_root_as_zip_progress(self):
+        job = MagicMock(state=RUNNING, size=2048)
+        job.follow.return_value = iter([b'data'])
+        with patch.object(self.app.restore_queue, 'submit', return_value=job):
+            # Browsers are shown the progress of the restore.
+            self.getPage("/restore/" + self.USERNAME + "/" + self.REPO + "/?date=1414871387&kind=zip", headers=[('Accept', 'text/html')])
+            self.assertStatus(202)
+            self.assertInBody('Archive size: 2.0 KiB')
+            # Other clients get the archive as it's written.
+            self.getPage("/restore/" + self.USERNAME + "/" + self.REPO + "/?date=1414871387&kind=zip")
+            self.assertStatus(200)
+            self.assertBody(b'data')
+
+    def test_root_as_zip_resume(self):
+        self._restore(self.USERNAME, self.REPO, "", "1414871387", False)
+        self.assertStatus(200)
+        body = self.body
+        # Completed archive is kept in cache and support range request.
+        self.getPage("/restore/" + self.USERNAME + "/" + self.REPO + "/?date=1414871387", headers=[('Range', 'bytes=10-')])
+        self.assertStatus(206)
+        self.assertHeader('Content-Type', 'application/zip')
+        self.assertEqual(body[10:], self.body)
+
     def test_root_as_zip_recent(self):
         self._restore(self.USERNAME, self.REPO, "", "1415221507", False)
         self.assertStatus(200)
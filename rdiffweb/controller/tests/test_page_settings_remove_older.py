@@ -149,6 +149,21 @@ class RemoveOlderTestWithMock(WebCase):
         # Check if _remove_older was called
         p._remove_older.assert_called_once_with(repo)
 
+    def test_deamon_run_with_lease(self):
+        """
+        Check if the job is executed by a single process.
+        """
+        p = RemoveOlder(cherrypy.engine, self.app)
+        p._wait = MagicMock()
+        p.job_run = MagicMock()
+        # First run acquire the lease.
+        p.deamon_run()
+        self.assertEqual(1, p.job_run.call_count)
+        # Another process should not run the job.
+        self.app.store._database.update('leases', name='RemoveOlder', owner='otherhost:1')
+        p.deamon_run()
+        self.assertEqual(1, p.job_run.call_count)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
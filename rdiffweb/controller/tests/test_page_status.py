@@ -39,6 +39,8 @@ class StatusTest(WebCase):
     reset_testcases = True
 
     def _status(self, failures=False, date=None):
+        # Backups are recorded when the status is refreshed in background.
+        self.app.status_refresher.refresh_all()
         url = "/status/"
         if date:
             url += '?date=' + str(date)
@@ -72,6 +74,44 @@ class StatusTest(WebCase):
         self.assertInBody('Successful')
 
 
+class StatusPagingTest(WebCase):
+    """Check pagination of status page."""
+
+    login = True
+
+    reset_app = True
+
+    reset_testcases = True
+
+    @classmethod
+    def setup_server(cls):
+        WebCase.setup_server(default_config={'StatusPageSize': '1'})
+
+    def test_page_date(self):
+        self.app.status_refresher.refresh_all()
+        # Two backups on 2014-11-02.
+        self.getPage('/status/?date=1414939853')
+        self.assertStatus(200)
+        self.assertInBody('Page 1 of ')
+        self.assertInBody('page=2')
+        self.getPage('/status/?date=1414939853&page=2')
+        self.assertStatus(200)
+        self.assertInBody('Successful')
+        self.assertInBody('page=1')
+
+    def test_page_without_refresher(self):
+        # Backups are recorded by the page when the status is not refreshed
+        # in background.
+        self.app.status_refresher._interval = 0
+        self.getPage('/status/?date=1414939853')
+        self.assertStatus(200)
+        self.assertInBody('Page 1 of ')
+
+    def test_page_invalid(self):
+        self.getPage('/status/?page=invalid')
+        self.assertStatus(400)
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     logging.basicConfig(level=logging.DEBUG)
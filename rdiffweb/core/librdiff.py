@@ -19,6 +19,7 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from array import array
 import bisect
 from builtins import bytes
 from builtins import map
@@ -26,14 +27,19 @@ from builtins import object
 from builtins import str
 import calendar
 from collections import OrderedDict
-from datetime import timedelta
+from datetime import datetime, timedelta
 import encodings
 import gzip
+import hashlib
+import heapq
 import logging
 import os
 import re
 import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
 import weakref
 
@@ -44,11 +50,23 @@ from past.builtins import cmp
 from past.utils import old_div
 import psutil
 
-from rdiffweb.core import rdw_helpers
+from rdiffweb.core import quoting, rdw_helpers
 from rdiffweb.core.i18n import ugettext as _
-from rdiffweb.core.restore import call_restore
+from rdiffweb.core.metadata_index import IncrementsIndex, MetadataIndex, \
+    parse_session_statistics
+from rdiffweb.core.mirror_metadata import FileTreeIndex
+from rdiffweb.core.restore import call_restore, restore_file
 import subprocess
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python 2 backport.
+        from scandir import scandir  # @UnresolvedImport
+    except ImportError:
+        scandir = None
+
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -59,6 +77,9 @@ RDIFF_BACKUP_DATA = b"rdiff-backup-data"
 # Increment folder name.
 INCREMENTS = b"increments"
 
+# Number of distinct timestamps kept by `RdiffTime.parse()`.
+_RDIFF_TIME_CACHE_SIZE = 10000
+
 
 @python_2_unicode_compatible
 class ExecuteError(Exception):
@@ -86,6 +107,56 @@ class UnknownError(FileError):
     pass
 
 
+class _ScandirEntry(object):
+    """
+    Minimal implementation of os.DirEntry used when scandir is not available.
+    """
+
+    def __init__(self, path, name):
+        self.name = name
+        self.path = os.path.join(path, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path) if follow_symlinks else os.lstat(self.path)
+
+
+def _iter_scandir(path):
+    """
+    Generator of the entries (os.DirEntry) of the given directory. Raise
+    OSError if the directory cannot be listed. The file type and stat are
+    cached by each entry to avoid calling the system once more.
+    """
+    if scandir:
+        it = scandir(path)
+        try:
+            for entry in it:
+                yield entry
+        finally:
+            # Python >= 3.6 requires the iterator to be closed.
+            if hasattr(it, 'close'):
+                it.close()
+    else:
+        for name in os.listdir(path):
+            yield _ScandirEntry(path, name)
+
+
+def _isdir(dirent, increments):
+    """
+    Check if an entry is a directory from its scandir entry or from its
+    increments if the entry was deleted.
+    """
+    if dirent is not None:
+        return dirent.is_dir()
+    for increment in sorted(increments, key=lambda x: x.date):
+        # Ignore missing increment...
+        if not increment.is_missing:
+            return increment.isdir
+    return False
+
+
 @python_2_unicode_compatible
 class RdiffTime(object):
 
@@ -97,6 +168,11 @@ class RdiffTime(object):
     "local" time, but pass the timezone information on to rdiff-backup, so
     it can restore to the correct state"""
 
+    __slots__ = ('_time_seconds', '_tz_offset', '_epoch')
+
+    # Instances returned by `parse()` for each timestamp string.
+    _cache = rdw_helpers.LRUCache(_RDIFF_TIME_CACHE_SIZE)
+
     def __init__(self, value=None, tz_offset=None):
         assert value is None or isinstance(value, int) or isinstance(value, str)
         if value is None:
@@ -111,6 +187,20 @@ class RdiffTime(object):
             self._tz_offset = value._tz_offset
         else:
             self._from_str(value)
+        self._epoch = self._time_seconds - self._tz_offset
+
+    @staticmethod
+    def parse(value):
+        """
+        Return the RdiffTime of the given timestamp string. The instances
+        are shared between calls with the same value, they must not be
+        modified.
+        """
+        date = RdiffTime._cache.get(value)
+        if date is None:
+            date = RdiffTime(value)
+            RdiffTime._cache.set(value, date)
+        return date
 
     def _from_str(self, timeString):
         try:
@@ -136,7 +226,7 @@ class RdiffTime(object):
         return self._time_seconds // (24 * 60 * 60)
 
     def epoch(self):
-        return self._time_seconds - self._tz_offset
+        return self._epoch
 
     def _tz_str(self):
         if self._tz_offset:
@@ -157,6 +247,7 @@ class RdiffTime(object):
         day = time.gmtime(self._time_seconds)[2]
         self._time_seconds = calendar.timegm(
             (year, month, day, hour, minute, second, -1, -1, 0))
+        self._epoch = self._time_seconds - self._tz_offset
 
     def strftime(self, dateformat):
         value = time.strftime(dateformat, time.gmtime(self._time_seconds))
@@ -200,30 +291,30 @@ class RdiffTime(object):
 
     def __lt__(self, other):
         assert isinstance(other, RdiffTime)
-        return self.epoch() < other.epoch()
+        return self._epoch < other._epoch
 
     def __le__(self, other):
         assert isinstance(other, RdiffTime)
-        return self.epoch() <= other.epoch()
+        return self._epoch <= other._epoch
 
     def __gt__(self, other):
         assert isinstance(other, RdiffTime)
-        return self.epoch() > other.epoch()
+        return self._epoch > other._epoch
 
     def __ge__(self, other):
         assert isinstance(other, RdiffTime)
-        return self.epoch() >= other.epoch()
+        return self._epoch >= other._epoch
 
     def __cmp__(self, other):
         assert isinstance(other, RdiffTime)
-        return cmp(self.epoch(), other.epoch())
+        return cmp(self._epoch, other._epoch)
 
     def __eq__(self, other):
         return (isinstance(other, RdiffTime) and
-                self.epoch() == other.epoch())
+                self._epoch == other._epoch)
 
     def __hash__(self):
-        return hash(self.epoch())
+        return hash(self._epoch)
 
     def __str__(self):
         """return utf-8 string"""
@@ -246,7 +337,11 @@ class DirEntry(object):
     """Includes name, isDir, fileSize, exists, and dict (changeDates) of sorted
     local dates when backed up"""
 
-    def __init__(self, parent, path, exists, increments):
+    def __init__(self, parent, path, exists, increments, dirent=None):
+        """
+        `dirent` is the os.DirEntry of the existing file used to get the
+        file type and size without calling the system.
+        """
         assert isinstance(parent, RdiffRepo) or isinstance(parent, DirEntry)
         assert isinstance(path, bytes)
 
@@ -265,6 +360,34 @@ class DirEntry(object):
         # Store the increments sorted by date.
         # See self.last_change_date()
         self._increments = sorted(increments, key=lambda x: x.date)
+        self._dirent = dirent
+
+    def _iter_children(self):
+        """
+        Generator of (filename, dirent, increments) for every entry of this
+        directory. `dirent` is None for the entries that were deleted.
+        """
+        # Increments grouped by filename
+        grouped_increment_entries = self._repo._get_increment_entries(self.path)
+
+        # Check if the directory exists. It may not exist if
+        # it has been delete. Use scandir to get the file type of each entry
+        # in the same pass.
+        existing = set()
+        try:
+            for dirent in _iter_scandir(self.full_path):
+                # Remove "rdiff-backup-data" directory
+                if self.path == b'' and dirent.name == RDIFF_BACKUP_DATA:
+                    continue
+                existing.add(dirent.name)
+                yield dirent.name, dirent, grouped_increment_entries.get(dirent.name, [])
+        except OSError:
+            pass
+
+        # Then add the deleted entries only known by their increments.
+        for filename, increments in iteritems(grouped_increment_entries):
+            if filename not in existing:
+                yield filename, None, increments
 
     @property
     def dir_entries(self):
@@ -273,57 +396,83 @@ class DirEntry(object):
 
         logger.debug("get directory entries for [%r]", self.full_path)
 
-        # Group increments by filename
-        grouped_increment_entries = rdw_helpers.groupby(
-            self._repo._get_increment_entries(self.path), lambda x: x.filename)
+        entries = [
+            DirEntry(self, filename, dirent is not None, increments, dirent)
+            for filename, dirent, increments in self._iter_children()]
+        # Keep reference to siblings to lookup file size of deleted entries
+        # at once.
+        for entry in entries:
+            entry._siblings = entries
+        return entries
 
-        # Check if the directory exists. It may not exist if
-        # it has been delete
-        existing_entries = []
-        if os.path.isdir(self.full_path) and os.access(self.full_path, os.F_OK):
-            # Get entries from directory structure
-            existing_entries = os.listdir(self.full_path)
-            # Remove "rdiff-backup-data" directory
-            if self.path == b'' and RDIFF_BACKUP_DATA in existing_entries:
-                existing_entries.remove(RDIFF_BACKUP_DATA)
-
-        # Process each increment entries and combine this with the existing
-        # entries
-        entriesDict = {}
-        for filename, increments in iteritems(grouped_increment_entries):
-            # Check if filename exists
-            exists = filename in existing_entries
-            # Create DirEntry to represent the item
-            new_entry = DirEntry(
-                self,
-                filename,
-                exists,
-                increments)
-            entriesDict[filename] = new_entry
-
-        # Then add existing entries
-        for filename in existing_entries:
-            # Check if the entry was created by increments entry
-            if filename in entriesDict:
-                continue
-            # The entry doesn't exists (mostly because it ever change). So
-            # create a DirEntry to represent it
-            new_entry = DirEntry(
-                self,
-                filename,
-                True,
-                [])
-            entriesDict[filename] = new_entry
-
-        # Return the values (so the DirEntry objects)
-        return list(entriesDict.values())
+    def sort_key(self, sort='name'):
+        """
+        Return the key used to sort this entry. Directories are listed
+        first when sorting by name. The path is used as a tie breaker to get
+        a stable order used by `iter_dir_entries()`.
+        """
+        if sort == 'name':
+            return (0 if self.isdir else 1, self.path)
+        elif sort == 'size':
+            return (0 if self.isdir else self.file_size, self.path)
+        elif sort == 'date':
+            date = self.last_change_date
+            return (date.epoch() if date else 0, self.path)
+        raise ValueError('invalid sort key: %r' % sort)
+
+    def iter_dir_entries(self, sort='name', reverse=False, after=None, limit=None):
+        """
+        Generator returning the directory entries sorted by `sort` (name,
+        size or date).
+
+        When sorting by name, `after` may be the value of `sort_key()` of the
+        last entry returned by a previous call. The iteration then resume
+        with the next entry. When `limit` is defined, at most `limit` entries
+        are returned. Only the names and file types are read to select the
+        entries; the DirEntry objects are created for the entries returned.
+
+        Sorting by size or date require the information of every entry, so
+        `after` and `limit` are not supported. Raise ValueError.
+        """
+        if sort != 'name':
+            if after is not None or limit is not None:
+                raise ValueError('paging is only supported when sorting by name')
+            for entry in sorted(self.dir_entries, key=lambda e: e.sort_key(sort), reverse=reverse):
+                yield entry
+            return
+
+        items = (
+            ((0 if _isdir(dirent, increments) else 1, os.path.join(self.path, filename)), filename, dirent, increments)
+            for filename, dirent, increments in self._iter_children())
+        if after is not None:
+            after = tuple(after)
+            if reverse:
+                items = (item for item in items if item[0] < after)
+            else:
+                items = (item for item in items if item[0] > after)
+        if limit is not None:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            items = select(limit, items, key=lambda item: item[0])
+        else:
+            items = sorted(items, key=lambda item: item[0], reverse=reverse)
+
+        entries = []
+        for key, filename, dirent, increments in items:
+            entry = DirEntry(self, filename, dirent is not None, increments, dirent)
+            entry._isdir = key[0] == 0
+            entries.append(entry)
+        # Lookup file size of deleted entries of the page at once.
+        for entry in entries:
+            entry._siblings = entries
+        for entry in entries:
+            yield entry
 
     @property
     def display_name(self):
         """Return the most human readable filename. Without quote."""
         if self.path == b'':
             return self._repo.display_name
-        value = self._repo.unquote(os.path.basename(self.path))
+        value = quoting.unquote(os.path.basename(self.path))
         return self._repo._decode(value)
 
     @property
@@ -333,16 +482,13 @@ class DirEntry(object):
             return self._isdir
         if self.exists:
             # If the entry exists, check if it's a directory
-            self._isdir = os.path.isdir(self.full_path)
+            if self._dirent is not None:
+                self._isdir = self._dirent.is_dir()
+            else:
+                self._isdir = os.path.isdir(self.full_path)
         else:
             # Check if increments is a directory
-            self._isdir = False
-            for increment in self._increments:
-                if increment.is_missing:
-                    # Ignore missing increment...
-                    continue
-                self._isdir = increment.isdir
-                break
+            self._isdir = _isdir(None, self._increments)
         return self._isdir
 
     @property
@@ -351,20 +497,50 @@ class DirEntry(object):
         if hasattr(self, '_file_size'):
             return self._file_size
         if self.exists:
-            self._file_size = os.lstat(self.full_path).st_size
-        else:
-            # The only viable place to get the filesize of a deleted entry
-            # it to get it from file_statistics
-            stats = self._repo.get_file_statistic(self.last_change_date)
-            if stats:
-                # File stats uses unquoted name.
-                unquote_path = self._repo.unquote(self.path)
-                self._file_size = stats.get_source_size(unquote_path)
+            if self._dirent is not None:
+                self._file_size = self._dirent.stat(follow_symlinks=False).st_size
             else:
-                logger.warning("cannot find file statistic [%s]", self.last_change_date)
-                self._file_size = 0
+                self._file_size = os.lstat(self.full_path).st_size
+        else:
+            # Get the filesize of a deleted entry from the backup metadata.
+            # Lookup the size of every deleted entries of the same directory
+            # at once.
+            entries = [
+                e for e in getattr(self, '_siblings', [self])
+                if not e.exists and not hasattr(e, '_file_size')]
+            DirEntry._load_deleted_file_sizes(self._repo, entries)
         return self._file_size
 
+    @staticmethod
+    def _load_deleted_file_sizes(repo, entries):
+        """
+        Get the file size of the deleted entries from the file tree index.
+        Fallback to file_statistics for the entries missing from the index.
+        e.g.: backups made without mirror_metadata.
+        """
+        # File tree uses unquoted name.
+        paths = repo.unquote_all([entry.path for entry in entries])
+        found = repo.file_tree.last_versions(paths)
+        missing = []
+        for path, entry in zip(paths, entries):
+            if path in found:
+                entry._file_size = found[path].size or 0
+            else:
+                missing.append(entry)
+        grouped = rdw_helpers.groupby(missing, lambda x: x.last_change_date)
+        for date, group in iteritems(grouped):
+            stats = repo.get_file_statistic(date) if date else None
+            if not stats:
+                logger.warning("cannot find file statistic [%s]", date)
+                for entry in group:
+                    entry._file_size = 0
+                continue
+            # File stats uses unquoted name.
+            paths = repo.unquote_all([entry.path for entry in group])
+            sizes = stats.get_source_sizes(paths)
+            for path, entry in zip(paths, group):
+                entry._file_size = sizes.get(path, 0)
+
     @property
     def change_dates(self):
         """
@@ -423,29 +599,75 @@ class DirEntry(object):
         """Return last change date or False."""
         return self.change_dates and self.change_dates[-1]
 
-    def restore(self, restore_as_of, kind):
+    def archive_name(self, kind):
+        """
+        Return a tuple (filename, kind) with a nice filename for the archive
+        or file to be created to restore this entry. Directories are restored
+        into an archive of the given kind (default to zip). Files are
+        restored as-is ('raw').
+        """
+        # TODO The current entry might be a directory, but it may have been a file.
+        if self.path == b"" or self.isdir:
+            kind = kind or 'zip'
+            return "%s.%s" % (self.display_name, kind), kind
+        return self.display_name, 'raw'
+
+    @property
+    def restore_path(self):
+        """
+        Return the location of this entry as expected by rdiff-backup to
+        restore it (without quote).
+        """
+        return os.path.join(self._repo.full_path, self._repo.unquote(self.path))
+
+    def restore(self, restore_as_of, kind, workers=1, level=None):
         """
         Restore the current directory entry into a fileobj containing the
         file content of the directory compressed into an archive.
+        `workers` define the number of threads used for compression and
+        `level` the compression level of tar.zst and tar.lz4.
         
         Return a filename and a fileobj.
         """
         assert restore_as_of, "restore_as_of must be defined"
 
-        # Define a nice filename for the archive or file to be created.
-        # TODO The current entry might be a directory, but it may have been a file.
-        if self.path == b"" or self.isdir:
-            kind = kind or 'zip'
-            filename = "%s.%s" % (self.display_name, kind)
-        else:
-            kind = 'raw'
-            filename = self.display_name
+        filename, kind = self.archive_name(kind)
+        if kind == 'raw':
+            # Try to restore the file without rdiff-backup.
+            fh = self.restore_file(restore_as_of)
+            if fh is not None:
+                return filename, fh
 
         # Restore data using a subprocess.
-        path = os.path.join(self._repo.full_path, self._repo.unquote(self.path))
-        fh = call_restore(path, restore_as_of, self._repo._encoding.name, kind)
+        fh = call_restore(self.restore_path, restore_as_of, self._repo._encoding.name, kind, workers, level)
         return filename, fh
 
+    def restore_file(self, restore_as_of):
+        """
+        Restore a single file from the mirror or by applying the increments
+        directly. Return a fileobj or None if rdiff-backup must be used.
+        """
+        # Files may be modified while a backup is running.
+        if self._repo.status[0] != 'ok':
+            return None
+        # Restore the state of the last backup at or before the given date.
+        backup_dates = [d.epoch() for d in self._repo.backup_dates]
+        index = bisect.bisect_right(backup_dates, restore_as_of)
+        if not index:
+            return None
+        restore_as_of = backup_dates[index - 1]
+        # Only the increments at or after the restore date are relevant.
+        increments = [
+            os.path.join(self._repo._increment_path, os.path.dirname(self.path), i.name)
+            for i in self._increments
+            if i.has_suffix and i.date.epoch() >= restore_as_of]
+        mirror = self.full_path if self.exists else None
+        try:
+            return restore_file(mirror, increments)
+        except Exception:
+            logger.warning('fail to restore [%r] without rdiff-backup', self.full_path, exc_info=1)
+            return None
+
 
 class HistoryEntry(object):
 
@@ -498,17 +720,26 @@ class IncrementEntry(object):
     repository. The base repository is provided in the default constructor
     and the date is provided using an error_log.* file"""
 
+    __slots__ = ('repo', 'name', 'date', 'filename', 'suffix', '_size')
+
     MISSING_SUFFIX = b".missing"
 
     SUFFIXES = [b".missing", b".snapshot.gz", b".snapshot",
                 b".diff.gz", b".data.gz", b".data", b".dir", b".diff"]
 
-    def __init__(self, parent, name):
+    # Match the suffix of an increment name in one pass. Each suffix has its
+    # own group to reuse the value from SUFFIXES.
+    _SUFFIX_RE = re.compile(
+        b'\\.(?:' + b'|'.join(b'(' + re.escape(x[1:]) + b')' for x in SUFFIXES) + b')$')
+
+    def __init__(self, parent, name, date=None, filename=None):
         """Default constructor for an increment entry. User must provide the
             repository directory and an entry name. The entry name correspond
-            to an error_log.* filename."""
+            to an error_log.* filename. The date and filename may be provided
+            if already known."""
         assert isinstance(parent, DirEntry) or isinstance(parent, RdiffRepo)
         assert isinstance(name, bytes)
+        assert date is None or isinstance(date, RdiffTime)
         # Keep reference to the current path.
         if isinstance(parent, RdiffRepo):
             self.repo = weakref.proxy(parent)
@@ -516,8 +747,16 @@ class IncrementEntry(object):
             self.repo = parent._repo
         # The given entry name may has quote character, replace them
         self.name = name
-        # Calculate the date of the increment.
-        self.date = self.repo._extract_date(self.name)
+        if date is None or filename is None:
+            parsed_filename, date_string, self.suffix = IncrementEntry._parse_name(name)
+            self.filename = filename or parsed_filename
+            # Calculate the date of the increment.
+            self.date = date or self.repo._parse_date(date_string)
+        else:
+            self.suffix = IncrementEntry._parse_suffix(name)
+            self.filename = filename
+            self.date = date
+        self._size = None
 
     def _open(self, mode='rb'):
         """Should be used to open the increment file. This method handle
@@ -534,17 +773,35 @@ class IncrementEntry(object):
             return b''
         return self._open().read()
 
-    @property
-    def filename(self):
-        filename = IncrementEntry._remove_suffix(self.name)
-        return filename.rsplit(b".", 1)[0]
+    @staticmethod
+    def _parse_name(name):
+        """
+        Split the given increment name into (filename, date string, suffix).
+        The suffix is empty if the name doesn't have one of `SUFFIXES`.
+        """
+        suffix = IncrementEntry._parse_suffix(name)
+        base = name[:len(name) - len(suffix)]
+        filename, sep, date_string = base.rpartition(b".")
+        if not sep:
+            return base, base, suffix
+        return filename, date_string, suffix
+
+    @staticmethod
+    def _parse_suffix(name):
+        """Return the suffix of the given increment name or an empty value."""
+        m = IncrementEntry._SUFFIX_RE.search(name)
+        if m:
+            return IncrementEntry.SUFFIXES[m.lastindex - 1]
+        return b''
+
+    @staticmethod
+    def _extract_filename(name):
+        """Return the filename without date and suffix."""
+        return IncrementEntry._parse_name(name)[0]
 
     @property
     def has_suffix(self):
-        for suffix in IncrementEntry.SUFFIXES:
-            if self.name.endswith(suffix):
-                return True
-        return False
+        return bool(self.suffix)
 
     @property
     def _is_compressed(self):
@@ -552,25 +809,24 @@ class IncrementEntry(object):
 
     @property
     def isdir(self):
-        return self.name.endswith(b".dir")
+        return self.suffix == b".dir"
 
     @property
     def is_missing(self):
         """Check if the curent entry is a missing increment."""
-        return self.name.endswith(self.MISSING_SUFFIX)
+        return self.suffix == self.MISSING_SUFFIX
 
     @property
     def is_snapshot(self):
         """Check if the current entry is a snapshot increment."""
-        return (self.name.endswith(b".snapshot.gz") or
-                self.name.endswith(b".snapshot"))
+        return self.suffix == b".snapshot.gz" or self.suffix == b".snapshot"
 
     @staticmethod
     def _remove_suffix(filename):
         """ returns None if there was no suffix to remove. """
-        for suffix in IncrementEntry.SUFFIXES:
-            if filename.endswith(suffix):
-                return filename[:-len(suffix)]
+        m = IncrementEntry._SUFFIX_RE.search(filename)
+        if m:
+            return filename[:m.start()]
         return filename
 
     @property
@@ -578,6 +834,9 @@ class IncrementEntry(object):
         """
         Check if the increment entry is empty.
         """
+        # Use the size from metadata index if available.
+        if self._size is not None:
+            return self._size == 0
         fn = os.path.join(self.repo._data_path, self.name)
         return os.path.getsize(fn) == 0
 
@@ -595,8 +854,8 @@ class FileStatisticsEntry(IncrementEntry):
     data.
     """
 
-    def __init__(self, repo_path, name):
-        IncrementEntry.__init__(self, repo_path, name)
+    def __init__(self, repo_path, name, date=None):
+        IncrementEntry.__init__(self, repo_path, name, date)
         # check to ensure we have a file_statistics entry
         assert self.name.startswith(b"file_statistics.")
         assert self.name.endswith(b".data") or self.name.endswith(b".data.gz")
@@ -619,24 +878,126 @@ class FileStatisticsEntry(IncrementEntry):
             logger.warning("source size not found for [%r]", path, exc_info=1)
             return 0
 
+    def get_source_sizes(self, paths):
+        """
+        Return a dict of {path: SourceSize} for the given files. Files not
+        found are omitted. This is faster than calling `get_source_size()`
+        for each file.
+        """
+        sizes = {}
+        for path, data in iteritems(self._search_all(paths)):
+            try:
+                sizes[path] = int(data["source_size"])
+            except ValueError:
+                logger.warning("invalid source size for [%r]", path)
+        return sizes
+
     def _search(self, path):
         """
         This function search for a file entry in the file_statistics compress
-        file. Since python gzip.open() seams to be 2 time slower, we directly use
-        zlib library on python2.
+        file. Raise KeyError if the file is not found.
         """
-        logger.debug("read file_statistics [%r]", self.name)
+        return self._search_all([path])[path]
 
-        path += b' '
+    def _search_all(self, paths):
+        """
+        Search for multiple file entries. Return a dict of {path: data}.
 
+        When the metadata index is enabled, the file_statistics is parsed once
+        into a SQLite database to lookup entries. Otherwise, the file is read
+        once to find all the entries.
+        """
+        paths = set(paths)
+        if not paths:
+            return {}
+        index_file = self._index_file
+        if index_file:
+            try:
+                return self._search_index(index_file, paths)
+            except Exception:
+                logger.warning("fail to use file_statistics index [%r]", index_file, exc_info=1)
+
+        logger.debug("read file_statistics [%r]", self.name)
+        found = {}
         with self._open() as f:
             for line in f:
-                if not line.startswith(path):
-                    continue
-                break
+                data = FileStatisticsEntry._parse_line(line)
+                if data and data[0] in paths:
+                    found[data[0]] = FileStatisticsEntry._to_dict(data)
+                    if len(found) == len(paths):
+                        break
+        return found
+
+    @property
+    def _index_file(self):
+        """Return the location of the index for this file_statistics or None."""
+        if not self.repo._index_dir:
+            return None
+        name = IncrementEntry._remove_suffix(self.name)
+        return os.path.join(self.repo._index_dir, self.repo._index_key + b'.' + name + b'.db')
+
+    def _search_index(self, index_file, paths):
+        """
+        Lookup the given paths in the index. Create the index if required.
+        """
+        if not os.path.isfile(index_file):
+            self._create_index(index_file)
+        found = {}
+        conn = sqlite3.connect(index_file)
+        try:
+            paths = list(paths)
+            # Query by chunk to stay below SQLite variables limit.
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                query = 'SELECT Path, Changed, SourceSize, MirrorSize, IncrementSize FROM stats WHERE Path IN (%s)' % ','.join('?' * len(chunk))
+                for row in conn.execute(query, [sqlite3.Binary(p) for p in chunk]):
+                    found[bytes(row[0])] = FileStatisticsEntry._to_dict([bytes(row[0])] + [bytes(v) for v in row[1:]])
+        finally:
+            conn.close()
+        return found
+
+    def _create_index(self, index_file):
+        """
+        Parse the file_statistics into a SQLite database.
+        """
+        logger.info("create file_statistics index [%r]", index_file)
+        index_dir = os.path.dirname(index_file)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        # Write into a temporary file to avoid reading a partial index.
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(index_file) + b'.', suffix=b'.tmp', dir=index_dir)
+        os.close(fd)
+        conn = sqlite3.connect(tmp_file)
+        try:
+            conn.execute('CREATE TABLE stats (Path blob primary key, Changed blob, SourceSize blob, MirrorSize blob, IncrementSize blob) WITHOUT ROWID')
+            with self._open() as f:
+                rows = (FileStatisticsEntry._parse_line(line) for line in f)
+                conn.executemany(
+                    'INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?)',
+                    ([sqlite3.Binary(v) for v in data] for data in rows if data))
+            conn.commit()
+        except Exception:
+            conn.close()
+            os.remove(tmp_file)
+            raise
+        conn.close()
+        os.rename(tmp_file, index_file)
 
-        # Split the line into array
+    @staticmethod
+    def _parse_line(line):
+        """
+        Split a line of file_statistics into [path, changed, source_size,
+        mirror_size, increment_size]. Return None for comments.
+        """
+        if line.startswith(b'#'):
+            return None
         data = line.rstrip(b'\r\n').rsplit(b' ', 4)
+        if len(data) != 5:
+            return None
+        return data
+
+    @staticmethod
+    def _to_dict(data):
         # From array create an entry
         return {
             'changed': data[1],
@@ -645,15 +1006,200 @@ class FileStatisticsEntry(IncrementEntry):
             'increment_size': data[4]}
 
 
+# Attributes of the session statistics.
+SESSION_STATISTICS_ATTRS = [
+    'starttime', 'endtime', 'elapsedtime', 'sourcefiles', 'sourcefilesize',
+    'mirrorfiles', 'mirrorfilesize', 'newfiles', 'newfilesize', 'deletedfiles',
+    'deletedfilesize', 'changedfiles', 'changedsourcesize', 'changedmirrorsize',
+    'incrementfiles', 'incrementfilesize', 'totaldestinationsizechange', 'errors']
+
+# Attributes of the session statistics with a decimal value.
+SESSION_STATISTICS_FLOATS = ['starttime', 'endtime', 'elapsedtime']
+
+
+class SessionStatisticsColumns(object):
+    """
+    Columnar cache of the session statistics of a repository. The date and
+    each attribute are kept in an array ordered by date. New sessions are
+    appended to the arrays when updated.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # Create new arrays to not affect the rows being read.
+        self.dates = array(str('d'))
+        self.columns = OrderedDict([(attr, array(str('d'))) for attr in SESSION_STATISTICS_ATTRS])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def update(self, session_statistics):
+        """
+        Append the sessions not already in cache. The cache is built again
+        if sessions were removed.
+        """
+        with self._lock:
+            entries = list(session_statistics.values())
+            count = len(self.dates)
+            if count > len(entries) or (count and self.dates[count - 1] != entries[count - 1].date.epoch()):
+                logger.debug("rebuild session statistics cache")
+                self._clear()
+                count = 0
+            for entry in entries[count:]:
+                self.dates.append(entry.date.epoch())
+                for attr, column in self.columns.items():
+                    try:
+                        column.append(getattr(entry, attr))
+                    except (KeyError, AttributeError):
+                        column.append(0)
+
+    def _range(self, start, end):
+        """
+        Return the dates, the columns and the range of indexes of the
+        sessions between `start` and `end` epoch (inclusive).
+        """
+        with self._lock:
+            dates = self.dates
+            columns = list(self.columns.values())
+            lo = bisect.bisect_left(dates, start) if start is not None else 0
+            hi = bisect.bisect_right(dates, end) if end is not None else len(dates)
+        return dates, columns, lo, hi
+
+    def rows(self, start=None, end=None, points=None, metric=None):
+        """
+        Return a tuple (date, values) for each session between `start` and
+        `end` epoch (inclusive). When `points` is defined, return at most
+        `points` sessions evenly distributed, including the last one. When
+        `metric` is also defined, the sessions are selected using the
+        Largest-Triangle-Three-Buckets algorithm to preserve the shape of
+        this metric.
+        """
+        dates, columns, lo, hi = self._range(start, end)
+        if points and points > 0 and hi - lo > points:
+            if metric:
+                ys = columns[SESSION_STATISTICS_ATTRS.index(metric)]
+                indexes = _lttb(dates, ys, lo, hi, points)
+            else:
+                # Keep the last session when downsampling.
+                step = -(-(hi - lo) // points)
+                indexes = list(range(hi - 1, lo - 1, -step))
+                indexes.reverse()
+        else:
+            indexes = range(lo, hi)
+        for i in indexes:
+            yield dates[i], [column[i] for column in columns]
+
+    def aggregate(self, group, func='sum', start=None, end=None, tzoffset=0):
+        """
+        Return a tuple (date, values) for each day, week, month or year
+        with sessions between `start` and `end` epoch (inclusive). The values
+        are aggregated with `func` (sum, min, max or avg). The date is the
+        beginning of the period in the timezone defined by `tzoffset`, the
+        difference in minutes between UTC and local time.
+        """
+        assert group in SESSION_STATISTICS_GROUPS
+        assert func in SESSION_STATISTICS_FUNCS
+        dates, columns, lo, hi = self._range(start, end)
+        bucket = None
+        i = lo
+        while i < hi:
+            # Find the sessions of the period.
+            bucket = _period_start(dates[i], group, tzoffset)
+            next_bucket = _period_start(dates[i], group, tzoffset, 1)
+            j = bisect.bisect_left(dates, next_bucket, i, hi)
+            values = []
+            for column in columns:
+                data = column[i:j]
+                if func == 'sum':
+                    values.append(sum(data))
+                elif func == 'min':
+                    values.append(min(data))
+                elif func == 'max':
+                    values.append(max(data))
+                else:
+                    values.append(sum(data) / len(data))
+            yield bucket, values
+            i = j
+
+
+# Periods used to aggregate the session statistics.
+SESSION_STATISTICS_GROUPS = ['day', 'week', 'month', 'year']
+
+# Functions used to aggregate the session statistics.
+SESSION_STATISTICS_FUNCS = ['sum', 'min', 'max', 'avg']
+
+
+def _period_start(epoch, group, tzoffset=0, count=0):
+    """
+    Return the epoch of the beginning of the day, week (starting Sunday),
+    month or year of the given epoch in the timezone `tzoffset` (minutes
+    between UTC and local time). Use `count` to move to following periods.
+    """
+    local = datetime.utcfromtimestamp(epoch - tzoffset * 60)
+    d = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if group == 'day':
+        d += timedelta(days=count)
+    elif group == 'week':
+        d -= timedelta(days=(d.weekday() + 1) % 7)
+        d += timedelta(days=7 * count)
+    elif group == 'month':
+        month = d.month - 1 + count
+        d = d.replace(year=d.year + month // 12, month=month % 12 + 1, day=1)
+    else:
+        d = d.replace(year=d.year + count, month=1, day=1)
+    return calendar.timegm(d.timetuple()) + tzoffset * 60
+
+
+def _lttb(xs, ys, lo, hi, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Return the indexes of the
+    `points` values to keep between `lo` and `hi`, including the first and
+    the last ones.
+    """
+    if points < 3:
+        return [hi - 1] if points == 1 else [lo, hi - 1]
+    indexes = [lo]
+    size = float(hi - lo - 2) / (points - 2)
+    a = lo
+    for b in range(points - 2):
+        start = lo + 1 + int(b * size)
+        end = lo + 1 + int((b + 1) * size)
+        # Average point of the next bucket.
+        next_start = end
+        next_end = min(lo + 1 + int((b + 2) * size), hi - 1) if b < points - 3 else hi
+        next_end = max(next_end, next_start + 1)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+        # Keep the point forming the largest triangle.
+        best = start
+        best_area = -1
+        for i in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[i] - ys[a]) - (xs[a] - xs[i]) * (avg_y - ys[a]))
+            if area > best_area:
+                best = i
+                best_area = area
+        indexes.append(best)
+        a = best
+    indexes.append(hi - 1)
+    return indexes
+
+
 class SessionStatisticsEntry(IncrementEntry):
 
     """Represent a single session_statistics."""
 
-    def __init__(self, repo_path, name):
+    def __init__(self, repo_path, name, date=None, stats=None):
         # check to ensure we have a file_statistics entry
         assert name.startswith(b"session_statistics")
         assert name.endswith(b".data") or name.endswith(b".data.gz")
-        IncrementEntry.__init__(self, repo_path, name)
+        IncrementEntry.__init__(self, repo_path, name, date)
+        # Use the statistics from metadata index if available.
+        if stats:
+            self.__dict__.update(stats)
 
     def _load(self):
         """This method is used to read the session_statistics and create the
@@ -663,21 +1209,8 @@ class SessionStatisticsEntry(IncrementEntry):
         the backup. This class provide a simple and easy way to access this
         data."""
 
-        with self._open('r') as f:
-            for line in f.readlines():
-                # Skip comments
-                if line.startswith("#"):
-                    continue
-                # Read the line into array
-                line = line.rstrip('\r\n')
-                data_line = line.split(" ", 2)
-                # Read line into tuple
-                (key, value) = tuple(data_line)[0:2]
-                if '.' in value:
-                    value = float(value)
-                else:
-                    value = int(value)
-                setattr(self, key.lower(), value)
+        with self._open() as f:
+            self.__dict__.update(parse_session_statistics(f))
 
     def __getattr__(self, name):
         """
@@ -696,7 +1229,7 @@ class RdiffRepo(object):
 
     """Represent one rdiff-backup repository."""
 
-    def __init__(self, user_root, path, encoding):
+    def __init__(self, user_root, path, encoding, index_dir=None):
         if isinstance(user_root, str):
             user_root = encodefilename(user_root)
         if isinstance(path, str):
@@ -714,17 +1247,41 @@ class RdiffRepo(object):
         assert isinstance(self._data_path, bytes)
         self._increment_path = os.path.join(self._data_path, INCREMENTS)
 
+        # Index of metadata files. Persisted in `index_dir` if defined.
+        index_file = None
+        if isinstance(index_dir, str):
+            index_dir = encodefilename(index_dir)
+        self._index_dir = index_dir
+        self._index_key = hashlib.sha1(self.full_path).hexdigest().encode('ascii')
+        if index_dir:
+            index_file = os.path.join(index_dir, self._index_key + b'.db')
+        self._index = MetadataIndex(self._data_path, index_file, self._index_date)
+        # Content of the increments directories.
+        increments_file = None
+        if index_dir:
+            increments_file = os.path.join(index_dir, self._index_key + b'.increments.db')
+        self._increments = IncrementsIndex(self._increment_path, increments_file, self._parse_increment_names)
+        # File tree of each backup read from mirror_metadata.
+        tree_file = None
+        if index_dir:
+            tree_file = os.path.join(index_dir, self._index_key + b'.tree.db')
+        self._tree = FileTreeIndex(self._data_path, tree_file)
+
+        # Lazily computed data. May be shared between instances of the same
+        # repository. See `share_state()`.
+        self._state = {}
+
     @property
     def backup_dates(self):
         """Return a list of dates when backup was executed. This list is
         sorted from old to new (ascending order). To identify dates,
         'mirror_metadata' file located in rdiff-backup-data are used."""
-        if not hasattr(self, '_backup_dates_data'):
+        if 'backup_dates' not in self._state:
             logger.debug("get backup dates for [%r]", self.full_path)
-            self._backup_dates_data = sorted([
-                self._extract_date(x)
-                for x in self._get_entries(b'mirror_metadata')])
-        return self._backup_dates_data
+            self._state['backup_dates'] = sorted([
+                self._record_date(x)
+                for x in self._get_records(b'mirror_metadata')])
+        return self._state['backup_dates']
 
     @property
     def _current_mirrors(self):
@@ -755,8 +1312,8 @@ class RdiffRepo(object):
         """Return the most human representation of the repository name."""
         # NOTE : path may be empty, so return a simple string.
         if self.path:
-            return self._decode(self.unquote(self.path))
-        return self._decode(self.unquote(os.path.basename(self.full_path)))
+            return self._decode(quoting.unquote(self.path))
+        return self._decode(quoting.unquote(os.path.basename(self.full_path)))
 
     def _decode(self, value, errors='replace'):
         """Used to decode a repository path into unicode."""
@@ -766,53 +1323,99 @@ class RdiffRepo(object):
     @property
     def _error_logs(self):
         """Return dict of {date: IncrementEntry} to represent each file statistics."""
-        if not hasattr(self, '_error_logs_data'):
-            self._error_logs_data = {
-                self._extract_date(x): IncrementEntry(self, x)
-                for x in self._get_entries(b'error_log')}
-        return self._error_logs_data
+        if 'error_logs' not in self._state:
+            data = {}
+            for x in self._get_records(b'error_log'):
+                entry = IncrementEntry(self, x.name, self._record_date(x))
+                entry._size = x.size
+                data[entry.date] = entry
+            self._state['error_logs'] = data
+        return self._state['error_logs']
 
     def _extract_date(self, filename):
         """
         Extract date from rdiff-backup filenames.
         """
-        # Remove suffix from filename
-        filename = IncrementEntry._remove_suffix(filename)
-        # Remove prefix from filename
-        date_string = filename.rsplit(b".", 1)[-1]
+        return self._parse_date(IncrementEntry._parse_name(filename)[1])
+
+    def _extract_dates(self, filenames):
+        """
+        Extract the dates of many rdiff-backup filenames at once.
+        """
+        return self._parse_dates([IncrementEntry._parse_name(f)[1] for f in filenames])
+
+    def _parse_date(self, date_string):
+        """
+        Parse the quoted date string of an rdiff-backup filename.
+        """
         # Unquote string
         date_string = self.unquote(date_string)
         try:
-            return RdiffTime(date_string.decode())
+            return RdiffTime.parse(date_string.decode())
         except:
             logger.warn('fail to parse date [%r]', date_string, exc_info=1)
             return None
 
+    def _index_date(self, filename):
+        """
+        Used by metadata index to extract date from filename.
+        """
+        date = self._extract_date(filename)
+        if date is None:
+            return None
+        return (date._time_seconds, date._tz_offset)
+
+    def _parse_dates(self, date_strings):
+        """
+        Parse a list of quoted date strings. Each distinct value is parsed
+        once.
+        """
+        parsed = {}
+        dates = []
+        for date_string in date_strings:
+            if date_string not in parsed:
+                parsed[date_string] = self._parse_date(date_string)
+            dates.append(parsed[date_string])
+        return dates
+
+    def _parse_increment_names(self, names):
+        """
+        Used by increments index to extract the filename and the date from
+        a list of increment names.
+        """
+        parsed = [IncrementEntry._parse_name(name) for name in names]
+        dates = self._parse_dates([x[1] for x in parsed])
+        return [
+            (x[0], date._time_seconds, date._tz_offset) if date is not None else (x[0], None, None)
+            for x, date in zip(parsed, dates)]
+
+    def _record_date(self, record):
+        """
+        Return the date of the given metadata index record.
+        """
+        return RdiffTime(record.time_seconds, record.tz_offset)
+
     @property
     def _file_statistics(self):
         """Return dict of {date: filename} to represent each file statistics."""
-        if not hasattr(self, '_file_statistics_data'):
-            self._file_statistics_data = {
-                self._extract_date(x): x
-                for x in self._get_entries(b'file_statistics')}
-        return self._file_statistics_data
+        if 'file_statistics' not in self._state:
+            self._state['file_statistics'] = {
+                self._record_date(x): x.name
+                for x in self._get_records(b'file_statistics')}
+        return self._state['file_statistics']
 
     def _get_entries(self, prefix):
-        if not hasattr(self, '_entries_data'):
-            self._entries_data = {}
-            try:
-                entries = os.listdir(self._data_path)
-            except:
-                entries = []
-            for e in entries:
-                try:
-                    key = e[:e.index(b'.')]
-                    if key in [b'file_statistics', b'session_statistics', b'current_mirror', b'mirror_metadata', b'error_log']:
-                        l = self._entries_data.setdefault(key, [])
-                        l.append(e)
-                except:
-                    pass
-        return self._entries_data.get(prefix, [])
+        """Return the filenames in rdiff-backup-data with the given prefix."""
+        return [x.name for x in self._get_records(prefix)]
+
+    def _get_records(self, prefix):
+        """
+        Return the metadata index records with the given prefix. Records
+        without a valid date are ignored.
+        """
+        if 'entries' not in self._state:
+            self._state['entries'] = self._index.records()
+        return [x for x in self._state['entries'].get(prefix, []) if x.time_seconds is not None]
 
     def get_file_statistic(self, date):
         """Return the file statistic for the given date.
@@ -826,7 +1429,7 @@ class RdiffRepo(object):
         try:
             value = self._file_statistics[date]
             if not isinstance(value, FileStatisticsEntry):
-                entry = FileStatisticsEntry(self, value)
+                entry = FileStatisticsEntry(self, value, date)
                 self._file_statistics[date] = entry
                 return entry
             return self._file_statistics[date]
@@ -871,24 +1474,37 @@ class RdiffRepo(object):
 
     def _get_increment_entries(self, path):
         """
-        Get the increment entries for the current path. This path is located
-        under rdiff-backup-data/increments.
+        Get the increment entries for the current path grouped by filename.
+        This path is located under rdiff-backup-data/increments.
         """
-        # Compute increment directory location.
-        p = os.path.join(self._increment_path, path.strip(b'/'))
-        assert p.startswith(self.full_path)
+        # Share the dates between the entries.
+        dates = {}
+        return dict([
+            (filename, self._increment_entries(filename, increments, dates))
+            for filename, increments in iteritems(self._list_increments(path))])
 
-        # Check if increment directory exists. The path may not exists if
-        # the folder always exists and never changed.
-        if not os.access(p, os.F_OK):
-            return []
+    def _get_file_increment_entries(self, path, filename):
+        """
+        Get the increment entries of a single file of the given path.
+        """
+        return self._increment_entries(filename, self._list_increments(path).get(filename, []))
 
-        # List content of the increment directory.
-        # Ignore sub-directories.
-        entries = [
-            IncrementEntry(self, x)
-            for x in os.listdir(p)
-            if not os.path.isdir(os.path.join(p, x))]
+    def _list_increments(self, path):
+        # Compute increment directory location.
+        path = path.strip(b'/')
+        assert os.path.join(self._increment_path, path).startswith(self.full_path)
+        return self._increments.get(path)
+
+    def _increment_entries(self, filename, increments, dates=None):
+        dates = {} if dates is None else dates
+        entries = []
+        for name, time_seconds, tz_offset in increments:
+            date = None
+            if time_seconds is not None:
+                date = dates.get((time_seconds, tz_offset))
+                if date is None:
+                    date = dates[(time_seconds, tz_offset)] = RdiffTime(time_seconds, tz_offset)
+            entries.append(IncrementEntry(self, name, date, filename))
         return entries
 
     def get_path(self, path):
@@ -915,8 +1531,7 @@ class RdiffRepo(object):
         # Check if path exists or has increment. If not raise an exception.
         exists = os.path.exists(p)
         fn = os.path.basename(p)
-        increments = [e for e in self._get_increment_entries(os.path.dirname(path))
-                      if e.filename == fn]
+        increments = self._get_file_increment_entries(os.path.dirname(path), fn)
         if not exists and not increments:
             logger.error("path [%r] doesn't exists", path)
             raise DoesNotExistError(path)
@@ -934,21 +1549,72 @@ class RdiffRepo(object):
     def remove_older(self, remove_older_than):
         logger.info("execute rdiff-backup --force --remove-older-than=%sD %r", remove_older_than, self.full_path)
         subprocess.call([b'rdiff-backup', b'--force', b'--remove-older-than=' + str(remove_older_than).encode(encoding='latin1') + b'D', self.full_path])
+        self._prune_file_statistics_index()
+
+    def _prune_file_statistics_index(self):
+        """
+        Delete the file_statistics indexes of the increments removed from
+        the repository.
+        """
+        if not self._index_dir or not os.path.isdir(self._index_dir):
+            return
+        prefix = self._index_key + b'.file_statistics.'
+        records = self._index.records().get(b'file_statistics', [])
+        expected = set(
+            self._index_key + b'.' + IncrementEntry._remove_suffix(x.name) + b'.db'
+            for x in records)
+        for name in os.listdir(self._index_dir):
+            if name.startswith(prefix) and name.endswith(b'.db') and name not in expected:
+                logger.debug("delete file_statistics index [%r]", name)
+                try:
+                    os.remove(os.path.join(self._index_dir, name))
+                except OSError:
+                    logger.warning("fail to delete file_statistics index [%r]", name, exc_info=1)
 
     @property
     def status(self):
         """Check if a backup is in progress for the current repo."""
-        if hasattr(self, '_status'):
-            return self._status
+        if 'status' not in self._state:
+            self.refresh_status()
+        return self._status_message(self._state['status'])
+
+    @staticmethod
+    def _status_message(status):
+        """Return the status code with its message."""
+        # Translate the message on every call since the status may be shared.
+        if status == 'failed':
+            return (status, _('The repository cannot be found or is badly damaged.'))
+        elif status == 'in_progress':
+            return (status, _('A backup is currently in progress to this repository.'))
+        elif status == 'interrupted':
+            return (status, _('The previous backup seams to have failed.'))
+        return (status, '')
+
+    @property
+    def status_time(self):
+        """Return the time when the status was computed or None."""
+        return self._state.get('status_time')
+
+    def refresh_status(self):
+        """
+        Compute the status of the repository and keep it with the shared
+        data. Return the status code.
+        """
+        status = self._get_status()
+        self._state['status'] = status
+        self._state['status_time'] = time.time()
+        return status
+
+    def _get_status(self):
+        """Compute the status of the repository. Return the status code."""
 
         # Check if the repository exists.
         # Make sure repoRoot is a valid rdiff-backup repository
         if (not os.access(self._data_path, os.F_OK) or
                 not os.path.isdir(self._data_path)):
-            self._status = ('failed', _('The repository cannot be found or is badly damaged.'))
-            return self._status
+            return 'failed'
 
-        pid_re = re.compile(b"^PID\s*([0-9]+)", re.I | re.M)
+        pid_re = re.compile(br"^PID\s*([0-9]+)", re.I | re.M)
 
         def extract_pid(current_mirror):
             """Return process ID from a current mirror marker, if any"""
@@ -965,47 +1631,106 @@ class RdiffRepo(object):
             try:
                 p = psutil.Process(pid)
                 if any('rdiff-backup' in c for c in p.cmdline()):
-                    self._status = ('in_progress', _('A backup is currently in progress to this repository.'))
-                    return self._status
+                    return 'in_progress'
             except psutil.NoSuchProcess:
                 logger.debug('pid [%s] does not exists', pid)
                 pass
         # If multiple current_mirror file exists and none of them are associated to a PID, this mean the last backup was interrupted.
         # Also, if the last backup date is undefined, this mean the first initial backup was interrupted.
         if len(self._current_mirrors) > 1 or not self.last_backup_date:
-            self._status = ('interrupted', _('The previous backup seams to have failed.'))
-            return self._status
+            return 'interrupted'
 
-        self._status = ('ok', '')
-        return self._status
+        return 'ok'
 
     @property
     def session_statistics(self):
         """Return list of IncrementEntry to represent each sessions
         statistics."""
-        if not hasattr(self, '_session_statistics_data'):
+        if 'session_statistics' not in self._state:
             data = (
-                SessionStatisticsEntry(self, x)
-                for x in sorted(self._get_entries(b'session_statistics')))
-            self._session_statistics_data = OrderedDict([(x.date, x) for x in data])
-        return self._session_statistics_data
+                SessionStatisticsEntry(self, x.name, self._record_date(x), x.stats)
+                for x in sorted(self._get_records(b'session_statistics')))
+            self._state['session_statistics'] = OrderedDict([(x.date, x) for x in data])
+        return self._state['session_statistics']
 
-    def unquote(self, name):
-        """Remove quote from the given name."""
-        assert isinstance(name, bytes)
+    @property
+    def session_statistics_columns(self):
+        """Return the columnar cache of the session statistics."""
+        columns = self._state.get('session_columns')
+        if columns is None:
+            columns = self._state['session_columns'] = SessionStatisticsColumns()
+        # Update the cache once when rdiff-backup-data is modified.
+        if not self._state.get('session_columns_updated'):
+            columns.update(self.session_statistics)
+            self._state['session_columns_updated'] = True
+        return columns
 
-        # This function just gives back the original text if it can decode it
-        def unquoted_char(match):
-            """For each ;000 return the corresponding byte."""
-            if not len(match.group()) == 4:
-                return match.group
+    @property
+    def file_tree(self):
+        """
+        Return the index of the file tree of each backup. The paths are
+        unquoted and the dates are seconds since epoch.
+        """
+        # Index the new backups once when rdiff-backup-data is modified.
+        if not self._state.get('tree_updated'):
+            self._tree.update([
+                (self._record_date(x).epoch(), x.name)
+                for x in self._get_records(b'mirror_metadata') if x.complete])
+            self._state['tree_updated'] = True
+        return self._tree
+
+    def share_state(self, cache, key, force=False, generation=None):
+        """
+        Share the lazily computed data (backup dates, metadata entries,
+        status, error logs, file and session statistics) with other
+        instances of the same repository using the given
+        `cache`. The data is discarded when rdiff-backup-data is modified,
+        except the data updated incrementally (metadata index, session
+        statistics cache, increments, file tree). Use `force` to discard the
+        data even if rdiff-backup-data doesn't look modified. When given, the
+        data is also discarded if `generation` differs from the one of the
+        shared data.
+        """
+        try:
+            mtime = os.stat(self._data_path).st_mtime
+        except OSError:
+            mtime = None
+        state = cache.get(key)
+        if state is None or state.get('data_path') != self._data_path:
+            state = {'mtime': mtime, 'data_path': self._data_path, 'generation': generation, 'index': self._index, 'increments': self._increments, 'tree': self._tree}
+            cache[key] = state
+        elif force or state.get('mtime') != mtime or (generation is not None and state.get('generation') != generation):
+            state = dict(
+                [(k, state[k]) for k in ['index', 'increments', 'session_columns', 'tree'] if k in state],
+                mtime=mtime, data_path=self._data_path, generation=generation)
+            cache[key] = state
+        self._state = state
+        self._index = state['index']
+        self._increments = state['increments']
+        self._tree = state['tree']
+
+    @property
+    def _chars_to_quote(self):
+        """Return the characters quoted by rdiff-backup in this repository."""
+        if 'chars_to_quote' not in self._state:
             try:
-                return bytes([int(match.group()[1:])])
-            except:
-                return match.group
+                with open(os.path.join(self._data_path, b'chars_to_quote'), 'rb') as f:
+                    self._state['chars_to_quote'] = f.read().strip()
+            except IOError:
+                self._state['chars_to_quote'] = b''
+        return self._state['chars_to_quote']
+
+    def quote(self, name):
+        """Quote the given name as rdiff-backup does for this repository."""
+        return quoting.quote(name, self._chars_to_quote)
+
+    def unquote(self, name):
+        """Remove quote from the given name."""
+        return quoting.unquote(name)
 
-        # Remove quote using regex
-        return re.sub(b";[0-9]{3}", unquoted_char, name, re.S)
+    def unquote_all(self, names):
+        """Remove quote from a list of names."""
+        return quoting.unquote_all(names)
 
     def __str__(self):
         return "%r" % (self.full_path,)
@@ -0,0 +1,422 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Index of the metadata files stored in `rdiff-backup-data`.
+
+On repositories with years of backups, `rdiff-backup-data` contains tens of
+thousands of files. Instead of listing and parsing them for every request,
+this module keep a record of each relevant file (date, size and session
+statistics) in a small SQLite database. The index is only refreshed when the
+modification time of `rdiff-backup-data` changes and only new files are
+parsed.
+
+The content of the increments directories is also kept by directory to
+avoid listing directories with thousands of increments on every request.
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from rdiffweb.core.rdw_helpers import LRUCache
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python 2 backport.
+        from scandir import scandir  # @UnresolvedImport
+    except ImportError:
+        scandir = None
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Prefixes of the files to be indexed.
+PREFIXES = [b'current_mirror', b'error_log', b'file_statistics', b'mirror_metadata', b'session_statistics']
+
+# Increment this value when the structure of the index changes.
+_INDEX_VERSION = 1
+
+# Number of directories of increments kept in memory by repository.
+_INCREMENTS_CACHE_SIZE = 64
+
+# Minimum number of increments in a directory to be persisted.
+_INCREMENTS_PERSIST_MIN = 1000
+
+IndexRecord = namedtuple('IndexRecord', ['name', 'time_seconds', 'tz_offset', 'size', 'stats', 'complete'])
+
+
+def parse_session_statistics(lines):
+    """
+    Parse the content of a session_statistics file. Return a dict of
+    lowercase key to int or float value.
+    """
+    stats = {}
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('latin1')
+        # Skip comments
+        if line.startswith("#"):
+            continue
+        # Read the line into array
+        data_line = line.rstrip('\r\n').split(" ", 2)
+        if len(data_line) < 2:
+            continue
+        key, value = data_line[0:2]
+        if '.' in value:
+            value = float(value)
+        else:
+            value = int(value)
+        stats[key.lower()] = value
+    return stats
+
+
+def _prefix(name):
+    """Return the prefix of the given metadata filename or None."""
+    prefix = name.split(b'.', 1)[0]
+    if prefix in PREFIXES:
+        return prefix
+    return None
+
+
+class MetadataIndex(object):
+    """
+    Keep track of the metadata files of a single repository.
+
+    `data_path` is the location of `rdiff-backup-data`. `index_file` is the
+    location of the SQLite database used to persist the index. When
+    `index_file` is None, the index is only kept in memory. `extract_date`
+    is a function returning a tuple (time_seconds, tz_offset) from a filename.
+    """
+
+    def __init__(self, data_path, index_file, extract_date):
+        assert isinstance(data_path, bytes)
+        assert extract_date
+        self._data_path = data_path
+        self._index_file = index_file
+        self._extract_date = extract_date
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._known = None
+        self._records = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self._index_file)
+        conn.isolation_level = None
+        return conn
+
+    def _create_tables(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == _INDEX_VERSION:
+            return
+        conn.execute('DROP TABLE IF EXISTS entries')
+        conn.execute('DROP TABLE IF EXISTS meta')
+        conn.execute("""CREATE TABLE entries (
+Name blob primary key,
+TimeSeconds integer,
+TzOffset integer,
+Size integer,
+Stats text,
+Complete tinyint NOT NULL DEFAULT 0)""")
+        conn.execute("CREATE TABLE meta (Key varchar(50) primary key, Value text)")
+        conn.execute('PRAGMA user_version = %d' % _INDEX_VERSION)
+
+    def _get_mtime(self):
+        """Return the modification time of rdiff-backup-data or None."""
+        try:
+            st = os.stat(self._data_path)
+        except OSError:
+            return None
+        return getattr(st, 'st_mtime_ns', st.st_mtime)
+
+    def _load(self):
+        """
+        Read the persisted index. Return a tuple (mtime, records) or
+        (None, {}) if the index is not available.
+        """
+        if not self._index_file or not os.path.isfile(self._index_file):
+            return None, {}
+        try:
+            conn = self._connect()
+            try:
+                self._create_tables(conn)
+                row = conn.execute("SELECT Value FROM meta WHERE Key = 'mtime'").fetchone()
+                mtime = json.loads(row[0]) if row else None
+                records = {}
+                for row in conn.execute('SELECT Name, TimeSeconds, TzOffset, Size, Stats, Complete FROM entries'):
+                    name = bytes(row[0])
+                    records[name] = IndexRecord(
+                        name, row[1], row[2], row[3],
+                        json.loads(row[4]) if row[4] else None,
+                        bool(row[5]))
+                return mtime, records
+            finally:
+                conn.close()
+        except Exception:
+            logger.warning('fail to read metadata index [%s]', self._index_file, exc_info=1)
+            return None, {}
+
+    def _save(self, mtime, records, removed, updated):
+        """
+        Persist the modification to the index.
+        """
+        if not self._index_file:
+            return
+        try:
+            index_dir = os.path.dirname(self._index_file)
+            if index_dir and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            conn = self._connect()
+            try:
+                self._create_tables(conn)
+                conn.execute('BEGIN TRANSACTION')
+                conn.executemany(
+                    'DELETE FROM entries WHERE Name = ?',
+                    [(sqlite3.Binary(name),) for name in removed])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO entries (Name, TimeSeconds, TzOffset, Size, Stats, Complete) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(sqlite3.Binary(r.name), r.time_seconds, r.tz_offset, r.size,
+                      json.dumps(r.stats) if r.stats is not None else None,
+                      1 if r.complete else 0) for r in (records[name] for name in updated)])
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (Key, Value) VALUES ('mtime', ?)",
+                    (json.dumps(mtime),))
+                conn.execute('COMMIT TRANSACTION')
+            finally:
+                conn.close()
+        except Exception:
+            logger.warning('fail to write metadata index [%s]', self._index_file, exc_info=1)
+
+    def _index_entry(self, name, date, complete):
+        """
+        Create a new record for the given filename.
+        """
+        time_seconds, tz_offset = date if date else (None, None)
+        size = None
+        stats = None
+        fn = os.path.join(self._data_path, name)
+        try:
+            if name.startswith(b'error_log.'):
+                size = os.path.getsize(fn)
+            elif name.startswith(b'session_statistics.'):
+                with (gzip.open(fn, 'rb') if name.endswith(b'.gz') else open(fn, 'rb')) as f:
+                    stats = parse_session_statistics(f)
+        except Exception:
+            logger.warning('fail to read metadata file [%r]', fn, exc_info=1)
+            complete = False
+        return IndexRecord(name, time_seconds, tz_offset, size, stats, complete)
+
+    def _refresh(self, mtime, known):
+        """
+        List rdiff-backup-data and update the records. Only new files and
+        files written by an incomplete backup are read.
+        """
+        try:
+            names = [n for n in os.listdir(self._data_path) if _prefix(n)]
+        except OSError:
+            names = []
+
+        # Files of the last session may still be written if a backup is in
+        # progress. Those are flagged as incomplete and read again later.
+        mirrors = [self._extract_date(n) for n in names if n.startswith(b'current_mirror.')]
+        mirrors = sorted([(d[0] - d[1]) for d in mirrors if d])
+        newest = mirrors[-1] if mirrors else None
+
+        records = {}
+        updated = []
+        for name in names:
+            record = known.get(name)
+            if record is None or not record.complete:
+                date = self._extract_date(name)
+                complete = bool(mirrors) and (len(mirrors) == 1 or (date is not None and (date[0] - date[1]) < newest))
+                record = self._index_entry(name, date, complete)
+                updated.append(name)
+            records[name] = record
+        removed = [name for name in known if name not in records]
+        self._save(mtime, records, removed, updated)
+        return records
+
+    def records(self):
+        """
+        Return a dict of {prefix: [IndexRecord]} for every file in
+        rdiff-backup-data. Refresh the index if required.
+        """
+        with self._lock:
+            mtime = self._get_mtime()
+            if self._records is not None and mtime == self._mtime:
+                return self._records
+            # Load the persisted index once.
+            if self._known is None:
+                stored_mtime, known = self._load()
+            else:
+                stored_mtime, known = self._mtime, self._known
+            if known and stored_mtime == mtime:
+                records = known
+            else:
+                logger.debug('refresh metadata index for [%r]', self._data_path)
+                records = self._refresh(mtime, known)
+            # Group record by prefix.
+            grouped = {}
+            for record in records.values():
+                grouped.setdefault(_prefix(record.name), []).append(record)
+            self._mtime = mtime
+            self._known = records
+            self._records = grouped
+            return grouped
+
+
+class IncrementsIndex(object):
+    """
+    Keep the content of the directories of `rdiff-backup-data/increments`
+    grouped by filename to lookup the increments of a file without listing
+    the directory again. A directory is listed again when its modification
+    time changes.
+
+    At most `maxsize` directories are kept in memory. When `index_file` is
+    defined, the directories with many increments are also persisted.
+    `parse_names` is a function returning a list of tuple (filename,
+    time_seconds, tz_offset) from a list of increment names.
+    """
+
+    def __init__(self, increment_path, index_file, parse_names, maxsize=_INCREMENTS_CACHE_SIZE):
+        assert isinstance(increment_path, bytes)
+        assert parse_names
+        self._increment_path = increment_path
+        self._index_file = index_file
+        self._parse_names = parse_names
+        self._cache = LRUCache(maxsize)
+
+    def _connect(self):
+        conn = sqlite3.connect(self._index_file)
+        conn.isolation_level = None
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != _INDEX_VERSION:
+            conn.execute('DROP TABLE IF EXISTS increments')
+            conn.execute("""CREATE TABLE increments (
+Path blob primary key,
+Mtime integer NOT NULL,
+Entries blob NOT NULL)""")
+            conn.execute('PRAGMA user_version = %d' % _INDEX_VERSION)
+        return conn
+
+    def _load(self, path, mtime):
+        """
+        Read the persisted increments of the directory. Return None if not
+        available or outdated.
+        """
+        if not self._index_file or not os.path.isfile(self._index_file):
+            return None
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT Entries FROM increments WHERE Path = ? AND Mtime = ?', (sqlite3.Binary(path), mtime)).fetchone()
+            finally:
+                conn.close()
+        except Exception:
+            logger.warning('fail to read increments index [%s]', self._index_file, exc_info=1)
+            return None
+        if row is None:
+            return None
+        # Each entry is stored as filename, name, time_seconds and tz_offset
+        # separated by NUL.
+        data = bytes(row[0]).split(b'\0')
+        entries = {}
+        for i in range(0, len(data) - 3, 4):
+            date = (int(data[i + 2]), int(data[i + 3])) if data[i + 2] else (None, None)
+            entries.setdefault(data[i], []).append((data[i + 1],) + date)
+        return entries
+
+    def _save(self, path, mtime, entries):
+        """
+        Persist the increments of the directory.
+        """
+        data = []
+        for filename, increments in entries.items():
+            for name, time_seconds, tz_offset in increments:
+                data.extend([
+                    filename,
+                    name,
+                    str(time_seconds).encode('ascii') if time_seconds is not None else b'',
+                    str(tz_offset).encode('ascii') if tz_offset is not None else b''])
+        try:
+            index_dir = os.path.dirname(self._index_file)
+            if index_dir and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            conn = self._connect()
+            try:
+                conn.execute(
+                    'INSERT OR REPLACE INTO increments (Path, Mtime, Entries) VALUES (?, ?, ?)',
+                    (sqlite3.Binary(path), mtime, sqlite3.Binary(b'\0'.join(data))))
+            finally:
+                conn.close()
+        except Exception:
+            logger.warning('fail to write increments index [%s]', self._index_file, exc_info=1)
+
+    def _list(self, full_path):
+        """
+        Return the increments of the directory grouped by filename.
+        Sub-directories are ignored.
+        """
+        entries = {}
+        if scandir:
+            it = scandir(full_path)
+            try:
+                names = [e.name for e in it if not e.is_dir()]
+            finally:
+                # Python >= 3.6 requires the iterator to be closed.
+                if hasattr(it, 'close'):
+                    it.close()
+        else:
+            names = [n for n in os.listdir(full_path) if not os.path.isdir(os.path.join(full_path, n))]
+        for name, (filename, time_seconds, tz_offset) in zip(names, self._parse_names(names)):
+            entries.setdefault(filename, []).append((name, time_seconds, tz_offset))
+        return entries
+
+    def get(self, path):
+        """
+        Return a dict of {filename: [(name, time_seconds, tz_offset)]} for
+        the directory `path` relative to the increments directory.
+        """
+        full_path = os.path.join(self._increment_path, path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            # The directory doesn't exist if the folder never changed.
+            return {}
+        mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        entries = self._load(path, mtime)
+        if entries is None:
+            logger.debug('list increments of [%r]', full_path)
+            try:
+                entries = self._list(full_path)
+            except OSError:
+                return {}
+            if self._index_file and sum(len(v) for v in entries.values()) >= _INCREMENTS_PERSIST_MIN:
+                self._save(path, mtime, entries)
+        self._cache.set(path, (mtime, entries))
+        return entries
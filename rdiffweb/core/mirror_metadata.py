@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Index of the file tree of each backup read from the `mirror_metadata` files.
+
+rdiff-backup keeps the metadata of every file of the mirror in
+`mirror_metadata.<date>.snapshot.gz`. When a new backup is made, the
+previous snapshot is replaced by a `diff` containing the records to be
+changed to go back from the newer metadata to the older one. A record with
+`Type None` is a file that didn't exist at that date.
+
+The chain of snapshot and diffs is applied from the newest backup to the
+oldest one. Each version of a file is stored once in a SQLite database with
+the first and last backup where it's the same. The tree of any backup is
+then queried without reading the metadata files or the filesystem. Only
+the new backups are read when the index is updated.
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+from collections import namedtuple
+import bisect
+import gzip
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Increment this value when the structure of the index changes.
+_INDEX_VERSION = 1
+
+# Number of rows inserted at once.
+_BATCH_SIZE = 1000
+
+FileInfo = namedtuple('FileInfo', ['path', 'type', 'size', 'mtime', 'sha1'])
+
+_UNQUOTE_PATH_RE = re.compile(b'\\\\n|\\\\\\\\')
+
+
+def _unquote_path_char(match):
+    return b'\n' if match.group(0) == b'\\n' else b'\\'
+
+
+def _unquote_path(value):
+    """Remove the quote added by rdiff-backup to the paths (\\n and \\\\)."""
+    if b'\\' not in value:
+        return value
+    return _UNQUOTE_PATH_RE.sub(_unquote_path_char, value)
+
+
+def _file_info(path, attrs):
+    """Create a FileInfo from the attributes of a record."""
+    file_type = attrs.get(b'Type', b'None')
+    size = attrs.get(b'Size')
+    mtime = attrs.get(b'ModTime')
+    return FileInfo(
+        path,
+        None if file_type == b'None' else file_type.decode('ascii'),
+        int(size) if size is not None else None,
+        int(mtime) if mtime is not None else None,
+        attrs.get(b'SHA1Digest', b'').decode('ascii') or None)
+
+
+def parse_mirror_metadata(lines):
+    """
+    Parse the content of a mirror_metadata file one line at a time. Yield a
+    FileInfo for every record. The path of the root directory is empty. The
+    type is None for a file that doesn't exist (in a diff).
+    """
+    path = None
+    attrs = {}
+    for line in lines:
+        line = line.rstrip(b'\n')
+        if line.startswith(b'File '):
+            if path is not None:
+                yield _file_info(path, attrs)
+            path = _unquote_path(line[5:])
+            if path == b'.':
+                path = b''
+            attrs = {}
+        elif path is not None and line.startswith(b'  '):
+            key, unused_sep, value = line[2:].partition(b' ')
+            attrs[key] = value
+    if path is not None:
+        yield _file_info(path, attrs)
+
+
+def _is_snapshot(name):
+    return b'.snapshot' in name
+
+
+def _parent(path):
+    """Return the parent of the given path. None for the root directory."""
+    if not path:
+        return None
+    return os.path.dirname(path)
+
+
+def _same(a, b):
+    return a.type == b.type and a.size == b.size and a.mtime == b.mtime and a.sha1 == b.sha1
+
+
+class FileTreeIndex(object):
+    """
+    Keep the file tree of every backup of a single repository.
+
+    `data_path` is the location of `rdiff-backup-data`. `index_file` is the
+    location of the SQLite database. When `index_file` is None, the index is
+    only kept in memory. Dates are seconds since epoch.
+    """
+
+    def __init__(self, data_path, index_file=None):
+        assert isinstance(data_path, bytes)
+        self._data_path = data_path
+        self._index_file = index_file
+        self._lock = threading.RLock()
+        self._conn = None
+        self._dates = None
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        if self._index_file:
+            index_dir = os.path.dirname(self._index_file)
+            if index_dir and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            conn = sqlite3.connect(self._index_file, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.isolation_level = None
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != _INDEX_VERSION:
+            conn.execute('DROP TABLE IF EXISTS backups')
+            conn.execute('DROP TABLE IF EXISTS files')
+            conn.execute('CREATE TABLE backups (Time integer PRIMARY KEY)')
+            conn.execute("""CREATE TABLE files (
+Path blob NOT NULL,
+Parent blob,
+First integer NOT NULL,
+Last integer NOT NULL,
+Type text NOT NULL,
+Size integer,
+ModTime integer,
+SHA1 blob,
+PRIMARY KEY (Path, Last)) WITHOUT ROWID""")
+            conn.execute('CREATE INDEX idx_files_parent ON files(Parent, Last)')
+            conn.execute('PRAGMA user_version = %d' % _INDEX_VERSION)
+        self._conn = conn
+        return conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _read(self, name):
+        """Stream the records of the given mirror_metadata file."""
+        fn = os.path.join(self._data_path, name)
+        with (gzip.open(fn, 'rb') if name.endswith(b'.gz') else open(fn, 'rb')) as f:
+            for info in parse_mirror_metadata(f):
+                yield info
+
+    def dates(self):
+        """Return the sorted list of indexed backup dates."""
+        with self._lock:
+            if self._dates is None:
+                conn = self._connect()
+                self._dates = [row[0] for row in conn.execute('SELECT Time FROM backups ORDER BY Time')]
+            return self._dates
+
+    def _resolve(self, date):
+        """Return the indexed backup at or before the given date or None."""
+        dates = self.dates()
+        i = bisect.bisect_right(dates, date)
+        return dates[i - 1] if i else None
+
+    def _query(self, where, args, date):
+        with self._lock:
+            date = self._resolve(date)
+            if date is None:
+                return []
+            query = 'SELECT Path, Type, Size, ModTime, SHA1 FROM files WHERE ' + where + ' AND First <= ? AND Last >= ? ORDER BY Path'
+            return [
+                FileInfo(bytes(row[0]), row[1], row[2], row[3], binascii.hexlify(row[4]).decode('ascii') if row[4] else None)
+                for row in self._connect().execute(query, list(args) + [date, date])]
+
+    def get(self, date, path):
+        """
+        Return the FileInfo of the given unquoted path as of the given date or
+        None if the file doesn't exist.
+        """
+        found = self._query('Path = ?', [sqlite3.Binary(path)], date)
+        return found[0] if found else None
+
+    def listdir(self, date, path=b''):
+        """
+        Return the FileInfo of the files found in the given unquoted
+        directory as of the given date.
+        """
+        return self._query('Parent = ?', [sqlite3.Binary(path)], date)
+
+    def tree(self, date):
+        """
+        Return the FileInfo of every file as of the given date, sorted by path.
+        """
+        return self._query('1', [], date)
+
+    def last_versions(self, paths):
+        """
+        Return a dict with the FileInfo of the last backup of each of the
+        given unquoted paths, deleted files included. The paths never backed
+        up are missing from the dict.
+        """
+        found = {}
+        paths = list(paths)
+        with self._lock:
+            conn = self._connect()
+            # Keep the number of arguments below the limit of SQLite.
+            for i in range(0, len(paths), _BATCH_SIZE // 2):
+                batch = paths[i:i + _BATCH_SIZE // 2]
+                # SQLite return the other columns of the row matching MAX().
+                query = 'SELECT Path, Type, Size, ModTime, SHA1, MAX(Last) FROM files WHERE Path IN (' + ','.join('?' * len(batch)) + ') GROUP BY Path'
+                for row in conn.execute(query, [sqlite3.Binary(p) for p in batch]):
+                    found[bytes(row[0])] = FileInfo(bytes(row[0]), row[1], row[2], row[3], binascii.hexlify(row[4]).decode('ascii') if row[4] else None)
+        return found
+
+    def update(self, metadata):
+        """
+        Index the backups not yet indexed. `metadata` is a list of tuple
+        (date, name) of the mirror_metadata files.
+        """
+        names = {}
+        for date, name in metadata:
+            # Prefer the snapshot when both are available.
+            if date not in names or _is_snapshot(name):
+                names[date] = name
+        with self._lock:
+            indexed = self.dates()
+            if indexed == sorted(names):
+                return
+            conn = self._connect()
+            conn.execute('BEGIN')
+            try:
+                self._update(conn, names, indexed)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                logger.warning('fail to update file tree index of [%r]', self._data_path, exc_info=1)
+            finally:
+                self._dates = None
+
+    def _update(self, conn, names, indexed):
+        # Backups removed with --remove-older-than are the oldest one.
+        removed = [d for d in indexed if d not in names]
+        if removed and removed != indexed[:len(removed)]:
+            indexed = self._clear(conn)
+        elif removed and len(removed) == len(indexed):
+            indexed = self._clear(conn)
+        elif removed:
+            oldest = indexed[len(removed)]
+            conn.execute('DELETE FROM files WHERE Last < ?', (oldest,))
+            conn.execute('UPDATE files SET First = ? WHERE First < ?', (oldest, oldest))
+            conn.execute('DELETE FROM backups WHERE Time < ?', (oldest,))
+            indexed = indexed[len(removed):]
+        new = sorted([d for d in names if d not in indexed], reverse=True)
+        # A backup older than the last one indexed can't be merged.
+        if indexed and new and new[-1] < indexed[-1]:
+            indexed = self._clear(conn)
+            new = sorted(names, reverse=True)
+        if not new:
+            return
+        if not _is_snapshot(names[new[0]]):
+            logger.debug('last mirror_metadata is not a snapshot [%r]', names[new[0]])
+            return
+        logger.debug('index file tree of %s backups for [%r]', len(new), self._data_path)
+        self._walk(conn, names, new, indexed[-1] if indexed else None)
+
+    def _clear(self, conn):
+        conn.execute('DELETE FROM files')
+        conn.execute('DELETE FROM backups')
+        return []
+
+    def _walk(self, conn, names, new, stop):
+        """
+        Apply the snapshot and diffs from the newest backup to the oldest.
+        The file versions are written when they change. The versions still
+        open at the end are merged with the versions of backup `stop`.
+        """
+        rows = []
+
+        def write(path, first, last, info):
+            rows.append((
+                sqlite3.Binary(path), sqlite3.Binary(_parent(path)) if path else None,
+                first, last, info.type, info.size, info.mtime,
+                sqlite3.Binary(binascii.unhexlify(info.sha1)) if info.sha1 else None))
+            if len(rows) >= _BATCH_SIZE:
+                conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                del rows[:]
+
+        # {path: (last, FileInfo)} of the files of the previous backup.
+        current = {}
+        prev = None
+        for date in new:
+            name = names[date]
+            seen = set() if _is_snapshot(name) else None
+            for info in self._read(name):
+                if seen is not None:
+                    seen.add(info.path)
+                version = current.get(info.path)
+                if version is not None:
+                    if info.type is not None and _same(version[1], info):
+                        continue
+                    # File changed or didn't exist at this date.
+                    write(info.path, prev, version[0], version[1])
+                    del current[info.path]
+                if info.type is not None:
+                    current[info.path] = (date, info)
+            # A snapshot contains every file.
+            if seen is not None and prev is not None:
+                for path in [p for p in current if p not in seen]:
+                    version = current.pop(path)
+                    write(path, prev, version[0], version[1])
+            prev = date
+
+        # Extend the versions of the last indexed backup if unchanged.
+        stored = {}
+        if stop is not None:
+            for row in conn.execute('SELECT Path, Type, Size, ModTime, SHA1 FROM files WHERE Last = ?', (stop,)):
+                stored[bytes(row[0])] = FileInfo(
+                    bytes(row[0]), row[1], row[2], row[3], binascii.hexlify(row[4]).decode('ascii') if row[4] else None)
+        for path, (last, info) in current.items():
+            previous = stored.get(path)
+            if previous is not None and _same(previous, info):
+                conn.execute('UPDATE files SET Last = ? WHERE Path = ? AND Last = ?', (last, sqlite3.Binary(path), stop))
+            else:
+                write(path, prev, last, info)
+        if rows:
+            conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany('INSERT INTO backups VALUES (?)', [(d,) for d in new])
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Quoting of the filenames as done by rdiff-backup.
+
+When the backup destination doesn't support some characters (e.g.: colon
+on NTFS), rdiff-backup replace them by `;` followed by the decimal value of
+the byte on 3 digits (e.g.: `;058`). The characters to be quoted are
+defined by `rdiff-backup-data/chars_to_quote`. The quote character itself
+is always quoted as `;059`.
+"""
+
+from __future__ import unicode_literals
+
+from builtins import bytes
+import re
+
+from rdiffweb.core.rdw_helpers import LRUCache
+
+
+QUOTE = b';'
+
+# Number of unquoted names kept in cache.
+_CACHE_SIZE = 4096
+
+_UNQUOTE_RE = re.compile(b';([0-9]{3})', re.S)
+
+# Byte value of each quoted character.
+_BYTES = [bytes([i]) for i in range(256)]
+
+_cache = LRUCache(_CACHE_SIZE)
+
+# Compiled pattern for each value of chars_to_quote.
+_quote_patterns = {}
+
+
+def _unquote_char(match):
+    """For each ;000 return the corresponding byte."""
+    value = int(match.group(1))
+    if value > 255:
+        return match.group(0)
+    return _BYTES[value]
+
+
+def _quote_char(match):
+    """Return ;000 for the given character."""
+    return b';%03d' % ord(match.group(0))
+
+
+def unquote(name):
+    """
+    Remove quote from the given name.
+    """
+    assert isinstance(name, bytes)
+    # Nothing to do when the name is not quoted.
+    if QUOTE not in name:
+        return name
+    value = _cache.get(name)
+    if value is None:
+        value = _UNQUOTE_RE.sub(_unquote_char, name)
+        _cache.set(name, value)
+    return value
+
+
+def unquote_all(names):
+    """
+    Remove quote from a list of names. e.g.: a directory listing.
+    """
+    return [unquote(name) if QUOTE in name else name for name in names]
+
+
+def quote(name, chars_to_quote):
+    """
+    Quote the given name as rdiff-backup would do. `chars_to_quote` is the
+    content of a regex character class (e.g.: `A-Z:`). Return the name
+    unchanged if `chars_to_quote` is empty.
+    """
+    assert isinstance(name, bytes)
+    if not chars_to_quote:
+        return name
+    pattern = _quote_patterns.get(chars_to_quote)
+    if pattern is None:
+        pattern = re.compile(b'[' + chars_to_quote + b']|' + QUOTE, re.S)
+        _quote_patterns[chars_to_quote] = pattern
+    return pattern.sub(_quote_char, name)
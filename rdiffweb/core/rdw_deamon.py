@@ -29,12 +29,30 @@ class Deamon(Monitor):
 
     def deamon_run(self):
         self._wait()
+        # When multiple processes are running, only one should run the job.
+        if not self._acquire_lease():
+            _logger.info("job [%s] executed by another process", self.name)
+            self._next_execution_time = None
+            return
         # Run job.
         try:
             self.job_run()
         finally:
             self._next_execution_time = None
 
+    def _acquire_lease(self):
+        """
+        Return True if this process is elected to run the job.
+        """
+        app = getattr(self, 'app', None)
+        if app is None:
+            return True
+        try:
+            return app.store.acquire_lease(self.name)
+        except Exception:
+            _logger.warning("fail to acquire lease for job [%s]", self.name, exc_info=1)
+            return False
+
     def job_run(self):
         """
         Sub-class should implement this function.
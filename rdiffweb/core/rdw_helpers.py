@@ -20,7 +20,12 @@ from __future__ import division
 from __future__ import unicode_literals
 
 from builtins import bytes
+from builtins import object
 from builtins import str
+from collections import OrderedDict
+import threading
+import time
+
 from future.utils import iteritems
 
 
@@ -81,3 +86,70 @@ class groupby(dict):
             k = key(value)
             self.setdefault(k, []).append(value)
     __iter__ = iteritems
+
+
+class LRUCache(object):
+    """
+    Thread-safe dictionary keeping at most `maxsize` items. The least recently
+    used items are discarded first. When `ttl` is defined, items older than
+    `ttl` seconds are discarded.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        assert maxsize >= 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        """
+        Check if the key is defined and not expired. Doesn't mark the item as
+        recently used.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False
+            return not (self.ttl and item[1] + self.ttl < time.time())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get(self, key, default=None):
+        """
+        Return the value for the given key. Mark the item as recently used.
+        """
+        with self._lock:
+            try:
+                value, created = self._data.pop(key)
+            except KeyError:
+                return default
+            if self.ttl and created + self.ttl < time.time():
+                return default
+            self._data[key] = (value, created)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, (default, None))[0]
+
+    def set(self, key, value):
+        """
+        Add or replace the given item. Discard the least recently used
+        items if required.
+        """
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time())
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
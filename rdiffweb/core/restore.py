@@ -29,9 +29,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+from collections import deque
 from distutils import spawn
+import gzip
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import select
 import shutil
 import stat
 import struct
@@ -47,6 +51,18 @@ from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP64_LIMIT, crc32, zlib, \
 
 from future.builtins import bytes
 from future.builtins import str
+import psutil
+
+from rdiffweb.core import quoting
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 
 logger = logging.getLogger(__name__)
@@ -57,27 +73,159 @@ PY3 = sys.version_info[0] == 3
 # Increase the chunk size to improve performance.
 CHUNK_SIZE = 4096 * 10
 
+# Size of the blocks compressed by each thread when using multiple workers.
+BLOCK_SIZE = 128 * 1024
+
+# Size of the deflate window. Used as dictionary for the next block.
+WINDOW_SIZE = 32 * 1024
+
+# Default compression level for zstandard.
+ZSTD_LEVEL = 3
+
 # Token used by rdiff-backup
 TOKEN = b'Processing changed file '
 
 # File System encoding.
 FS_ENCODING = (sys.getfilesystemencoding() or 'utf-8').lower()
 
+# Magic number of librsync delta file.
+RS_DELTA_MAGIC = 0x72730236
+
+# Maximum size of intermediate version kept in memory when applying
+# multiple delta.
+SPOOL_SIZE = 1024 * 1024 * 4
+
+# Minimum number of seconds between two measures of the temporary folder.
+TEMP_WINDOW_INTERVAL = 0.5
+
 # PATH for executable lookup
 PATH = path = os.path.dirname(sys.executable) + os.pathsep + os.environ['PATH']
 
 
+def _deflate_block(block, zdict, level):
+    """
+    Compress a single block of data into a raw deflate stream. The stream is
+    terminated by a sync flush so it can be concatenated with the next block.
+    """
+    if zdict and PY3:
+        cmpr = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        cmpr = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return cmpr.compress(block) + cmpr.flush(zlib.Z_SYNC_FLUSH)
+
+
+class _ParallelDeflate(object):
+    """
+    Compressor object (same interface as zlib.compressobj) compressing the
+    data with multiple threads, the same way as pigz. The data is split into
+    blocks compressed independently using the end of the previous block as
+    dictionary. The concatenation of the blocks is a valid raw deflate
+    stream. Compressed data is returned in order as soon as available.
+    """
+
+    def __init__(self, pool, workers, level=zlib.Z_DEFAULT_COMPRESSION):
+        assert pool
+        self._pool = pool
+        # Limit the number of blocks kept in memory.
+        self._max_pending = workers * 2
+        self._level = level
+        self._buffer = []
+        self._buffered = 0
+        self._zdict = None
+        self._pending = deque()
+
+    def _submit(self, out):
+        block = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._pending.append(self._pool.apply_async(_deflate_block, (block, self._zdict, self._level)))
+        self._zdict = block[-WINDOW_SIZE:]
+        # Wait for the oldest block if too many are pending.
+        while len(self._pending) > self._max_pending:
+            out.append(self._pending.popleft().get())
+        while self._pending and self._pending[0].ready():
+            out.append(self._pending.popleft().get())
+
+    def compress(self, data):
+        out = []
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BLOCK_SIZE:
+            self._submit(out)
+        return b''.join(out)
+
+    def flush(self):
+        out = []
+        if self._buffered:
+            self._submit(out)
+        while self._pending:
+            out.append(self._pending.popleft().get())
+        # Write an empty final block to terminate the stream.
+        out.append(zlib.compressobj(self._level, zlib.DEFLATED, -15).flush())
+        return b''.join(out)
+
+
+class _ParallelGzipFile(object):
+    """
+    Write only file object writing a gzip stream into `fileobj` using
+    multiple threads to compress the data.
+    """
+
+    def __init__(self, fileobj, pool, workers):
+        self.fileobj = fileobj
+        self.cmpr = _ParallelDeflate(pool, workers)
+        self.crc = crc32(b'') & 0xffffffff
+        self.size = 0
+        # Magic, deflate, no flags, mtime, no extra flags, unknown OS.
+        self.fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack(b'<L', int(time.time())) + b'\x00\xff')
+
+    def write(self, data):
+        self.crc = crc32(data, self.crc) & 0xffffffff
+        self.size += len(data)
+        data = self.cmpr.compress(data)
+        if data:
+            self.fileobj.write(data)
+
+    def close(self):
+        self.fileobj.write(self.cmpr.flush())
+        self.fileobj.write(struct.pack(b'<LL', self.crc, self.size & 0xffffffff))
+
+
 class TarArchiver(object):
     """
     Archiver to create tar archive (with compression).
     """
 
-    def __init__(self, dest, compression=''):
-        assert compression in ['', 'gz', 'bz2']
+    def __init__(self, dest, compression='', workers=1, level=None):
+        assert compression in ['', 'gz', 'bz2', 'zst', 'lz4']
         mode = "w|" + compression
+        self.pool = None
+        self.cfile = None
+
+        # Compression not supported by tarfile or using multiple threads is
+        # done by wrapping the destination.
+        if compression in ['zst', 'lz4'] or (compression == 'gz' and workers > 1):
+            mode = "w|"
+            if isinstance(dest, str):
+                dest = open(dest, 'wb')
+            if compression == 'zst':
+                cctx = zstandard.ZstdCompressor(
+                    level=ZSTD_LEVEL if level is None else level,
+                    threads=workers if workers > 1 else 0)
+                self.cfile = cctx.stream_writer(dest, closefd=False)
+            elif compression == 'lz4':
+                self.cfile = lz4.frame.LZ4FrameFile(
+                    dest, mode='wb',
+                    compression_level=lz4.frame.COMPRESSIONLEVEL_MIN if level is None else level)
+            else:
+                self.pool = ThreadPool(workers)
+                self.cfile = _ParallelGzipFile(dest, self.pool, workers)
 
         # Open the tar archive with the right method.
-        if isinstance(dest, str):
+        if self.cfile:
+            self.z = tarfile.open(fileobj=self.cfile, mode=mode, encoding='UTF8', format=tarfile.PAX_FORMAT)
+            self.fileobj = dest
+        elif isinstance(dest, str):
             self.z = tarfile.open(name=dest, mode=mode, encoding='UTF8', format=tarfile.PAX_FORMAT)
             self.fileobj = None
         else:
@@ -104,6 +252,13 @@ class TarArchiver(object):
     def close(self):
         # Close tar archive
         self.z.close()
+        # Write the end of the compressed stream.
+        if self.cfile:
+            try:
+                self.cfile.close()
+            finally:
+                if self.pool:
+                    self.pool.terminate()
         # Also close file object.
         if self.fileobj:
             self.fileobj.close()
@@ -141,6 +296,8 @@ class NonSeekZipFile(ZipFile):
     dereference = False  # If true, add content of linked file to the  tar file, else the link.
 
     def __init__(self, dest, *args, **kwargs):
+        # Function returning the compressor object to be used for deflate.
+        self.compressor = kwargs.pop('compressor', None)
         if not isinstance(dest, str):
             try:
                 dest.tell()
@@ -211,7 +368,9 @@ class NonSeekZipFile(ZipFile):
                 # Python <= 2.7.3
                 zip64 = zinfo.file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT
                 self.fp.write(zinfo.FileHeader())
-            if zinfo.compress_type == ZIP_DEFLATED:
+            if zinfo.compress_type == ZIP_DEFLATED and self.compressor:
+                cmpr = self.compressor()
+            elif zinfo.compress_type == ZIP_DEFLATED:
                 cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
                                         zlib.DEFLATED, -15)
             else:
@@ -256,12 +415,17 @@ class ZipArchiver(object):
     Can write uncompressed, or compressed with deflate.
     """
 
-    def __init__(self, dest, compress=True):
+    def __init__(self, dest, compress=True, workers=1):
         compress = compress and ZIP_DEFLATED or ZIP_STORED
-        if sys.version_info < (3, 5):
-            self.z = NonSeekZipFile(dest, 'w', compress)
+        self.pool = None
+        if compress == ZIP_DEFLATED and workers > 1:
+            # Compress the blocks of each entry with multiple threads.
+            self.pool = ThreadPool(workers)
+            self.z = NonSeekZipFile(dest, 'w', compress, compressor=lambda: _ParallelDeflate(self.pool, workers))
         else:
-            self.z = ZipFile(dest, 'w', compress)
+            # Never seek back to update the header: the archive may be
+            # streamed while it's written.
+            self.z = NonSeekZipFile(dest, 'w', compress)
 
     def addfile(self, filename, arcname, encoding):
         assert isinstance(filename, bytes)
@@ -285,7 +449,11 @@ class ZipArchiver(object):
         self.z.write(filename, arcname)
 
     def close(self):
-        self.z.close()
+        try:
+            self.z.close()
+        finally:
+            if self.pool:
+                self.pool.terminate()
 
 
 class RawArchiver(object):
@@ -314,15 +482,170 @@ class RawArchiver(object):
 
 
 ARCHIVERS = {
-    'tar': TarArchiver,
-    'tbz2': lambda dest, : TarArchiver(dest, 'bz2'),
-    'tar.bz2': lambda dest: TarArchiver(dest, 'bz2'),
-    'tar.gz': lambda dest: TarArchiver(dest, 'gz'),
-    'tgz': lambda dest: TarArchiver(dest, 'gz'),
-    'zip': ZipArchiver,
-    'raw': RawArchiver,
+    'tar': lambda dest, **kwargs: TarArchiver(dest),
+    'tbz2': lambda dest, **kwargs: TarArchiver(dest, 'bz2'),
+    'tar.bz2': lambda dest, **kwargs: TarArchiver(dest, 'bz2'),
+    'tar.gz': lambda dest, workers=1, **kwargs: TarArchiver(dest, 'gz', workers),
+    'tgz': lambda dest, workers=1, **kwargs: TarArchiver(dest, 'gz', workers),
+    'zip': lambda dest, workers=1, **kwargs: ZipArchiver(dest, workers=workers),
+    'raw': lambda dest, **kwargs: RawArchiver(dest),
 }
 
+# Optional archive types.
+if zstandard:
+    ARCHIVERS['tar.zst'] = lambda dest, workers=1, level=None: TarArchiver(dest, 'zst', workers, level)
+if lz4:
+    ARCHIVERS['tar.lz4'] = lambda dest, level=None, **kwargs: TarArchiver(dest, 'lz4', level=level)
+
+
+class _PatchReader(object):
+    """
+    File object applying a librsync delta (as written by rdiff-backup for
+    `.diff` increments) to a basis file while reading. The basis must be
+    seekable. The delta is read sequentially, so the result may be streamed
+    without writing anything to disk.
+    """
+
+    def __init__(self, basis, delta):
+        self.basis = basis
+        self.delta = delta
+        self._literal = False
+        self._pending = 0
+        self._done = False
+        if self._read_int(4) != RS_DELTA_MAGIC:
+            raise ValueError('invalid delta file')
+
+    def _read_exact(self, fp, size):
+        data = fp.read(size)
+        if len(data) != size:
+            raise IOError('unexpected end of file')
+        return data
+
+    def _read_int(self, size):
+        fmt = {1: b'>B', 2: b'>H', 4: b'>I', 8: b'>Q'}[size]
+        return struct.unpack(fmt, self._read_exact(self.delta, size))[0]
+
+    def _next_command(self):
+        """
+        Read the next command from the delta.
+        """
+        op = self._read_int(1)
+        if op == 0x00:
+            # END
+            self._done = True
+        elif op <= 0x40:
+            # LITERAL with inline length
+            self._literal = True
+            self._pending = op
+        elif op <= 0x44:
+            # LITERAL with length of 1, 2, 4 or 8 bytes
+            self._literal = True
+            self._pending = self._read_int(1 << (op - 0x41))
+        elif op <= 0x54:
+            # COPY with start and length of 1, 2, 4 or 8 bytes
+            start = self._read_int(1 << ((op - 0x45) // 4))
+            length = self._read_int(1 << ((op - 0x45) % 4))
+            self.basis.seek(start)
+            self._literal = False
+            self._pending = length
+        else:
+            raise ValueError('invalid delta command %d' % op)
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size if size is not None and size >= 0 else None
+        while remaining is None or remaining > 0:
+            if not self._pending:
+                if self._done:
+                    break
+                self._next_command()
+                continue
+            n = min(self._pending, CHUNK_SIZE)
+            if remaining is not None:
+                n = min(n, remaining)
+                remaining -= n
+            data = self._read_exact(self.delta if self._literal else self.basis, n)
+            self._pending -= n
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def close(self):
+        self.basis.close()
+        self.delta.close()
+
+
+def _open_increment(filename):
+    if filename.endswith(b'.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _spool(fileobj):
+    """
+    Copy the content of the file object into a seekable temporary file.
+    """
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        shutil.copyfileobj(fileobj, tmp, CHUNK_SIZE)
+    finally:
+        fileobj.close()
+    tmp.seek(0)
+    return tmp
+
+
+def restore_file(mirror, increments):
+    """
+    Restore a single file without calling rdiff-backup.
+
+    mirror: location of the file in the mirror or None if it doesn't exists.
+    increments: location of the increments files of the file to be applied
+    to restore it, from the oldest (the one matching the restore date) to
+    the newest.
+
+    Return a file object to read the file content or None if the file can't
+    be restored this way. e.g.: when the file was missing at that date.
+    """
+    assert mirror is None or isinstance(mirror, bytes)
+
+    # Lookup the most recent state available: the first snapshot or the
+    # mirror file.
+    base = None
+    diffs = []
+    for inc in increments:
+        assert isinstance(inc, bytes)
+        if os.path.islink(inc):
+            return None
+        if inc.endswith(b'.snapshot.gz') or inc.endswith(b'.snapshot'):
+            base = inc
+            break
+        elif inc.endswith(b'.diff.gz') or inc.endswith(b'.diff'):
+            diffs.append(inc)
+        else:
+            # Missing file, directory or anything else.
+            return None
+    if base is None:
+        if not mirror or os.path.islink(mirror) or not os.path.isfile(mirror):
+            return None
+        fileobj = open(mirror, 'rb')
+    elif diffs:
+        # Delta needs to be applied on a seekable file.
+        fileobj = _spool(_open_increment(base))
+    else:
+        return _open_increment(base)
+
+    # Apply the delta from the newest to the oldest. Only the last delta is
+    # applied while streaming the data.
+    try:
+        while diffs:
+            reader = _PatchReader(fileobj, _open_increment(diffs.pop()))
+            if not diffs:
+                return reader
+            fileobj = _spool(reader)
+    except:
+        fileobj.close()
+        raise
+    return fileobj
+
 
 # Log everything to stderr.
 def _print_stderr(msg, exc_info=False):
@@ -344,28 +667,185 @@ def _readerthread(stderr):
     stderr.close()
 
 
+class _FilenameLookup(object):
+    """
+    Search for the restored files. This is used to mitigate encoding issue
+    with rdiff-backup2. That replace invalid character. The names printed by
+    rdiff-backup may also be quoted (e.g.: `;058`) while the restored files
+    are not.
+
+    When a filename doesn't exists as-is, the listing of the parent directory
+    is kept in cache to avoid listing the same directory for every file.
+    """
+
+    def __init__(self, base):
+        assert isinstance(base, bytes)
+        self.base = base
+        self._listings = {}
+
+    def _match(self, dirname, name):
+        """
+        Return the real name of the file in `dirname` matching the given name
+        as printed by rdiff-backup.
+        """
+        listing = self._listings.get(dirname)
+        if listing is None or name not in listing:
+            # The file may have been restored after the last listing.
+            try:
+                names = os.listdir(dirname)
+            except OSError:
+                return None
+            listing = dict(
+                (n.decode(FS_ENCODING, 'replace').encode(FS_ENCODING, 'replace'), n)
+                for n in names)
+            self._listings[dirname] = listing
+        return listing.get(name)
+
+    def lookup(self, path):
+        """
+        Return a tuple (fullpath, arcname) or (None, None) if not found.
+        """
+        assert isinstance(path, bytes)
+        # Easy path, if the file encoding is ok, will find the file.
+        fullpath = os.path.normpath(os.path.join(self.base, path))
+        if os.path.lexists(fullpath):
+            return fullpath, path
+        # Otherwise, search for a matching name for each part of the path.
+        fullpath = self.base
+        for name in path.split(b'/'):
+            if not name or name == b'.':
+                continue
+            candidate = os.path.join(fullpath, name)
+            if not os.path.lexists(candidate):
+                real_name = self._match(fullpath, quoting.unquote(name))
+                if real_name is None:
+                    return None, None
+                candidate = os.path.join(fullpath, real_name)
+            fullpath = candidate
+        return fullpath, os.path.relpath(fullpath, self.base)
+
+    def forget(self, dirname):
+        """
+        Remove the listing of a directory from cache.
+        """
+        self._listings.pop(dirname, None)
+
+
 def _lookup_filename(base, path):
     """
     Search for the given filename. This is used to mitigate encoding issue
     with rdiff-backup2. That replace invalid character.
     """
-    assert isinstance(base, bytes)
-    assert isinstance(path, bytes)
-    # Easy path, if the file encoding is ok, will find the file.
-    fullpath = os.path.normpath(os.path.join(base, path))
-    if os.path.lexists(fullpath):
-        return fullpath, path
-    # Otherwise, Search the for a matching filename.
-    dirname = os.path.dirname(os.path.join(base, path))
-    basename = os.path.basename(path)
-    for file in os.listdir(dirname):
-        if basename == file.decode(FS_ENCODING,'replace').encode(FS_ENCODING, 'replace'):
-            fullpath = os.path.join(dirname, file)
-            arcname = os.path.relpath(fullpath, base)
-            return fullpath, arcname
-    return None, None
-
-def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
+    return _FilenameLookup(base).lookup(path)
+
+
+class _LineReader(object):
+    """
+    Read lines from a pipe with an optional timeout.
+    """
+
+    def __init__(self, fileobj):
+        self._fd = fileobj.fileno()
+        self._buf = b''
+        self._eof = False
+
+    def readline(self, timeout=None):
+        """
+        Return the next line, an empty string at the end of file or None
+        if no line is available within the given timeout.
+        """
+        while True:
+            idx = self._buf.find(b'\n')
+            if idx >= 0:
+                line, self._buf = self._buf[:idx + 1], self._buf[idx + 1:]
+                return line
+            if self._eof:
+                line, self._buf = self._buf, b''
+                return line
+            if timeout is not None and not select.select([self._fd], [], [], timeout)[0]:
+                return None
+            data = os.read(self._fd, CHUNK_SIZE)
+            if data:
+                self._buf += data
+            else:
+                self._eof = True
+
+
+class _TempWindow(object):
+    """
+    Bound the amount of data restored into the temporary folder and not yet
+    added to the archive. rdiff-backup is suspended when the window is full
+    and resumed once half of it is archived.
+    """
+
+    def __init__(self, pid, size, path):
+        assert size > 0
+        self._process = psutil.Process(pid)
+        self._path = path
+        self.size = size
+        self.paused = False
+        self._measured = 0
+
+    def _pending(self):
+        """
+        Number of bytes found in the temporary folder. Archived files are
+        deleted, so only the files waiting to be archived and the temporary
+        files of rdiff-backup are counted.
+        """
+        if not os.path.isdir(self._path):
+            return os.path.getsize(self._path) if os.path.isfile(self._path) else 0
+        pending = 0
+        for root, unused_dirs, files in os.walk(self._path):
+            for name in files:
+                try:
+                    pending += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    # File removed in the meantime.
+                    pass
+        return pending
+
+    def update(self):
+        """
+        Called every time a file is added to the archive and removed from
+        the temporary folder.
+        """
+        # Walking the temporary folder for every file would be too slow.
+        now = time.time()
+        if now - self._measured < TEMP_WINDOW_INTERVAL:
+            return
+        self._measured = now
+        pending = self._pending()
+        try:
+            if not self.paused and pending > self.size:
+                self._process.suspend()
+                self.paused = True
+            elif self.paused and pending <= self.size // 2:
+                self.resume()
+        except psutil.Error:
+            self.resume()
+
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            try:
+                self._process.resume()
+            except psutil.Error:
+                pass
+
+
+def _ancestors(path):
+    """
+    Return the list of parent directories of a relative path.
+    """
+    parents = []
+    path = os.path.dirname(path)
+    while path:
+        parents.append(path)
+        path = os.path.dirname(path)
+    return parents
+
+
+def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info, workers=1, level=None, temp_window=None):
     """
     Used to restore a file or a directory.
     restore: relative or absolute file or folder to be restored (unquoted)
@@ -373,6 +853,10 @@ def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
     kind: type of archive to generate or raw to stream a single file.
     encoding: encoding of the repository (used to properly encode the filename in archive)
     dest: a filename or a file handler where to write the archive.
+    workers: number of threads used to compress zip, tar.gz and tar.zst archive.
+    level: compression level used for tar.zst and tar.lz4 archive.
+    temp_window: maximum number of bytes restored in the temporary folder
+    waiting to be archived. None for unlimited.
     """
     assert isinstance(restore, bytes)
     assert isinstance(restore_as_of, int)
@@ -406,10 +890,23 @@ def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
         env=env)
 
     # Open an archive.
-    archive = ARCHIVERS[kind](dest)
+    archive = ARCHIVERS[kind](dest, workers=workers, level=level)
+    lookup = _FilenameLookup(tmp_output)
+    window = _TempWindow(process.pid, temp_window, tmp_output) if temp_window else None
+    reader = _LineReader(process.stdout)
+    # Directories containing the last processed file.
+    parents = []
     try:
         # Read the output of rdiff-backup
-        for line in process.stdout:
+        while True:
+            line = reader.readline(timeout=0.5 if window and window.paused else None)
+            if line is None:
+                # Every restored file is archived, rdiff-backup is probably
+                # writing a file larger than the window.
+                window.resume()
+                continue
+            if not line:
+                break
             line = line.rstrip(b'\n')
             log('rdiff-backup: %r' % line)
             if not line.startswith(TOKEN):
@@ -417,11 +914,20 @@ def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
             # A new file or directory was processed. Extract the filename and
             # look for it on filesystem.
             value = line[len(TOKEN):]
-            fullpath, arcname = _lookup_filename(tmp_output, line[len(TOKEN):])
+            fullpath, arcname = lookup.lookup(value)
             if not fullpath:
                 log('error: file not found %r' % value)
                 continue
 
+            # rdiff-backup process the files in order. The listing of the
+            # directories not containing this file are not needed anymore.
+            # The directories are kept until the end of the process since
+            # rdiff-backup update their attributes after their content.
+            previous, parents = parents, _ancestors(os.path.relpath(fullpath, tmp_output))
+            for dirname in previous:
+                if dirname not in parents:
+                    lookup.forget(os.path.join(tmp_output, dirname))
+
             # Add the file to the archive.
             log('adding %r' % fullpath)
             try:
@@ -432,14 +938,19 @@ def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
                 # with the next file.
                 log('error: fail to add %r' % fullpath, exc_info=1)
 
-            # Delete file once added to the archive.
+            # Delete file once added to the archive. Only the regular files
+            # and links are deleted.
             if os.path.isfile(fullpath) or os.path.islink(fullpath):
                 os.remove(fullpath)
+            if window:
+                window.update()
 
     finally:
         # Close the pipe
         archive.close()
         # Kill the process during exception.
+        if window:
+            window.resume()
         process.kill()
         # Clean-up the directory.
         if os.path.isdir(tmp_output):
@@ -448,9 +959,10 @@ def restore(restore, restore_as_of, kind, encoding, dest, log=logger.info):
             os.remove(tmp_output)
 
 
-def call_restore(path, restore_as_of, encoding, kind):
+def spawn_restore(path, restore_as_of, encoding, kind, output=b'-', workers=1, level=None, temp_window=None):
     """
-    Used to call restore as a subprocess.
+    Start rdiffweb-restore as a subprocess writing the archive into `output`
+    (a filename or '-' for stdout). Return the process.
     """
     assert isinstance(restore_as_of, int), "restore_as_of must be a int"
     assert kind and kind in ARCHIVERS, "kind must be in " + ARCHIVERS
@@ -462,15 +974,29 @@ def call_restore(path, restore_as_of, encoding, kind):
     cmd = cmd.encode(FS_ENCODING)
 
     # Call the process.
-    cmdline = [cmd, b'--restore-as-of', str(restore_as_of).encode('latin'), b'--encoding', encoding, b'--kind', kind, path, b'-']
+    cmdline = [cmd, b'--restore-as-of', str(restore_as_of).encode('latin'), b'--encoding', encoding, b'--kind', kind, b'--workers', str(workers).encode('latin')]
+    if level is not None:
+        cmdline += [b'--level', str(level).encode('latin')]
+    if temp_window:
+        cmdline += [b'--temp-window', str(temp_window).encode('latin')]
+    cmdline += [path, output]
     logger.info('executing: %r' % cmdline)
-    process = subprocess.Popen(cmdline, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout = subprocess.PIPE if output == b'-' else None
+    process = subprocess.Popen(cmdline, stdout=stdout, stderr=subprocess.PIPE)
 
     # Pipe stderr to logger
     t = threading.Thread(target=_readerthread, args=(process.stderr,))
     t.daemon = True
     t.start()
 
+    return process
+
+
+def call_restore(path, restore_as_of, encoding, kind, workers=1, level=None, temp_window=None):
+    """
+    Used to call restore as a subprocess.
+    """
+    process = spawn_restore(path, restore_as_of, encoding, kind, workers=workers, level=level, temp_window=temp_window)
     # TODO We should wait half a second and check if the process failed.
     return process.stdout
 
@@ -480,6 +1006,9 @@ def main():
     parser.add_argument('--restore-as-of', type=int, required=True)
     parser.add_argument('--encoding', type=str, default='utf-8', help='Define the encoding of the repository.')
     parser.add_argument('--kind', type=str, choices=ARCHIVERS, default='zip', help='Define the type of archive to generate.')
+    parser.add_argument('--workers', type=int, default=1, help='Define the number of threads used to compress the archive.')
+    parser.add_argument('--level', type=int, default=None, help='Define the compression level of tar.zst and tar.lz4 archive.')
+    parser.add_argument('--temp-window', type=int, default=None, help='Define the maximum number of bytes restored in the temporary folder waiting to be archived.')
     parser.add_argument('restore', type=str if PY3 else bytes, help='Define the path of the file or directory to restore.')
     parser.add_argument('output', type=str, default='-', help='Define the location of the archive. Default to stdout.')
     args = parser.parse_args()
@@ -494,7 +1023,7 @@ def main():
         output = open(args.output, 'wb')
     # Execute the restore.
     try:
-        restore(path, args.restore_as_of, args.kind, args.encoding, output, log=_print_stderr)
+        restore(path, args.restore_as_of, args.kind, args.encoding, output, log=_print_stderr, workers=args.workers, level=args.level, temp_window=args.temp_window)
     except:
         _print_stderr('error: failure to create the archive', exc_info=1)
         sys.exit(1)
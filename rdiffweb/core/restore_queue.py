@@ -0,0 +1,487 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Queue of restore jobs.
+
+Each restore of a directory is executed by a `rdiffweb-restore` subprocess
+writing the archive into a cache directory. The number of processes running
+at the same time is limited globally and per user, the other jobs wait in
+the queue. Once completed, the archive is kept for a while so an interrupted
+download may be resumed without restoring the data again.
+
+The cache directory must be private to the service (owned by the same user
+and not accessible by others). Only the archives created by this process are
+served from cache. When the cache is full, the restore is not queued and the
+archive should be streamed directly to the client. The oldest archives are
+evicted first, whichever worker created them.
+
+When multiple workers share the same database, the concurrency limits are
+enforced with leases: each running job holds one of the `RestoreMaxJobs`
+global slots and one of the `RestoreMaxJobsPerUser` slots of its owner. The
+archives are named after the process creating them so a worker never
+removes the files of another worker still running.
+"""
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import errno
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from builtins import bytes
+from cherrypy.process.plugins import SimplePlugin
+
+from rdiffweb.core.config import Option, IntOption
+from rdiffweb.core.restore import spawn_restore, CHUNK_SIZE
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Number of seconds a restore slot is kept without being renewed. Slots of a
+# dead worker are released after this delay.
+_LEASE_TTL = 60
+
+
+def _parse_name(name):
+    """
+    Return the key and the pid of the process creating the given archive or
+    (None, None) if the name is not an archive.
+    """
+    parts = name.split(b'.', 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None, None
+    return parts[0].decode('ascii', 'replace'), int(parts[1])
+
+
+def _pid_exists(pid):
+    """
+    Return True if the given process is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class RestoreJob(object):
+    """
+    Represent the restore of a path into an archive.
+    """
+
+    def __init__(self, key, owner, archive, args):
+        self.key = key
+        self.owner = owner
+        # Location of the archive once completed.
+        self.archive = archive
+        # Location of the archive while it's being written.
+        self.part = archive + b'.part'
+        # Arguments of spawn_restore()
+        self.args = args
+        self.state = QUEUED
+        self.process = None
+        self.created = time.time()
+        self.finished = None
+        # Name of the leases held while running.
+        self.leases = []
+        self._done = threading.Event()
+
+    @property
+    def size(self):
+        """
+        Number of bytes written to the archive.
+        """
+        for fn in [self.archive, self.part]:
+            try:
+                return os.path.getsize(fn)
+            except OSError:
+                pass
+        return 0
+
+    def wait(self, timeout=None):
+        """
+        Wait until the job is completed or failed.
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def follow(self):
+        """
+        Return a generator of the content of the archive as it's written by
+        the restore process. The archive is opened immediately so it may be
+        read even if removed from cache. Raise an error if the restore failed.
+        """
+        try:
+            f = open(self.part, 'rb')
+        except (IOError, OSError):
+            # The archive may be completed already.
+            f = open(self.archive, 'rb')
+        return self._follow(f)
+
+    def _follow(self, f):
+        with f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if data:
+                    yield data
+                elif self.wait(0.5):
+                    if self.state == FAILED:
+                        raise IOError('restore failed')
+                    # Read what was written after the last read.
+                    data = f.read(CHUNK_SIZE)
+                    while data:
+                        yield data
+                        data = f.read(CHUNK_SIZE)
+                    return
+
+
+class RestoreQueue(SimplePlugin):
+    """
+    Schedule the restore jobs according to the concurrency limits and
+    keep track of the archives kept in cache.
+    """
+
+    _max_jobs = IntOption("RestoreMaxJobs", 4)
+
+    _max_jobs_per_user = IntOption("RestoreMaxJobsPerUser", 2)
+
+    _cache_dir = Option("RestoreCacheDir")
+
+    _cache_ttl = IntOption("RestoreCacheTTL", 3600)
+
+    _temp_window = IntOption("RestoreTempWindow", 1024)
+
+    _cache_size = IntOption("RestoreCacheSize", 1024)
+
+    def __init__(self, bus, app):
+        SimplePlugin.__init__(self, bus)
+        self.app = app
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+
+    @property
+    def cache_dir(self):
+        value = self._cache_dir or os.path.join(tempfile.gettempdir(), 'rdiffweb-restore-%s' % os.getuid())
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        return value
+
+    @property
+    def temp_window(self):
+        """
+        Maximum number of bytes waiting to be archived or None.
+        """
+        return self._temp_window * 1024 * 1024 if self._temp_window > 0 else None
+
+    def _check_cache_dir(self):
+        """
+        Create the cache directory if missing. Raise an error if the directory
+        is not owned by the service or accessible by other users.
+        """
+        cache_dir = self.cache_dir
+        try:
+            os.makedirs(cache_dir, 0o700)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+        st = os.lstat(cache_dir)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise IOError('restore cache directory %r must be a directory owned by the service with permission 0700' % cache_dir)
+        return cache_dir
+
+    def _free_space(self):
+        """
+        Return the number of bytes available in the cache directory or None
+        if unknown.
+        """
+        try:
+            st = os.statvfs(self.cache_dir)
+        except (AttributeError, OSError):
+            return None
+        return st.f_bavail * st.f_frsize
+
+    def _used_space(self):
+        """
+        Return the number of bytes used by the archives of every worker.
+        """
+        used = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return 0
+        for name in names:
+            try:
+                used += os.path.getsize(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+        return used
+
+    def _completed_archives(self):
+        """
+        Return the list of (mtime, filename) of the completed archives found
+        in the cache directory, including the archives of other workers.
+        """
+        archives = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return archives
+        for name in names:
+            if name.endswith(b'.part') or _parse_name(name)[0] is None:
+                continue
+            fn = os.path.join(self.cache_dir, name)
+            try:
+                archives.append((os.path.getmtime(fn), fn))
+            except OSError:
+                pass
+        return archives
+
+    def _reserve(self):
+        """
+        Evict the oldest archives of the cache directory until the cache has
+        room for a new one. Return False if the cache is full.
+        """
+        quota = self._cache_size * 1024 * 1024
+        if quota <= 0:
+            return False
+        while self._used_space() >= quota:
+            archives = self._completed_archives()
+            if not archives:
+                return False
+            unused, fn = min(archives)
+            logger.debug('evict archive [%r] from restore cache', fn)
+            self._remove(fn)
+            key = _parse_name(os.path.basename(fn))[0]
+            job = self._jobs.get(key)
+            if job and job.archive == fn:
+                del self._jobs[key]
+        free = self._free_space()
+        if free is not None and free < quota - self._used_space():
+            logger.warning('not enough free space in restore cache directory [%r]', self.cache_dir)
+            return False
+        return True
+
+    def _evict(self, job):
+        logger.debug('evict restore job [%s] from cache', job.key)
+        del self._jobs[job.key]
+        self._remove(job.archive)
+
+    def _key(self, path, restore_as_of, kind):
+        h = hashlib.sha1()
+        h.update(path)
+        h.update(('\0%s\0%s' % (restore_as_of, kind)).encode('ascii'))
+        return h.hexdigest()
+
+    def submit(self, owner, path, restore_as_of, encoding, kind, workers=1, level=None):
+        """
+        Return the job to restore the given path. An existing job is returned
+        if the same restore is queued, running or available in cache. Return
+        None if the cache is full: the archive should be streamed instead.
+        """
+        assert isinstance(path, bytes)
+        key = self._key(path, restore_as_of, kind)
+        with self._lock:
+            self.cleanup()
+            job = self._jobs.get(key)
+            if job and job.state == DONE and not os.path.isfile(job.archive):
+                # Evicted by another worker.
+                del self._jobs[key]
+                job = None
+            if job and job.state != FAILED:
+                # Slots may have been released by another worker.
+                self._schedule()
+                return job
+            if not self._reserve():
+                return None
+            name = ('%s.%s.%s' % (key, os.getpid(), kind)).encode('ascii')
+            archive = os.path.join(self.cache_dir, name)
+            job = RestoreJob(key, owner, archive, (path, restore_as_of, encoding, kind, workers, level))
+            self._jobs[key] = job
+            self._schedule()
+            return job
+
+    def position(self, job):
+        """
+        Return the position of the job in the queue (1 is the next to run).
+        """
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.state == QUEUED]
+            return queued.index(job) + 1 if job in queued else 0
+
+    def _schedule(self):
+        """
+        Start as many queued jobs as allowed by the limits.
+        """
+        with self._lock:
+            running = [j for j in self._jobs.values() if j.state == RUNNING]
+            for job in list(self._jobs.values()):
+                if len(running) >= max(1, self._max_jobs):
+                    break
+                if job.state != QUEUED:
+                    continue
+                if len([j for j in running if j.owner == job.owner]) >= max(1, self._max_jobs_per_user):
+                    continue
+                if not self._acquire_slots(job, running):
+                    continue
+                self._start(job)
+                running.append(job)
+
+    def _acquire_slots(self, job, running):
+        """
+        Acquire a global slot and a slot of the job owner shared with the
+        other workers. Return False if none is available.
+        """
+        held = set(name for j in running for name in j.leases)
+        leases = []
+        for prefix, count in [('RestoreJob', self._max_jobs), ('RestoreJob:%s' % job.owner, self._max_jobs_per_user)]:
+            names = ['%s:%s' % (prefix, i) for i in range(max(1, count))]
+            name = next((n for n in names if n not in held and self._acquire_lease(n)), None)
+            if name is None:
+                self._release_slots(leases)
+                return False
+            leases.append(name)
+        job.leases = leases
+        return True
+
+    def _release_slots(self, leases):
+        for name in leases:
+            try:
+                self.app.store.release_lease(name)
+            except Exception:
+                logger.warning('fail to release lease [%s]', name, exc_info=1)
+        del leases[:]
+
+    def _acquire_lease(self, name):
+        try:
+            return self.app.store.acquire_lease(name, ttl=_LEASE_TTL)
+        except Exception:
+            # Fallback to the limits of this process.
+            logger.warning('fail to acquire lease [%s]', name, exc_info=1)
+            return True
+
+    def _start(self, job):
+        logger.info('start restore job [%s] for user [%s]', job.key, job.owner)
+        job.state = RUNNING
+        try:
+            self._check_cache_dir()
+            # Create the file to be followed before the process start. Make
+            # sure the file is created by us and readable only by us.
+            self._remove(job.part)
+            os.close(os.open(job.part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+            path, restore_as_of, encoding, kind, workers, level = job.args
+            job.process = spawn_restore(
+                path, restore_as_of, encoding, kind, output=job.part,
+                workers=workers, level=level,
+                temp_window=self.temp_window)
+        except Exception:
+            logger.exception('fail to start restore job [%s]', job.key)
+            self._finished(job, -1)
+            return
+        t = threading.Thread(target=self._wait, args=(job,), name='RestoreJob-' + job.key)
+        t.daemon = True
+        t.start()
+
+    def _wait(self, job):
+        # Renew the slots while the process is running.
+        renewed = time.time()
+        while job.process.poll() is None:
+            time.sleep(0.1)
+            if time.time() - renewed > _LEASE_TTL / 3:
+                for name in job.leases:
+                    self._acquire_lease(name)
+                renewed = time.time()
+        self._finished(job, job.process.returncode)
+
+    def _finished(self, job, returncode):
+        with self._lock:
+            if returncode == 0 and os.path.isfile(job.part):
+                os.rename(job.part, job.archive)
+                job.state = DONE
+                # Do not keep the archive if it doesn't fit in cache.
+                if job.size > self._cache_size * 1024 * 1024:
+                    self._evict(job)
+            else:
+                logger.warning('restore job [%s] failed with code [%s]', job.key, returncode)
+                job.state = FAILED
+                self._remove(job.part)
+            job.finished = time.time()
+            self._release_slots(job.leases)
+            self._schedule()
+            job._done.set()
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def cleanup(self):
+        """
+        Remove expired archives from the cache.
+        """
+        now = time.time()
+        ttl = self._cache_ttl
+        with self._lock:
+            for key, job in list(self._jobs.items()):
+                if job.state == FAILED or (job.state == DONE and job.finished + ttl < now):
+                    del self._jobs[key]
+                    self._remove(job.archive)
+            # Remove the archives left by a previous run or a dead worker.
+            # They are never served. Archives of other workers are removed
+            # once expired.
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                return
+            for name in names:
+                fn = os.path.join(self.cache_dir, name)
+                key, pid = _parse_name(name)
+                if pid == os.getpid():
+                    job = self._jobs.get(key)
+                    if job and fn in [job.archive, job.part]:
+                        continue
+                elif pid and _pid_exists(pid):
+                    try:
+                        if name.endswith(b'.part') or os.path.getmtime(fn) + ttl >= now:
+                            continue
+                    except OSError:
+                        continue
+                self._remove(fn)
+
+    def stop(self):
+        """
+        Kill running processes when the server stop.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.state == RUNNING and job.process:
+                    job.process.kill()
+                self._release_slots(job.leases)
+    stop.priority = 10
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Session storage using the database of rdiffweb. Used when multiple worker
+processes or nodes must share the user's sessions.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import logging
+import pickle
+import threading
+import time
+
+from cherrypy.lib.sessions import Session
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Number of locks shared by the sessions of a process.
+_LOCK_COUNT = 64
+
+
+def _timestamp(value):
+    return time.mktime(value.timetuple())
+
+
+class DbSession(Session):
+    """
+    Implementation of a cherrypy session storing the data into the `sessions`
+    table. The database backend is defined by `tools.sessions.database`.
+
+    Locks only apply to the threads of the current process. When two
+    processes update the same session at the same time, the record is locked
+    while saving and the changes of each request are merged into the data
+    saved by the other one.
+    """
+
+    # Database backend used to store the sessions.
+    database = None
+
+    # Encoded data as loaded from the database.
+    _loaded = None
+
+    # Sessions are locked using a fixed number of locks to avoid keeping a
+    # lock per session.
+    locks = [threading.RLock() for _unused in range(_LOCK_COUNT)]
+
+    def _lock(self):
+        return self.locks[hash(self.id) % _LOCK_COUNT]
+
+    def _exists(self):
+        return self.database.count('sessions', sessionid=self.id) > 0
+
+    def _load(self):
+        record = self.database.findone('sessions', sessionid=self.id)
+        if record is None:
+            return None
+        data = self._decode(record['data'])
+        if data is None:
+            return None
+        self._loaded = record['data']
+        return data, datetime.datetime.fromtimestamp(record['expirationtime'])
+
+    def _decode(self, value):
+        try:
+            return pickle.loads(base64.b64decode(value))
+        except Exception:
+            logger.warning('fail to load session [%s]', self.id, exc_info=1)
+            return None
+
+    def _merge(self, record):
+        """
+        Return the data to be saved: the changes made since the session was
+        loaded applied to the data saved by other processes in the meantime.
+        """
+        if record is None or record['data'] == self._loaded:
+            return self._data
+        stored = self._decode(record['data'])
+        if stored is None:
+            return self._data
+        original = (self._decode(self._loaded) if self._loaded else None) or {}
+        for key in set(original) - set(self._data):
+            stored.pop(key, None)
+        for key, value in self._data.items():
+            if key not in original or original[key] != value:
+                stored[key] = value
+        return stored
+
+    def _save(self, expiration_time):
+        expiration_time = _timestamp(expiration_time)
+        try:
+            self._save_locked(expiration_time)
+        except self.database.IntegrityError:
+            # Session created by another process in the meantime.
+            self._save_locked(expiration_time)
+
+    def _save_locked(self, expiration_time):
+        with self.database.transaction(immediate=True):
+            record = self.database.findone_for_update('sessions', sessionid=self.id)
+            # Use protocol 2 to be readable by python 2 and 3.
+            data = base64.b64encode(pickle.dumps(self._merge(record), 2)).decode('ascii')
+            if record is None:
+                self.database.insert('sessions', sessionid=self.id, data=data, expirationtime=expiration_time)
+            else:
+                self.database.update('sessions', sessionid=self.id, data=data, expirationtime=expiration_time)
+        self._loaded = data
+
+    def _delete(self):
+        self.database.delete('sessions', sessionid=self.id)
+
+    def acquire_lock(self):
+        """Acquire an exclusive lock on the currently-loaded session data."""
+        self._lock().acquire()
+        self.locked = True
+
+    def release_lock(self):
+        """Release the lock on the currently-loaded session data."""
+        self._lock().release()
+        self.locked = False
+
+    def clean_up(self):
+        """Clean up expired sessions."""
+        self.database.delete_expired('sessions', _timestamp(self.now()))
+
+    def __len__(self):
+        """Return the number of active sessions."""
+        return self.database.count('sessions')
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Background computation of the repositories status.
+
+Computing the status of a repository requires reading the `current_mirror`
+files and looking for the rdiff-backup process. Instead of doing it while
+serving the request, the status of every repository is computed on a
+schedule by a pool of threads and recorded in database. The pages read the
+status from the database, so it's available to every process whatever the
+number of repositories kept in memory (`RepoCacheSize`). When multiple
+processes share the same database, only the process holding the lease
+refreshes the status.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+from rdiffweb.core.config import IntOption
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+class StatusRefresher(SimplePlugin):
+    """
+    Plugin refreshing the status of every repository periodically.
+    """
+
+    _interval = IntOption("StatusRefreshInterval", 300)
+
+    _workers = IntOption("StatusRefreshWorkers", 4)
+
+    def __init__(self, bus, app):
+        SimplePlugin.__init__(self, bus)
+        self.app = app
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        """
+        True if the status is refreshed in background.
+        """
+        return self._interval > 0
+
+    def start(self):
+        if not self.enabled or self._thread:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(10)
+        self._thread = None
+
+    def refresh(self):
+        """
+        Refresh the status of every repository as soon as possible.
+        """
+        self._wakeup.set()
+
+    def refresh_all(self, pool=None):
+        """
+        Compute the status of every repository using the given pool of
+        threads. Return the number of repositories.
+        """
+        start = time.time()
+        repos = list(self.app.store.repos())
+        if pool:
+            pool.map(self._refresh, repos)
+        else:
+            for repo in repos:
+                self._refresh(repo)
+        logger.debug("status of %s repositories refreshed in %.3fs", len(repos), time.time() - start)
+        return len(repos)
+
+    def _refresh(self, repo):
+        if self._stopped.is_set():
+            return
+        try:
+            repo.refresh_status()
+        except Exception:
+            logger.warning("fail to refresh status of [%r]", repo, exc_info=1)
+
+    def _acquire_lease(self):
+        """
+        Return True if this process is elected to refresh the status.
+        """
+        try:
+            return self.app.store.acquire_lease(self.__class__.__name__, ttl=self._interval)
+        except Exception:
+            logger.warning("fail to acquire lease for [%s]", self.__class__.__name__, exc_info=1)
+            return False
+
+    def _run(self):
+        pool = ThreadPool(max(1, self._workers))
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                try:
+                    if self._acquire_lease():
+                        self.refresh_all(pool)
+                except Exception:
+                    logger.exception("fail to refresh repositories status")
+                self._wakeup.wait(self._interval)
+        finally:
+            pool.close()
+            pool.join()
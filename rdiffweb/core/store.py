@@ -23,7 +23,7 @@ import encodings
 from io import open
 import logging
 import os
-import sqlite3
+import socket
 import sys
 
 from future.utils import python_2_unicode_compatible
@@ -31,12 +31,13 @@ from future.utils.surrogateescape import encodefilename, decodefilename
 import pkg_resources
 
 from rdiffweb.core import RdiffError, authorizedkeys
-from rdiffweb.core.config import BoolOption, read_config, Option
+from rdiffweb.core.config import BoolOption, IntOption, read_config, Option
 from rdiffweb.core.i18n import ugettext as _
 from rdiffweb.core.ldap_auth import LdapPasswordStore
-from rdiffweb.core.librdiff import RdiffRepo, DoesNotExistError, \
+from rdiffweb.core.librdiff import RdiffRepo, RdiffTime, DoesNotExistError, \
     AccessDeniedError
 from rdiffweb.core.passwd import check_password, hash_password
+from rdiffweb.core.rdw_helpers import LRUCache
 
 # Define the logger
 logger = logging.getLogger(__name__)
@@ -45,6 +46,9 @@ SEP = b'/'
 
 MAX_DEPTH = 5
 
+# Maximum length of the error messages kept in database for each backup.
+_ERROR_EXCERPT_LENGTH = 2000
+
 DEFAULT_REPO_ENCODING = codecs.lookup((sys.getfilesystemencoding() or 'utf-8').lower()).name
 
 # Define roles
@@ -67,6 +71,16 @@ def normpath(val):
     return val
 
 
+def _status(criteria):
+    """
+    Return the status stored in database matching the given criteria. The
+    status of a repository is empty until computed by the `StatusRefresher`.
+    """
+    if criteria == 'unknown':
+        return ''
+    return criteria or None
+
+
 def _split_path(path):
     """
     Split the given path into <username as str> / <path as bytes>
@@ -182,7 +196,7 @@ class UserObject(object):
                     fingerprint=key.fingerprint,
                     key=key.getvalue())
                 assert inserted
-            except sqlite3.IntegrityError:  # @UndefinedVariable
+            except self._db.IntegrityError:
                 raise ValueError(_("Duplicate key. This key already exists or is associated to another user."))
         self._store._notify('user_attr_changed', self, {'authorizedkeys': True })
 
@@ -220,10 +234,12 @@ class UserObject(object):
 
         # Delete user from database (required).
         logger.info("deleting user [%s] from database", self.username)
-        self._db.delete('sshkeys', userid=self._userid)
-        self._db.delete('repos', userid=self._userid)
-        deleted = self._db.delete('users', userid=self._userid)
-        assert deleted, 'fail to delete user'
+        with self._db.transaction():
+            self._db.delete('sshkeys', userid=self._userid)
+            self._db.delete_backups(userid=self._userid)
+            self._db.delete('repos', userid=self._userid)
+            deleted = self._db.delete('users', userid=self._userid)
+            assert deleted, 'fail to delete user'
         self._store._notify('user_deleted', self.username)
         return True
 
@@ -443,8 +459,10 @@ class RepoObject(RdiffRepo):
         else:
             self._repo = data['repopath']
             self._record = data
-        RdiffRepo.__init__(self, user_obj.user_root, self._repo, encoding=DEFAULT_REPO_ENCODING)
+        RdiffRepo.__init__(self, user_obj.user_root, self._repo, encoding=DEFAULT_REPO_ENCODING, index_dir=user_obj._store._index_dir)
         self._encoding = self._get_encoding()
+        # Share repository data with other requests.
+        self.share_state(user_obj._store._repo_cache, (self._userid, self._repo), generation=self._get_attr('generation'))
 
     def __eq__(self, other):
         return (isinstance(other, RepoObject) and
@@ -456,7 +474,7 @@ class RepoObject(RdiffRepo):
 
     def _set_attr(self, key, value):
         """Used to define an attribute to the repository."""
-        assert key in ['encoding', 'maxage', 'keepdays'], 'invalid attribute:' + key
+        assert key in ['encoding', 'maxage', 'keepdays', 'status'], 'invalid attribute:' + key
         if key in ['maxage', 'keepdays']:
             value = int(value)
         updated = self._db.update('repos', **{'userid': self._userid, 'repopath': self._repo, key: value})
@@ -465,7 +483,7 @@ class RepoObject(RdiffRepo):
             self._record[key] = value
 
     def _get_attr(self, key, default=None):
-        assert key in ['encoding', 'maxage', 'keepdays'], 'invalid attribute:' + key
+        assert key in ['encoding', 'maxage', 'keepdays', 'status', 'repoid', 'generation'], 'invalid attribute:' + key
         if not self._record:
             self._record = self._db.findone('repos', userid=self._userid, repopath=self._repo)
         value = self._record.get(key, default)
@@ -477,6 +495,70 @@ class RepoObject(RdiffRepo):
     def displayname(self):
         return self._repo.strip('/')
 
+    @property
+    def status(self):
+        """
+        Return the status recorded in database by the `StatusRefresher` of
+        any process. The status is computed if never recorded or if the
+        status is not refreshed in background.
+        """
+        refresher = getattr(self._user_obj._store.app, 'status_refresher', None)
+        status = self._get_attr('status') if refresher and refresher.enabled else None
+        if not status:
+            return RdiffRepo.status.fget(self)
+        return self._status_message(status)
+
+    def refresh_status(self):
+        status = RdiffRepo.refresh_status(self)
+        # Keep the last known status in database to filter repositories.
+        if self._get_attr('status') != status:
+            self._set_attr('status', status)
+        self.update_backups()
+        return status
+
+    def update_backups(self):
+        """
+        Record the new backups of this repository in database with their size
+        and errors to show the status of many repositories without reading
+        rdiff-backup-data. The backups removed from the repository are
+        deleted. Nothing is done until rdiff-backup-data is modified. Many
+        processes may record the same backups at the same time.
+        """
+        if self._state.get('backups_updated'):
+            return
+        status = self.status[0]
+        # Computing the status may update the backups. Nothing to read if
+        # the repository doesn't exists.
+        if status == 'failed' or self._state.get('backups_updated'):
+            return
+        repoid = self._get_attr('repoid')
+        backup_dates = self.backup_dates
+        if status == 'in_progress':
+            # Wait for the backup in progress to complete.
+            backup_dates = backup_dates[:-1]
+        elif status == 'interrupted':
+            # Record the backups completed before the interrupted one.
+            mirrors = sorted(self._record_date(x) for x in self._get_records(b'current_mirror'))
+            completed = mirrors[0] if len(mirrors) > 1 else None
+            backup_dates = [d for d in backup_dates if completed and d <= completed]
+        last = self._db.find_backups(repoid=repoid, reverse=True, limit=1)
+        last = last[0]['backupdate'] if last else None
+        with self._db.transaction():
+            if backup_dates:
+                self._db.delete_backups(repoid=repoid, before=backup_dates[0].epoch())
+            for entry in self.get_history_entries(
+                    earliestDate=RdiffTime(last + 1) if last else None,
+                    latestDate=backup_dates[-1] if backup_dates else RdiffTime(0)):
+                errors = entry.errors if entry.has_errors else ''
+                self._db.insert_ignore(
+                    'backups',
+                    repoid=repoid,
+                    backupdate=entry.date.epoch(),
+                    size=entry.size,
+                    errors=1 if errors else 0,
+                    errorexcerpt=errors[:_ERROR_EXCERPT_LENGTH])
+        self._state['backups_updated'] = status != 'in_progress'
+
     @property
     def name(self):
         return self._repo
@@ -518,11 +600,24 @@ class RepoObject(RdiffRepo):
         self._set_attr('encoding', codec.name)
         self._encoding = codec
 
+    def clear_cache(self):
+        """
+        Discard the repository data shared with other requests. The
+        generation of the repository is incremented in the database to let
+        the other processes discard their own copy.
+        """
+        self._db.increment_generation(self._userid, self._repo)
+        self._record = self._db.findone('repos', userid=self._userid, repopath=self._repo)
+        self.share_state(self._user_obj._store._repo_cache, (self._userid, self._repo), force=True, generation=self._get_attr('generation'))
+
     def delete(self):
         """Properly remove the given repository by updating the user's repositories."""
         logger.info("deleting repository %s", self)
-        rowcount = self._db.delete('repos', userid=self._userid, repopath=self._repo)
-        assert rowcount, 'fail to delete repository'
+        with self._db.transaction():
+            self._db.delete_backups(repoid=self._get_attr('repoid'))
+            rowcount = self._db.delete('repos', userid=self._userid, repopath=self._repo)
+            assert rowcount, 'fail to delete repository'
+        self._user_obj._store._repo_cache.pop((self._userid, self._repo))
         RdiffRepo.delete(self)
 
     encoding = property(lambda x: x._encoding.name, _set_encoding)
@@ -536,15 +631,21 @@ class Store():
     """
 
     _db_file = Option("SQLiteDBFile", "/etc/rdiffweb/rdw.db")
+    _db_uri = Option("DatabaseURI")
+    _db_pool_size = IntOption("DatabasePoolSize", 10)
     _allow_add_user = BoolOption("AddMissingUser", False)
     _admin_user = Option("AdminUser", "admin")
+    _index_dir = Option("MetadataIndexDir")
+    _repo_cache_size = IntOption("RepoCacheSize", 1000)
+    _repo_cache_ttl = IntOption("RepoCacheTTL", 300)
 
     def __init__(self, app):
         self.app = app
-        from rdiffweb.core.store_sqlite import SQLiteBackend
-        self._database = SQLiteBackend(self._db_file)
+        self._database = self._create_backend()
         self._password_stores = [LdapPasswordStore(app)]
         self._change_listeners = []
+        # Repository data shared between requests.
+        self._repo_cache = LRUCache(self._repo_cache_size, self._repo_cache_ttl)
 
         # Register entry point.
         for entry_point in pkg_resources.iter_entry_points('rdiffweb.IUserChangeListener'):  # @UndefinedVariable
@@ -557,12 +658,55 @@ class Store():
             except:
                 logging.error("IUserChangeListener [%s] fail to load", entry_point)
 
+    def _create_backend(self):
+        """
+        Create the database backend according to `DatabaseURI`. Default to
+        the SQLite database defined by `SQLiteDBFile`. Other backends may be
+        registered with the entry point `rdiffweb.IDatabaseBackend` using the
+        URI scheme as name.
+        """
+        uri = self._db_uri
+        scheme = uri.split(':', 1)[0].lower() if uri else 'sqlite'
+        if scheme == 'sqlite':
+            from rdiffweb.core.store_sqlite import SQLiteBackend
+            db_file = uri[len('sqlite:///'):] if uri else self._db_file
+            return SQLiteBackend(db_file)
+        if scheme in ['postgres', 'postgresql']:
+            from rdiffweb.core.store_postgresql import PostgreSQLBackend
+            return PostgreSQLBackend(uri, pool_size=self._db_pool_size)
+        for entry_point in pkg_resources.iter_entry_points('rdiffweb.IDatabaseBackend', scheme):  # @UndefinedVariable
+            cls = entry_point.load()
+            return cls(self.app, uri)
+        raise ValueError('unsupported database: %s' % scheme)
+
     def create_admin_user(self):
         # Check if admin user exists. If not, created it.
         if not self.get_user(self._admin_user):
-            userobj = self.add_user(self._admin_user, 'admin123')
+            try:
+                userobj = self.add_user(self._admin_user, 'admin123')
+            except self._database.IntegrityError:
+                # Created by another process in the meantime.
+                return
             userobj.role = ADMIN_ROLE
 
+    def acquire_lease(self, name, ttl=3600):
+        """
+        Return True if this process is elected to run the job identified by
+        `name`. The lease is kept for `ttl` seconds in the database so a
+        single process run the job when multiple processes share the same
+        database.
+        """
+        return self._database.acquire_lease(name, self._lease_owner(), ttl)
+
+    def release_lease(self, name):
+        """
+        Release the lease identified by `name` if held by this process.
+        """
+        return self._database.release_lease(name, self._lease_owner())
+
+    def _lease_owner(self):
+        return '%s:%s' % (socket.gethostname(), os.getpid())
+
     def add_change_listener(self, listener):
         self._change_listeners.append(listener)
 
@@ -594,8 +738,45 @@ class Store():
     def count_users(self):
         return self._database.count('users')
 
-    def count_repos(self):
-        return self._database.count('repos')
+    def backups(self, user_obj, repo_obj=None, start=None, end=None, errors=None, limit=None, offset=0):
+        """
+        Return the backups recorded in database for the user's repositories
+        or a single repository, sorted by date. Each backup is a dict with
+        `repo`, `repo_name`, `date`, `size` and `errors`.
+
+        start: Define the epoch of the oldest backup to return.
+        end: Define the epoch of the most recent backup to return.
+        errors: Define if only backups with (True) or without (False) errors are returned.
+        limit: Define the maximum number of backups to return.
+        offset: Define the number of backups to skip.
+        """
+        records = self._database.find_backups(
+            userid=None if repo_obj else user_obj.userid,
+            repoid=repo_obj._get_attr('repoid') if repo_obj else None,
+            start=start, end=end, errors=errors, limit=limit, offset=offset)
+        repo_objs = {}
+        for record in records:
+            repopath = record['repopath']
+            if repopath not in repo_objs:
+                repo_objs[repopath] = repo_obj or RepoObject(user_obj, repopath)
+            yield {
+                "repo": repo_objs[repopath],
+                "repo_name": repo_objs[repopath].displayname,
+                "date": RdiffTime(record['backupdate']),
+                "size": record['size'],
+                "errors": record['errorexcerpt'] if record['errors'] else ''}
+
+    def count_backups(self, user_obj, repo_obj=None, start=None, end=None, errors=None):
+        """
+        Return the number of backups matching the criteria. See `backups`.
+        """
+        return self._database.count_backups(
+            userid=None if repo_obj else user_obj.userid,
+            repoid=repo_obj._get_attr('repoid') if repo_obj else None,
+            start=start, end=end, errors=errors)
+
+    def count_repos(self, search=None, criteria=None):
+        return self._database.count_repos(search=search, status=_status(criteria))
 
     def get_repo(self, name, as_user=None):
         """
@@ -671,24 +852,31 @@ class Store():
         for record in users:
             yield UserObject(self, record)
 
-    def repos(self, search=None, criteria=None):
+    def repos(self, search=None, criteria=None, limit=None, offset=0):
         """
         Quick listing of all the repository object for all user.
         
         search: Define a search term to look into path, email or username.
-        criteria: Define a search filter: ok, failed, interrupted, in_progress
-        """
-        if search:
-            repos = self._database.search('repos', search, 'RepoPath', 'username', 'useremail')
-        else:
-            repos = self._database.find('repos')
-
-        for record in repos:
-            user_record = self._database.findone('users', userid=record['userid'])
-            user_obj = UserObject(self, user_record)
-            repo_obj = RepoObject(user_obj, record)
-            if not criteria or criteria == repo_obj.status[0]:
-                yield repo_obj
+        criteria: Define a search filter: ok, failed, interrupted,
+        in_progress or unknown for the repositories not yet refreshed by the
+        `StatusRefresher`.
+        limit: Define the maximum number of repository to return.
+        offset: Define the number of repository to skip.
+        """
+        records = self._database.find_repos(search=search, status=_status(criteria), limit=limit, offset=offset)
+        return self._repo_objs(records)
+
+    def _repo_objs(self, records):
+        """
+        Create the repository objects from records joined with the owner.
+        """
+        users = {}
+        for record in records:
+            # Create a single user object per owner.
+            user_obj = users.get(record['userid'])
+            if user_obj is None:
+                user_obj = users[record['userid']] = UserObject(self, dict(record))
+            yield RepoObject(user_obj, record)
 
     def login(self, user, password):
         """
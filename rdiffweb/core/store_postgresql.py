@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+PostgreSQL database backend. Let multiple rdiffweb processes or nodes share
+the same database. Requires `psycopg2`.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import logging
+import os
+from threading import BoundedSemaphore, RLock, local
+
+from rdiffweb.core.store import USER_ROLE
+from rdiffweb.core.store_sql import SQLBackend
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Current version of the database. See `PostgreSQLBackend._migrate_*`.
+_DB_VERSION = 6
+
+# Identify the lock used to upgrade the database.
+_MIGRATION_LOCK = 0x72647765
+
+
+def _dict_rows(cursor):
+    """
+    Return the records of the cursor as dict.
+    """
+    columns = [col[0].lower() for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class PostgreSQLBackend(SQLBackend):
+    """
+    PostgreSQL data base backend to do CRUD operation. Connections are taken
+    from a pool shared by every thread.
+    """
+
+    _param = '%s'
+
+    _like = 'ILIKE'
+
+    def __init__(self, uri, pool_size=10):
+        if psycopg2 is None:
+            raise ImportError('psycopg2 is required to use a PostgreSQL database')
+        self.IntegrityError = psycopg2.IntegrityError
+        self._uri = uri
+        self._pool_size = max(1, pool_size)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = RLock()
+        self._slots = None
+        # Connection of the current transaction by thread.
+        self._local = local()
+        self._create_or_update()
+
+    def _get_pool(self):
+        """
+        Return the connection pool and the semaphore limiting the number of
+        connections in use. The pool is re-created after a fork.
+        """
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = psycopg2.pool.ThreadedConnectionPool(1, self._pool_size, self._uri)
+                self._pool_pid = os.getpid()
+                self._slots = BoundedSemaphore(self._pool_size)
+            return self._pool, self._slots
+
+    def _getconn(self):
+        """
+        Take a connection from the pool. Wait for a connection to be
+        available when all of them are in use.
+        """
+        pool, slots = self._get_pool()
+        slots.acquire()
+        try:
+            return pool, slots, pool.getconn()
+        except:
+            slots.release()
+            raise
+
+    def _putconn(self, pool, slots, conn):
+        """
+        Return the connection to the pool.
+        """
+        try:
+            pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            slots.release()
+
+    @contextmanager
+    def _connection(self):
+        """
+        Return the connection of the current transaction or a connection
+        from the pool.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        pool, slots, conn = self._getconn()
+        try:
+            conn.autocommit = True
+            yield conn
+        finally:
+            self._putconn(pool, slots, conn)
+
+    def close(self):
+        """
+        Close every connections of the pool.
+        """
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Execute the queries of the block in a single transaction. The
+        transaction is committed at the end of the block or rolled back when
+        an exception is raised. Nested blocks are part of the outer
+        transaction. `immediate` is ignored since records are locked using
+        `SELECT ... FOR UPDATE`.
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield
+            return
+        pool, slots, conn = self._getconn()
+        self._local.conn = conn
+        try:
+            conn.autocommit = False
+            yield
+            conn.commit()
+        except:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._putconn(pool, slots, conn)
+
+    def _fetchall(self, sql, args=[]):
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, args)
+                return _dict_rows(cursor)
+
+    def _rowcount(self, sql, args=[]):
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, args)
+                return cursor.rowcount
+
+    def _create_or_update(self):
+        """
+        Used to create or update the database. An advisory lock prevents
+        multiple nodes from upgrading the database at the same time.
+        """
+        with self.transaction():
+            self._fetchall('SELECT pg_advisory_xact_lock(%s)', [_MIGRATION_LOCK])
+            self._rowcount('CREATE TABLE IF NOT EXISTS schema_version (version integer NOT NULL)')
+            rows = self._fetchall('SELECT version FROM schema_version')
+            if not rows:
+                self._rowcount('INSERT INTO schema_version (version) VALUES (0)')
+            version = rows[0]['version'] if rows else 0
+            for version in range(version + 1, _DB_VERSION + 1):
+                logger.info('upgrading database to version %s', version)
+                getattr(self, '_migrate_%d' % version)()
+                self._rowcount('UPDATE schema_version SET version = %s', [version])
+            # The extension may be available since the migration.
+            if version >= 3 and not self._fetchall("SELECT 1 FROM pg_indexes WHERE indexname = 'idx_users_username_trgm'"):
+                self._create_trgm_indexes()
+
+    def _migrate_1(self):
+        """
+        Create the tables.
+        """
+        self._rowcount("""CREATE TABLE users (
+UserID serial primary key,
+Username varchar (50) unique NOT NULL,
+Password varchar (40) NOT NULL DEFAULT '',
+UserRoot varchar (255) NOT NULL DEFAULT '',
+IsAdmin smallint NOT NULL DEFAULT 0,
+UserEmail varchar (255) NOT NULL DEFAULT '',
+RestoreFormat smallint NOT NULL DEFAULT 1,
+Role smallint NOT NULL DEFAULT %d)""" % USER_ROLE)
+        self._rowcount("""CREATE TABLE repos (
+RepoID serial primary key,
+UserID integer NOT NULL,
+RepoPath varchar (255) NOT NULL,
+MaxAge smallint NOT NULL DEFAULT 0,
+Encoding varchar (30) NOT NULL DEFAULT '',
+KeepDays varchar (255) NOT NULL DEFAULT '',
+Status varchar (20) NOT NULL DEFAULT '')""")
+        self._rowcount("""CREATE TABLE sshkeys (
+Fingerprint varchar (255) primary key,
+Key text UNIQUE,
+UserID integer NOT NULL)""")
+
+    def _migrate_2(self):
+        """
+        Create the indexes.
+        """
+        self._rowcount('CREATE UNIQUE INDEX idx_repos_userid_repopath ON repos (UserID, RepoPath)')
+        self._rowcount('CREATE INDEX idx_repos_status ON repos (Status)')
+        self._rowcount('CREATE INDEX idx_sshkeys_userid ON sshkeys (UserID)')
+
+    def _migrate_3(self):
+        """
+        Create trigram indexes to search users and repositories.
+        """
+        self._create_trgm_indexes()
+
+    def _create_trgm_indexes(self):
+        """
+        Create the missing trigram indexes. Creating the extension may require
+        privileges, the search still works without it.
+        """
+        self._rowcount('SAVEPOINT pg_trgm')
+        try:
+            self._rowcount('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except psycopg2.Error:
+            logger.warning('fail to create pg_trgm extension, search will not be indexed')
+            self._rowcount('ROLLBACK TO SAVEPOINT pg_trgm')
+            return
+        self._rowcount('RELEASE SAVEPOINT pg_trgm')
+        self._rowcount('CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING gin (Username gin_trgm_ops)')
+        self._rowcount('CREATE INDEX IF NOT EXISTS idx_users_useremail_trgm ON users USING gin (UserEmail gin_trgm_ops)')
+        self._rowcount('CREATE INDEX IF NOT EXISTS idx_repos_repopath_trgm ON repos USING gin (RepoPath gin_trgm_ops)')
+
+    def _migrate_4(self):
+        """
+        Create the tables used to share sessions and leases between multiple
+        processes.
+        """
+        self._rowcount("""CREATE TABLE sessions (
+SessionID varchar (64) primary key,
+Data text NOT NULL,
+ExpirationTime double precision NOT NULL)""")
+        self._rowcount('CREATE INDEX idx_sessions_expirationtime ON sessions (ExpirationTime)')
+        self._rowcount("""CREATE TABLE leases (
+Name varchar (50) primary key,
+Owner varchar (255) NOT NULL,
+ExpirationTime double precision NOT NULL)""")
+
+    def _migrate_5(self):
+        """
+        Create the table of backups used to show the status of the
+        repositories without reading the rdiff-backup-data directories.
+        """
+        self._rowcount("""CREATE TABLE backups (
+RepoID integer NOT NULL,
+BackupDate integer NOT NULL,
+Size bigint NOT NULL DEFAULT 0,
+Errors smallint NOT NULL DEFAULT 0,
+ErrorExcerpt text NOT NULL DEFAULT '',
+PRIMARY KEY (RepoID, BackupDate))""")
+        self._rowcount('CREATE INDEX idx_backups_backupdate ON backups (BackupDate)')
+
+    def _migrate_6(self):
+        """
+        Add the generation of the repositories incremented when the
+        repository data is modified to discard the data cached by every
+        process.
+        """
+        self._rowcount('ALTER TABLE repos ADD COLUMN Generation bigint NOT NULL DEFAULT 0')
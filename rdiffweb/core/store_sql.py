@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Interface of the database backends used by the store.
+
+`SQLBackend` implements the CRUD operations with plain SQL queries. A backend
+only has to provide the connection handling (`_fetchall`, `_rowcount`,
+`transaction`) and create the schema.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import time
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# List of tables
+_TABLES = ['users', 'repos', 'sshkeys', 'sessions', 'leases', 'backups']
+
+
+def _validate_model(model):
+    if model not in _TABLES:
+        raise ValueError(model + " is not a valid table name")
+
+
+class SQLBackend(object):
+    """
+    Database backend to do CRUD operation.
+    """
+
+    # Raised when a unique constraint is violated.
+    IntegrityError = Exception
+
+    # Placeholder used for query parameters.
+    _param = '?'
+
+    # Operator used to search a value.
+    _like = 'LIKE'
+
+    # Statement and clause used to insert a record unless it already exists.
+    _insert_ignore = ('INSERT INTO ', ' ON CONFLICT DO NOTHING')
+
+    # Clause used to lock the selected records until the end of the transaction.
+    _for_update = ' FOR UPDATE'
+
+    def _fetchall(self, sql, args=[]):
+        """
+        Execute the query and return the records as dict.
+        """
+        raise NotImplementedError()
+
+    def _rowcount(self, sql, args=[]):
+        """
+        Execute the query and return the number of rows modified.
+        """
+        raise NotImplementedError()
+
+    def transaction(self, immediate=False):
+        """
+        Return a context manager to execute the queries of the block in a
+        single transaction. When `immediate` is True, the database is locked
+        for writing at the beginning of the transaction if the backend
+        doesn't support locking the records.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Release the connections.
+        """
+
+    def _where(self, fields):
+        """
+        Create the WHERE clause from the given fields.
+        """
+        if not fields:
+            return ""
+        return " WHERE " + ' AND '.join(['%s = %s' % (f, self._param) for f in fields])
+
+    def _get_id(self, model, **kwargs):
+        """
+        Return the primary key fields of the given model.
+        """
+        _validate_model(model)
+        if 'users' == model:
+            if 'userid' in kwargs:
+                return ['userid']
+            return ['username']
+        elif 'repos' == model:
+            if 'repoid' in kwargs:
+                return ['repoid']
+            return ['userid', 'repopath']
+        elif 'sshkeys' == model:
+            return ['fingerprint']
+        elif 'sessions' == model:
+            return ['sessionid']
+        elif 'leases' == model:
+            return ['name']
+        elif 'backups' == model:
+            return ['repoid', 'backupdate']
+        return None
+
+    def _search_where(self, value, in_fields):
+        """
+        Build the condition to search `value` in the given fields.
+        """
+        value = '%' + value.replace('%', '').replace('_', '') + '%'
+        clause = ' OR '.join(['%s %s %s' % (x, self._like, self._param) for x in in_fields])
+        return '(' + clause + ')', [value] * len(in_fields)
+
+    def _repos_query(self, select, search=None, status=None):
+        """
+        Build the query to list repositories with their owner.
+        """
+        query = select + " FROM repos JOIN users ON repos.UserID = users.UserID"
+        where = []
+        args = []
+        if search:
+            clause, search_args = self._search_where(search, ['RepoPath', 'Username', 'UserEmail'])
+            where.append(clause)
+            args.extend(search_args)
+        if status is not None:
+            where.append("repos.Status = " + self._param)
+            args.append(status)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return query, args
+
+    def _backups_query(self, select, userid=None, repoid=None, start=None, end=None, errors=None):
+        """
+        Build the query to list the backups with the repository path.
+        """
+        query = select + " FROM backups JOIN repos ON backups.RepoID = repos.RepoID"
+        where = []
+        args = []
+        for clause, value in [
+                ("repos.UserID = %s", userid),
+                ("backups.RepoID = %s", repoid),
+                ("backups.BackupDate >= %s", start),
+                ("backups.BackupDate <= %s", end)]:
+            if value is not None:
+                where.append(clause % self._param)
+                args.append(value)
+        if errors is not None:
+            where.append("backups.Errors = %s" % self._param)
+            args.append(1 if errors else 0)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return query, args
+
+    def count(self, model, **kwargs):
+        """
+        Return the number of record matching the given model and criteria.
+        """
+        _validate_model(model)
+        query = "SELECT COUNT(*) as count FROM " + model + self._where(kwargs.keys())
+        return self._fetchall(query, list(kwargs.values()))[0]['count']
+
+    def acquire_lease(self, name, owner, ttl):
+        """
+        Try to acquire or renew the lease identified by `name` for `ttl`
+        seconds. Return True if `owner` holds the lease. Used to elect a
+        single process to run a job when multiple processes share the same
+        database.
+        """
+        now = time.time()
+        updated = self._rowcount(
+            "UPDATE leases SET Owner = {p}, ExpirationTime = {p} WHERE Name = {p} AND (ExpirationTime < {p} OR Owner = {p})".format(p=self._param),
+            [owner, now + ttl, name, now, owner])
+        if updated:
+            return True
+        try:
+            return bool(self.insert('leases', name=name, owner=owner, expirationtime=now + ttl))
+        except self.IntegrityError:
+            # Lease is owned by another process.
+            return False
+
+    def release_lease(self, name, owner):
+        """
+        Release the lease identified by `name` if held by `owner`.
+        """
+        return bool(self.delete('leases', name=name, owner=owner))
+
+    def count_backups(self, userid=None, repoid=None, start=None, end=None, errors=None):
+        """
+        Return the number of backups matching the criteria.
+        """
+        query, args = self._backups_query("SELECT COUNT(*) as count", userid, repoid, start, end, errors)
+        return self._fetchall(query, args)[0]['count']
+
+    def count_repos(self, search=None, status=None):
+        """
+        Return the number of repositories matching the search term and status.
+        """
+        query, args = self._repos_query("SELECT COUNT(*) as count", search, status)
+        return self._fetchall(query, args)[0]['count']
+
+    def delete(self, model, **kwargs):
+        _validate_model(model)
+        query = "DELETE FROM " + model + self._where(kwargs.keys())
+        return self._rowcount(query, list(kwargs.values()))
+
+    def delete_backups(self, userid=None, repoid=None, before=None):
+        """
+        Delete the backups of a user or a repository. Use `before` to only
+        delete the backups older than the given epoch.
+        """
+        where = []
+        args = []
+        if userid is not None:
+            where.append("RepoID IN (SELECT RepoID FROM repos WHERE UserID = %s)" % self._param)
+            args.append(userid)
+        if repoid is not None:
+            where.append("RepoID = " + self._param)
+            args.append(repoid)
+        if before is not None:
+            where.append("BackupDate < " + self._param)
+            args.append(before)
+        assert where
+        return self._rowcount("DELETE FROM backups WHERE " + " AND ".join(where), args)
+
+    def delete_expired(self, model, now):
+        """
+        Delete the records with an expiration time older than `now`.
+        """
+        _validate_model(model)
+        return self._rowcount("DELETE FROM " + model + " WHERE ExpirationTime < " + self._param, [now])
+
+    def find(self, model, **kwargs):
+        _validate_model(model)
+        query = "SELECT * FROM " + model + self._where(kwargs.keys())
+        return self._fetchall(query, list(kwargs.values()))
+
+    def find_backups(self, userid=None, repoid=None, start=None, end=None, errors=None, reverse=False, limit=None, offset=0):
+        """
+        Return the backups matching the criteria sorted by date, joined
+        with the repository path.
+        """
+        query, args = self._backups_query("SELECT repos.RepoPath, repos.UserID, backups.*", userid, repoid, start, end, errors)
+        query += " ORDER BY backups.BackupDate" + (" DESC" if reverse else "") + ", backups.RepoID"
+        if limit:
+            query += " LIMIT %s OFFSET %s" % (self._param, self._param)
+            args.extend([limit, offset])
+        return self._fetchall(query, args)
+
+    def find_repos(self, search=None, status=None, limit=None, offset=0):
+        """
+        Return the repositories records joined with the owner's record in a
+        single query. The search term is looked into the repository path,
+        the username and the email.
+        """
+        query, args = self._repos_query("SELECT users.*, repos.*", search, status)
+        query += " ORDER BY repos.RepoID"
+        if limit:
+            query += " LIMIT %s OFFSET %s" % (self._param, self._param)
+            args.extend([limit, offset])
+        return self._fetchall(query, args)
+
+    def findone(self, model, **kwargs):
+        _validate_model(model)
+        query = "SELECT * FROM " + model + self._where(kwargs.keys()) + " LIMIT 1"
+        record = self._fetchall(query, list(kwargs.values()))
+        if record:
+            return record[0]
+        return None
+
+    def findone_for_update(self, model, **kwargs):
+        """
+        Same as `findone()` but lock the record until the end of the
+        transaction. Must be called within an immediate `transaction()`.
+        """
+        _validate_model(model)
+        query = "SELECT * FROM " + model + self._where(kwargs.keys()) + " LIMIT 1" + self._for_update
+        record = self._fetchall(query, list(kwargs.values()))
+        if record:
+            return record[0]
+        return None
+
+    def increment_generation(self, userid, repopath):
+        """
+        Increment the generation of the repository to notify the other
+        processes that the repository data was modified.
+        """
+        return self._rowcount(
+            "UPDATE repos SET Generation = Generation + 1 WHERE UserID = %s AND RepoPath = %s" % (self._param, self._param),
+            [userid, repopath])
+
+    def insert(self, model, **kwargs):
+        _validate_model(model)
+        query = "INSERT INTO " + model + " (" + ','.join(kwargs.keys()) + ") values (" + ','.join([self._param] * len(kwargs)) + ")"
+        return self._rowcount(query, args=list(kwargs.values()))
+
+    def insert_ignore(self, model, **kwargs):
+        """
+        Insert the record unless it conflicts with an existing one. Return
+        the number of records inserted.
+        """
+        _validate_model(model)
+        query = self._insert_ignore[0] + model + " (" + ','.join(kwargs.keys()) + ") values (" + ','.join([self._param] * len(kwargs)) + ")" + self._insert_ignore[1]
+        return self._rowcount(query, args=list(kwargs.values()))
+
+    def search(self, model, value, *in_fields):
+        """
+        Search the `value` in the `in_fields`.
+        """
+        _validate_model(model)
+        clause, args = self._search_where(value, in_fields)
+        # Make a JOIN for repos model.
+        if model == 'repos':
+            query = "SELECT * FROM users, repos WHERE repos.UserID = users.UserID AND " + clause
+        else:
+            query = "SELECT * FROM " + model + " WHERE " + clause
+        return self._fetchall(query, args)
+
+    def update(self, model, **kwargs):
+        """
+        Update a single object identified using the modelid.
+        """
+        _validate_model(model)
+        # Get model identity
+        keys = self._get_id(model, **kwargs)
+        query = "UPDATE " + model + " SET " + ', '.join(['%s=%s' % (k, self._param) for k in kwargs.keys() if k not in keys]) + self._where(keys)
+        return self._rowcount(query, [v for k, v in kwargs.items() if k not in keys] + [kwargs.get(k) for k in keys])
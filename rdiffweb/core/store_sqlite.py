@@ -18,23 +18,41 @@
 
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
 import logging
+import os
 import sqlite3
 import sys
-from threading import RLock
+from threading import RLock, local
 
 from rdiffweb.core.store import ADMIN_ROLE, USER_ROLE
+from rdiffweb.core.store_sql import SQLBackend
 
 
 # Define the logger
 logger = logging.getLogger(__name__)
 
-# List of tables
-_TABLES = ['users', 'repos', 'sshkeys']
-
 # Check if python2
 PY2 = sys.version_info[0] == 2
 
+# Number of prepared statements kept by each connection.
+_CACHED_STATEMENTS = 200
+
+# Number of seconds to wait for a lock on the database.
+_TIMEOUT = 30
+
+# Current version of the database. See `SQLiteBackend._migrate_*`.
+_DB_VERSION = 6
+
+# Full text search tables: (table, primary key, columns)
+_FTS_TABLES = [
+    ('users', 'UserID', ['Username', 'UserEmail']),
+    ('repos', 'RepoID', ['RepoPath']),
+]
+
+# Minimum length of the search term to use full text search.
+_FTS_MIN_LENGTH = 3
+
 
 def _dict_factory(cursor, row):
     """
@@ -51,24 +69,18 @@ def _dict_factory(cursor, row):
     return d
 
 
-def _validate_model(model):
-    if model not in _TABLES:
-        raise ValueError(model + " is not a valid table name")
-
-
-def _where(fields):
+class SQLiteBackend(SQLBackend):
     """
-    Create the WHERE clause from the given fields.
+    SQLite data base backend to do CRUD operation.
     """
-    if not fields:
-        return ""
-    return " WHERE " + ' AND '.join(['%s = ?' % f for f in fields])
 
+    IntegrityError = sqlite3.IntegrityError
 
-class SQLiteBackend():
-    """
-    SQLite data base backend to do CRUD operation.
-    """
+    # ON CONFLICT clause requires SQLite 3.24.
+    _insert_ignore = ('INSERT OR IGNORE INTO ', '')
+
+    # Records can't be locked, the database is locked by immediate transactions.
+    _for_update = ''
 
     def __init__(self, db_file):
         """
@@ -77,50 +89,108 @@ class SQLiteBackend():
         self._db_file = db_file
         # Declare a lock.
         self.create_tables_lock = RLock()
+        # Keep one connection per thread.
+        self._local = local()
         self._create_or_update()
 
-    def _get_id(self, model, **kwargs):
-        """
-        Return the primary key fields of the given model.
-        """
-        _validate_model(model)
-        if 'users' == model:
-            if 'userid' in kwargs:
-                return ['userid']
-            return ['username']
-        elif 'repos' == model:
-            if 'repoid' in kwargs:
-                return ['repoid']
-            return ['userid', 'repopath']
-        elif 'sshkeys' == model:
-            return ['fingerprint']
-        return None
-
     def _connect(self):
         """
-        Called to create a new connection to database.
+        Return the connection of the current thread. A new connection is
+        created the first time it's called by a thread. The connection is
+        re-created after a fork.
         """
-        conn = sqlite3.connect(self._db_file)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(
+            self._db_file,
+            timeout=_TIMEOUT,
+            cached_statements=_CACHED_STATEMENTS)
         conn.isolation_level = None
+        conn.row_factory = _dict_factory
+        # Let readers and writer work concurrently.
+        if self._db_file != ':memory:':
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.OperationalError:
+                # Another process is changing the journal mode.
+                logger.debug('fail to enable WAL journal mode', exc_info=1)
+            conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        self._local.depth = 0
         return conn
 
+    def close(self):
+        """
+        Close the connection of the current thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Execute the queries of the block in a single transaction. The
+        transaction is committed at the end of the block or rolled back when
+        an exception is raised. Nested blocks are part of the outer
+        transaction. When `immediate` is True, the database is locked for
+        writing at the beginning of the transaction.
+        """
+        conn = self._connect()
+        self._local.depth += 1
+        try:
+            if self._local.depth == 1:
+                conn.execute('BEGIN IMMEDIATE TRANSACTION' if immediate else 'BEGIN TRANSACTION')
+            yield
+            if self._local.depth == 1:
+                conn.execute('COMMIT TRANSACTION')
+        except:
+            if self._local.depth == 1:
+                try:
+                    conn.execute('ROLLBACK TRANSACTION')
+                except sqlite3.OperationalError:
+                    # Transaction may be rolled back already.
+                    pass
+            raise
+        finally:
+            self._local.depth -= 1
+
     def _create_or_update(self):
         """
-        Used to create or update the database.
+        Used to create or update the database. Each migration is executed
+        once and the version of the database is kept in `user_version`.
         """
 
         # To avoid re-creating the table twice.
         with self.create_tables_lock:
-            # Check if tables exists, if not created them.
-            tables = self._get_tables()
-
-            # Create the tables.
-            conn = self._connect()
-            cursor = conn.cursor()
-            try:
-                if not tables:
-                    cursor.execute("BEGIN TRANSACTION")
-                    cursor.execute("""create table users (
+            # Lock the database to prevent other processes from upgrading the
+            # database at the same time.
+            with self.transaction(immediate=True):
+                version = self._fetchall('PRAGMA user_version')[0]['user_version']
+                for version in range(version + 1, _DB_VERSION + 1):
+                    logger.info('upgrading database to version %s', version)
+                    getattr(self, '_migrate_%d' % version)()
+                    self._rowcount('PRAGMA user_version = %d' % version)
+                # Full text search may be supported since the migration if
+                # SQLite was upgraded.
+                tables = self._get_tables()
+                if version >= 3 and any(table + '_fts' not in tables for table, unused, unused in _FTS_TABLES):
+                    self._create_fts()
+            # Check if full text search is available.
+            self._fts = 'users_fts' in self._get_tables()
+
+    def _migrate_1(self):
+        """
+        Create the tables. For database created before the versioning, the
+        missing tables and columns are added.
+        """
+        # Check if tables exists, if not created them.
+        tables = self._get_tables()
+        if 'users' not in tables:
+            self._rowcount("""create table users (
 UserID integer primary key autoincrement,
 Username varchar (50) unique NOT NULL,
 Password varchar (40) NOT NULL DEFAULT "",
@@ -128,33 +198,140 @@ UserRoot varchar (255) NOT NULL DEFAULT "",
 IsAdmin tinyint NOT NULL DEFAULT FALSE,
 UserEmail varchar (255) NOT NULL DEFAULT "",
 RestoreFormat tinyint NOT NULL DEFAULT TRUE)""")
-                    cursor.execute("""create table repos (
+        if 'repos' not in tables:
+            self._rowcount("""create table repos (
 RepoID integer primary key autoincrement,
 UserID int(11) NOT NULL,
 RepoPath varchar (255) NOT NULL,
 MaxAge tinyint NOT NULL DEFAULT 0,
 Encoding varchar (50))""")
-                    cursor.execute("COMMIT TRANSACTION")
 
-                # Create `keepdays` columns in repos
-                self._create_column('repos', 'keepdays')
-                self._create_column('repos', 'encoding', datatype='varchar(30)')
+        # Create `keepdays` columns in repos
+        self._create_column('repos', 'keepdays')
+        self._create_column('repos', 'encoding', datatype='varchar(30)')
+        # Create `status` column to filter repositories by status.
+        self._create_column('repos', 'status', datatype='varchar(20)')
 
-                # Create table for ssh Keys
-                if 'sshkeys' not in tables:
-                    cursor.execute("""create table sshkeys (
+        # Create table for ssh Keys
+        if 'sshkeys' not in tables:
+            self._rowcount("""create table sshkeys (
 Fingerprint primary key,
 Key clob UNIQUE,
 UserID int(11) NOT NULL)""")
 
-                # Create column for roles using "isadmin" column. Keep the
-                # original column in case we need to revert to previous version. 
-                if 'role'.lower() not in self._get_columns('users'):
-                    self._rowcount('ALTER TABLE users ADD COLUMN role tinyint NOT NULL DEFAULT "%s"' % (USER_ROLE,))
-                    cursor.execute('UPDATE users SET role = %s WHERE isadmin=1' % (ADMIN_ROLE,))
+        # Create column for roles using "isadmin" column. Keep the
+        # original column in case we need to revert to previous version. 
+        if 'role'.lower() not in self._get_columns('users'):
+            self._rowcount('ALTER TABLE users ADD COLUMN role tinyint NOT NULL DEFAULT "%s"' % (USER_ROLE,))
+            self._rowcount('UPDATE users SET role = %s WHERE isadmin=1' % (ADMIN_ROLE,))
+
+    def _migrate_2(self):
+        """
+        Create the indexes.
+        """
+        # Merge duplicate repositories before creating the unique index. The
+        # oldest record is kept with the settings defined by the others.
+        kept = {}
+        for record in self._fetchall("""SELECT repos.* FROM repos JOIN (
+SELECT UserID, RepoPath FROM repos GROUP BY UserID, RepoPath HAVING COUNT(*) > 1) duplicates
+ON repos.UserID = duplicates.UserID AND repos.RepoPath = duplicates.RepoPath
+ORDER BY repos.RepoID"""):
+            key = (record['userid'], record['repopath'])
+            if key not in kept:
+                kept[key] = dict((c, record[c]) for c in ['repoid', 'maxage', 'keepdays', 'encoding'])
+                continue
+            repo = kept[key]
+            for column in ['maxage', 'keepdays', 'encoding']:
+                if not repo[column] and record[column]:
+                    repo[column] = record[column]
+                    self._rowcount('UPDATE repos SET %s = ? WHERE RepoID = ?' % column, [record[column], repo['repoid']])
+            self._rowcount('DELETE FROM repos WHERE RepoID = ?', [record['repoid']])
+            logger.warning(
+                'duplicate repository [%s] of user [%s] with id [%s] merged into id [%s]',
+                record['repopath'], record['userid'], record['repoid'], repo['repoid'])
+        self._rowcount('CREATE UNIQUE INDEX IF NOT EXISTS idx_repos_userid_repopath ON repos (UserID, RepoPath)')
+        self._rowcount('CREATE INDEX IF NOT EXISTS idx_repos_status ON repos (Status)')
+        self._rowcount('CREATE INDEX IF NOT EXISTS idx_sshkeys_userid ON sshkeys (UserID)')
+
+    def _migrate_3(self):
+        """
+        Create the full text search tables to search users and repositories.
+        """
+        self._create_fts()
 
-            finally:
-                conn.close()
+    def _create_fts(self):
+        """
+        Create the missing full text search tables. The tables are kept up to
+        date using triggers. Nothing is created if not supported by SQLite.
+        """
+        tables = self._get_tables()
+        for table, rowid, columns in _FTS_TABLES:
+            if table + '_fts' in tables:
+                continue
+            try:
+                self._rowcount(
+                    "CREATE VIRTUAL TABLE %s_fts USING fts5(%s, content='%s', content_rowid='%s', tokenize='trigram')" %
+                    (table, ', '.join(columns), table, rowid))
+            except sqlite3.OperationalError:
+                logger.warning('full text search is not supported by SQLite %s', sqlite3.sqlite_version)
+                return
+            new_values = ', '.join(['new.' + c for c in columns])
+            old_values = ', '.join(['old.' + c for c in columns])
+            values = {
+                'table': table,
+                'rowid': rowid,
+                'columns': ', '.join(columns),
+                'new': new_values,
+                'old': old_values}
+            self._rowcount("""CREATE TRIGGER IF NOT EXISTS %(table)s_fts_insert AFTER INSERT ON %(table)s BEGIN
+INSERT INTO %(table)s_fts (rowid, %(columns)s) VALUES (new.%(rowid)s, %(new)s);
+END""" % values)
+            self._rowcount("""CREATE TRIGGER IF NOT EXISTS %(table)s_fts_delete AFTER DELETE ON %(table)s BEGIN
+INSERT INTO %(table)s_fts (%(table)s_fts, rowid, %(columns)s) VALUES ('delete', old.%(rowid)s, %(old)s);
+END""" % values)
+            self._rowcount("""CREATE TRIGGER IF NOT EXISTS %(table)s_fts_update AFTER UPDATE OF %(columns)s ON %(table)s BEGIN
+INSERT INTO %(table)s_fts (%(table)s_fts, rowid, %(columns)s) VALUES ('delete', old.%(rowid)s, %(old)s);
+INSERT INTO %(table)s_fts (rowid, %(columns)s) VALUES (new.%(rowid)s, %(new)s);
+END""" % values)
+            # Index existing records.
+            self._rowcount("INSERT INTO %s_fts (%s_fts) VALUES ('rebuild')" % (table, table))
+
+    def _migrate_4(self):
+        """
+        Create the tables used to share sessions and leases between multiple
+        processes.
+        """
+        self._rowcount("""CREATE TABLE sessions (
+SessionID varchar (64) primary key,
+Data text NOT NULL,
+ExpirationTime real NOT NULL)""")
+        self._rowcount('CREATE INDEX idx_sessions_expirationtime ON sessions (ExpirationTime)')
+        self._rowcount("""CREATE TABLE leases (
+Name varchar (50) primary key,
+Owner varchar (255) NOT NULL,
+ExpirationTime real NOT NULL)""")
+
+    def _migrate_5(self):
+        """
+        Create the table of backups used to show the status of the
+        repositories without reading the rdiff-backup-data directories.
+        """
+        self._rowcount("""CREATE TABLE backups (
+RepoID integer NOT NULL,
+BackupDate integer NOT NULL,
+Size integer NOT NULL DEFAULT 0,
+Errors smallint NOT NULL DEFAULT 0,
+ErrorExcerpt text NOT NULL DEFAULT '',
+PRIMARY KEY (RepoID, BackupDate))""")
+        self._rowcount('CREATE INDEX idx_backups_backupdate ON backups (BackupDate)')
+
+    def _migrate_6(self):
+        """
+        Add the generation of the repositories incremented when the
+        repository data is modified to discard the data cached by every
+        process.
+        """
+        self._rowcount('ALTER TABLE repos ADD COLUMN Generation integer NOT NULL DEFAULT 0')
 
     def _create_column(self, table, column, datatype='varchar(255)'):
         """
@@ -167,15 +344,11 @@ UserID int(11) NOT NULL)""")
         self._rowcount('ALTER TABLE %s ADD COLUMN %s %s NOT NULL DEFAULT ""' % (table, column, datatype,))
 
     def _fetchall(self, sql, args=[]):
-        conn = self._connect()
-        conn.row_factory = _dict_factory
+        cursor = self._connect().execute(sql, args)
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, args)
-            # We want to return either the rowcount or the list or record.
             return cursor.fetchall()
         finally:
-            conn.close()
+            cursor.close()
 
     def _get_columns(self, table):
         """
@@ -190,64 +363,29 @@ UserID int(11) NOT NULL)""")
             self._fetchall('SELECT name FROM sqlite_master WHERE type="table"')]
 
     def _rowcount(self, sql, args=[]):
-        conn = self._connect()
+        cursor = self._connect().execute(sql, args)
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, args)
             return cursor.rowcount
         finally:
-            conn.close()
-
-    def count(self, model, **kwargs):
-        """
-        Return the number of record matching the given model and criteria.
-        """
-        _validate_model(model)
-        query = "SELECT COUNT(*) as count FROM " + model + _where(kwargs.keys())
-        return self._fetchall(query, list(kwargs.values()))[0]['count']
-
-    def delete(self, model, **kwargs):
-        _validate_model(model)
-        query = "DELETE FROM " + model + _where(kwargs.keys())
-        return self._rowcount(query, list(kwargs.values()))
-
-    def find(self, model, **kwargs):
-        _validate_model(model)
-        query = "SELECT * FROM " + model + _where(kwargs.keys())
-        return self._fetchall(query, list(kwargs.values()))
-
-    def findone(self, model, **kwargs):
-        _validate_model(model)
-        query = "SELECT * FROM " + model + _where(kwargs.keys()) + " LIMIT 1"
-        record = self._fetchall(query, list(kwargs.values()))
-        if record:
-            return record[0]
-        return None
-
-    def insert(self, model, **kwargs):
-        _validate_model(model)
-        query = "INSERT INTO " + model + " (" + ','.join(kwargs.keys()) + ") values (" + ','.join('?' * len(kwargs)) + ")"
-        return self._rowcount(query, args=list(kwargs.values()))
-
-    def search(self, model, value, *in_fields):
-        """
-        Search the `value` in the `in_fields`.
-        """
-        _validate_model(model)
-        value = '%' + value.replace('%', '').replace('_', '') + '%'
-        # Build the query
-        query = "SELECT * FROM " + model + " WHERE " + ' OR '.join(['%s LIKE ?' % x for x in in_fields])
-        # Make a JOIN for repos model.
-        if model == 'repos':
-            query = "SELECT * FROM users, repos WHERE repos.UserID = users.UserID AND " + ' OR '.join(['%s LIKE ?' % x for x in in_fields])
-        return self._fetchall(query, [value] * len(in_fields))
+            cursor.close()
 
-    def update(self, model, **kwargs):
+    def _search_where(self, value, in_fields):
         """
-        Update a single object identified using the modelid.
+        Build the condition to search `value` in the given fields. Use the
+        full text search tables when available.
         """
-        _validate_model(model)
-        # Get model identity
-        keys = self._get_id(model, **kwargs)
-        query = "UPDATE " + model + " SET " + ', '.join(['%s=?' % k for k in kwargs.keys() if k not in keys]) + _where(keys)
-        return self._rowcount(query, [v for k, v in kwargs.items() if k not in keys] + [kwargs.get(k) for k in keys])
+        value = value.replace('%', '').replace('_', '')
+        fields = [f.lower() for f in in_fields]
+        fts_fields = [c.lower() for unused, unused, columns in _FTS_TABLES for c in columns]
+        if self._fts and len(value) >= _FTS_MIN_LENGTH and all(f in fts_fields for f in fields):
+            clauses = []
+            args = []
+            for table, rowid, columns in _FTS_TABLES:
+                columns = [c for c in columns if c.lower() in fields]
+                if not columns:
+                    continue
+                clauses.append('%s.%s IN (SELECT rowid FROM %s_fts WHERE %s_fts MATCH ?)' % (table, rowid, table, table))
+                args.append('{%s} : "%s"' % (' '.join(columns), value.replace('"', '""')))
+            return '(' + ' OR '.join(clauses) + ')', args
+        # Fallback to a full scan.
+        return SQLBackend._search_where(self, value, in_fields)
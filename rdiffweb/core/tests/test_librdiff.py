@@ -27,6 +27,7 @@ from __future__ import unicode_literals
 
 from builtins import bytes
 from builtins import str
+from collections import OrderedDict
 import datetime
 from future.utils import native_str
 import os
@@ -37,9 +38,14 @@ import tempfile
 import time
 import unittest
 
+from mock import patch
+
 from rdiffweb.core.librdiff import FileStatisticsEntry, RdiffRepo, \
     DirEntry, IncrementEntry, SessionStatisticsEntry, HistoryEntry, \
-    AccessDeniedError, DoesNotExistError, FileError, UnknownError, RdiffTime
+    AccessDeniedError, DoesNotExistError, FileError, UnknownError, RdiffTime, \
+    SessionStatisticsColumns, SESSION_STATISTICS_ATTRS
+from rdiffweb.core.mirror_metadata import FileInfo
+from rdiffweb.core.rdw_helpers import LRUCache
 
 
 class MockRdiffRepo(RdiffRepo):
@@ -76,6 +82,31 @@ class IncrementEntryTest(unittest.TestCase):
         self.assertEqual(b'my_filename.txt', increment.filename)
         self.assertIsNotNone(increment.repo)
 
+    def test_suffix(self):
+        increment = IncrementEntry(self.root_path, b'my_filename.txt.2014-11-02T17:23:41-05:00.snapshot.gz')
+        self.assertEqual(b'.snapshot.gz', increment.suffix)
+        self.assertTrue(increment.has_suffix)
+        self.assertTrue(increment.is_snapshot)
+        self.assertTrue(increment._is_compressed)
+        self.assertFalse(increment.is_missing)
+        self.assertFalse(increment.isdir)
+
+        increment = IncrementEntry(self.root_path, b'my_dir.2014-11-02T17:23:41-05:00.missing')
+        self.assertEqual(b'my_dir', increment.filename)
+        self.assertTrue(increment.is_missing)
+        self.assertFalse(increment.is_snapshot)
+
+        increment = IncrementEntry(self.root_path, b'my_filename.txt.2014-11-02T17:23:41-05:00')
+        self.assertEqual(b'my_filename.txt', increment.filename)
+        self.assertEqual(RdiffTime(1414967021), increment.date)
+        self.assertFalse(increment.has_suffix)
+
+    def test_parse_name(self):
+        self.assertEqual(
+            (b'my.file', b'2014-11-02T17;05823;05841-05;05800', b'.diff.gz'),
+            IncrementEntry._parse_name(b'my.file.2014-11-02T17;05823;05841-05;05800.diff.gz'))
+        self.assertEqual(b'my.file.2014-11-02T17:23:41-05:00', IncrementEntry._remove_suffix(b'my.file.2014-11-02T17:23:41-05:00.dir'))
+
 
 class DirEntryTest(unittest.TestCase):
 
@@ -136,6 +167,13 @@ class DirEntryTest(unittest.TestCase):
         entry = DirEntry(self.root_path, bytes('<F!chïer> (@vec) {càraçt#èrë} $épêcial', encoding='utf-8'), False, increments)
         self.assertEqual(286, entry.file_size)
 
+    def test_file_size_from_file_tree(self):
+        increments = [
+            IncrementEntry(self.root_path, b'my_file.2014-11-05T16:04:30-05:00.dir')]
+        entry = DirEntry(self.root_path, b'my_file', False, increments)
+        with patch.object(self.repo._tree, 'last_versions', return_value={b'my_file': FileInfo(b'my_file', 'reg', 42, 1, None)}):
+            self.assertEqual(42, entry.file_size)
+
     def test_file_size_without_stats(self):
         increments = [
             IncrementEntry(self.root_path, b'my_file.2014-11-05T16:04:30-05:00.dir')]
@@ -189,6 +227,27 @@ class FileStatisticsEntryTest(unittest.TestCase):
         size = entry.get_source_size(bytes('<F!chïer> (@vec) {càraçt#èrë} $épêcial', encoding='utf-8'))
         self.assertEqual(286, size)
 
+    def test_get_source_size_not_found(self):
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data')
+        self.assertEqual(0, entry.get_source_size(b'invalid'))
+
+    def test_get_source_sizes(self):
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+        sizes = entry.get_source_sizes([bytes('<F!chïer> (@vec) {càraçt#èrë} $épêcial', encoding='utf-8'), b'invalid'])
+        self.assertEqual({bytes('<F!chïer> (@vec) {càraçt#èrë} $épêcial', encoding='utf-8'): 286}, sizes)
+
+    def test_get_source_sizes_with_index(self):
+        self.repo._index_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_').encode('utf8')
+        try:
+            entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+            path = bytes('<F!chïer> (@vec) {càraçt#èrë} $épêcial', encoding='utf-8')
+            self.assertEqual({path: 286}, entry.get_source_sizes([path, b'invalid']))
+            self.assertTrue(os.path.isfile(entry._index_file))
+            # Second lookup read the index.
+            self.assertEqual(143, entry.get_mirror_size(path))
+        finally:
+            shutil.rmtree(self.repo._index_dir)
+
 
 class HistoryEntryTest(unittest.TestCase):
 
@@ -232,6 +291,15 @@ class RdiffRepoTest(unittest.TestCase):
         # On NTFS, colon (:) are not supported.
         self.assertEqual(RdiffTime(1483443123), self.repo._extract_date(b'my_filename.txt.2017-01-03T06;05832;05803-05;05800.diff.gz'))
 
+    def test_extract_dates(self):
+        dates = self.repo._extract_dates([
+            b'my_filename.txt.2014-11-02T17:23:41-05:00.diff.gz',
+            b'other.txt.2014-11-02T17;05823;05841-05;05800.missing',
+            b'my_filename.txt.invalid.diff.gz'])
+        self.assertEqual([RdiffTime(1414967021), RdiffTime(1414967021), None], dates)
+        # Same timestamp return the same instance.
+        self.assertIs(dates[0], dates[1])
+
     def test_init(self):
         self.assertEqual('testcases', self.repo.display_name)
 
@@ -273,6 +341,72 @@ class RdiffRepoTest(unittest.TestCase):
         self.assertEqual([], dir_entry.dir_entries)
         self.assertTrue(len(dir_entry.change_dates) > 1)
 
+    def test_dir_entries_with_scandir(self):
+        # File type should be provided by scandir.
+        with patch('os.path.isdir', side_effect=AssertionError('isdir should not be called')):
+            entries = self.repo.get_path(b"/").dir_entries
+            dirs = [e.display_name for e in entries if e.exists and e.isdir]
+        self.assertIn('Subdirectory', dirs)
+        self.assertNotIn('rdiff-backup-data', [e.display_name for e in entries])
+
+    def test_iter_dir_entries(self):
+        path = self.repo.get_path(b"/")
+        entries = list(path.iter_dir_entries(sort='name'))
+        self.assertEqual(len(path.dir_entries), len(entries))
+        # Directories are listed first.
+        isdir = [e.isdir for e in entries]
+        self.assertEqual(sorted(isdir, reverse=True), isdir)
+        # Resume after the third entry.
+        after = entries[2].sort_key('name')
+        self.assertEqual(
+            [e.path for e in entries[3:]],
+            [e.path for e in path.iter_dir_entries(sort='name', after=after)])
+
+    def test_iter_dir_entries_limit(self):
+        path = self.repo.get_path(b"/")
+        for reverse in [False, True]:
+            entries = [e.path for e in path.iter_dir_entries(reverse=reverse)]
+            page = list(path.iter_dir_entries(reverse=reverse, limit=3))
+            self.assertEqual(entries[:3], [e.path for e in page])
+            after = page[-1].sort_key('name')
+            self.assertEqual(
+                entries[3:6],
+                [e.path for e in path.iter_dir_entries(reverse=reverse, after=after, limit=3)])
+
+    def test_iter_dir_entries_limit_create_page_only(self):
+        path = self.repo.get_path(b"/")
+        count = len(path.dir_entries)
+        self.assertGreater(count, 3)
+        created = []
+        init = DirEntry.__init__
+
+        def mock_init(entry, *args, **kwargs):
+            created.append(entry)
+            init(entry, *args, **kwargs)
+
+        with patch.object(DirEntry, '__init__', mock_init):
+            page = list(path.iter_dir_entries(limit=3))
+        self.assertEqual(3, len(page))
+        self.assertEqual(page, created)
+
+    def test_iter_dir_entries_paging_by_size(self):
+        path = self.repo.get_path(b"/")
+        for sort in ['size', 'date']:
+            with self.assertRaises(ValueError):
+                list(path.iter_dir_entries(sort=sort, limit=3))
+
+    def test_iter_dir_entries_reverse(self):
+        path = self.repo.get_path(b"/")
+        for sort in ['name', 'size', 'date']:
+            entries = list(path.iter_dir_entries(sort=sort, reverse=True))
+            keys = [e.sort_key(sort) for e in entries]
+            self.assertEqual(sorted(keys, reverse=True), keys)
+        entries = list(path.iter_dir_entries(reverse=True))
+        after = entries[2].sort_key('name')
+        self.assertEqual(
+            [e.path for e in entries[3:]],
+            [e.path for e in path.iter_dir_entries(reverse=True, after=after)])
+
     def test_get_path_rdiff_backup_data(self):
         with self.assertRaises(DoesNotExistError):
             self.repo.get_path(b'rdiff-backup-data')
@@ -296,6 +430,32 @@ class RdiffRepoTest(unittest.TestCase):
         data = stream.read()
         self.assertEqual(b'Version3\n', data)
 
+    def test_restore_file_with_increments(self):
+        # Apply the delta without calling rdiff-backup.
+        with patch('rdiffweb.core.librdiff.call_restore', side_effect=AssertionError('call_restore should not be called')):
+            for date, expected in [('2014-11-05T16:05:07-05:00', b'Version3\n'),
+                                   ('2014-11-05T16:04:55-05:00', b'Version2\n'),
+                                   ('2014-11-05T16:04:30-05:00', b'Version1\n')]:
+                filename, stream = self.repo.get_path(b"Revisions/Data").restore(restore_as_of=RdiffTime(date).epoch(), kind='zip')
+                self.assertEqual('Data', filename)
+                self.assertEqual(expected, stream.read())
+                stream.close()
+
+    def test_restore_file_between_backups(self):
+        # Restore the state of the last backup before the date.
+        with patch('rdiffweb.core.librdiff.call_restore', side_effect=AssertionError('call_restore should not be called')):
+            for date, expected in [('2014-11-05T16:05:00-05:00', b'Version2\n'),
+                                   ('2014-11-05T16:04:40-05:00', b'Version1\n')]:
+                filename, stream = self.repo.get_path(b"Revisions/Data").restore(restore_as_of=RdiffTime(date).epoch(), kind='zip')
+                self.assertEqual(expected, stream.read())
+                stream.close()
+
+    def test_restore_file_missing(self):
+        # File doesn't exists at that date, let rdiff-backup handle it.
+        with patch('rdiffweb.core.librdiff.call_restore') as mock_call_restore:
+            self.repo.get_path(b"Revisions/Data").restore(restore_as_of=RdiffTime('2014-11-05T16:01:02-05:00').epoch(), kind='zip')
+            self.assertTrue(mock_call_restore.called)
+
     def test_restore_subdirectory(self):
         filename, stream = self.repo.get_path(b"Revisions/").restore(restore_as_of=1454448640, kind='zip')
         self.assertEqual('Revisions.zip', filename)
@@ -308,9 +468,167 @@ class RdiffRepoTest(unittest.TestCase):
         data = stream.read()
         self.assertTrue(data)
 
+    def test_prune_file_statistics_index(self):
+        index_dir = os.path.join(self.temp_dir, 'index').encode('utf8')
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8', index_dir=index_dir)
+        date = repo.backup_dates[-1]
+        repo.get_file_statistic(date).get_source_sizes([b'Revisions/Data'])
+        index_file = repo.get_file_statistic(date)._index_file
+        self.assertTrue(os.path.isfile(index_file))
+        # Index of an existing file_statistics is kept.
+        repo._prune_file_statistics_index()
+        self.assertTrue(os.path.isfile(index_file))
+        # Index is deleted with the file_statistics.
+        for name in os.listdir(os.path.join(self.testcases_dir, b'rdiff-backup-data')):
+            if name.startswith(b'file_statistics.' + str(date).encode('ascii')):
+                os.remove(os.path.join(self.testcases_dir, b'rdiff-backup-data', name))
+        os.utime(os.path.join(self.testcases_dir, b'rdiff-backup-data'), (0, 0))
+        repo._prune_file_statistics_index()
+        self.assertFalse(os.path.isfile(index_file))
+        self.assertEqual([], [n for n in os.listdir(index_dir) if n.endswith(b'.tmp')])
+
     def test_unquote(self):
         self.assertEqual(b'Char ;090 to quote', self.repo.unquote(b'Char ;059090 to quote'))
 
+    def test_quote(self):
+        # Use chars_to_quote of the repository.
+        self.assertEqual(b'Char:;090', self.repo.quote(b'Char:Z'))
+        with open(os.path.join(self.testcases_dir, b'rdiff-backup-data', b'chars_to_quote'), 'wb') as f:
+            f.write(b'A-Z:\n')
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        self.assertEqual(b';067har;058;090', repo.quote(b'Char:Z'))
+
+    def test_share_state(self):
+        cache = LRUCache()
+        self.repo.share_state(cache, 'testcases')
+        backup_dates = self.repo.backup_dates
+        # A new instance should reuse the data.
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases')
+        self.assertIs(backup_dates, repo.backup_dates)
+        # Data is discarded when rdiff-backup-data is modified.
+        os.utime(os.path.join(self.testcases_dir, b'rdiff-backup-data'), (0, 0))
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases')
+        self.assertIsNot(backup_dates, repo.backup_dates)
+        self.assertEqual(backup_dates, repo.backup_dates)
+
+    def test_share_state_generation(self):
+        cache = LRUCache()
+        self.repo.share_state(cache, 'testcases', generation=1)
+        backup_dates = self.repo.backup_dates
+        # Same generation reuses the data.
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases', generation=1)
+        self.assertIs(backup_dates, repo.backup_dates)
+        # Data is discarded when the generation changes.
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases', generation=2)
+        self.assertIsNot(backup_dates, repo.backup_dates)
+        self.assertEqual(backup_dates, repo.backup_dates)
+
+    def test_share_state_statistics(self):
+        cache = LRUCache()
+        self.repo.share_state(cache, 'testcases')
+        session_statistics = self.repo.session_statistics
+        file_statistics = self.repo._file_statistics
+        error_logs = self.repo._error_logs
+        # A new instance should reuse the data.
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases')
+        self.assertIs(session_statistics, repo.session_statistics)
+        self.assertIs(file_statistics, repo._file_statistics)
+        self.assertIs(error_logs, repo._error_logs)
+        # Data is discarded when rdiff-backup-data is modified.
+        os.utime(os.path.join(self.testcases_dir, b'rdiff-backup-data'), (0, 0))
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases')
+        self.assertIsNot(session_statistics, repo.session_statistics)
+        self.assertIsNot(error_logs, repo._error_logs)
+
+    def test_share_state_keep_session_columns(self):
+        cache = LRUCache()
+        self.repo.share_state(cache, 'testcases')
+        columns = self.repo.session_statistics_columns
+        # Columns are updated instead of discarded.
+        repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+        repo.share_state(cache, 'testcases', force=True)
+        self.assertIs(columns, repo.session_statistics_columns)
+        self.assertEqual(len(repo.session_statistics), len(columns))
+
+    def test_session_statistics_columns(self):
+        columns = self.repo.session_statistics_columns
+        self.assertEqual(len(self.repo.session_statistics), len(columns))
+        date, values = next(columns.rows())
+        self.assertEqual(1414871387, date)
+        self.assertEqual([1414871387.0, 1414871388.07, 1.07, 10, 0, 1, 0, 9, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0], values)
+
+    def test_session_statistics_columns_range(self):
+        columns = self.repo.session_statistics_columns
+        dates = [d for d, _unused in columns.rows()]
+        self.assertEqual(dates[2:5], [d for d, _unused in columns.rows(start=dates[2], end=dates[4])])
+        self.assertEqual([], list(columns.rows(start=dates[-1] + 1)))
+
+    def test_session_statistics_columns_points(self):
+        columns = self.repo.session_statistics_columns
+        dates = [d for d, _unused in columns.rows()]
+        sampled = [d for d, _unused in columns.rows(points=5)]
+        self.assertLessEqual(len(sampled), 5)
+        self.assertEqual(dates[-1], sampled[-1])
+        self.assertEqual(sampled, sorted(sampled))
+
+    def test_session_statistics_columns_update(self):
+        entries = list(self.repo.session_statistics.values())
+        columns = SessionStatisticsColumns()
+        columns.update(OrderedDict([(e.date, e) for e in entries[:5]]))
+        dates = columns.dates
+        self.assertEqual(5, len(columns))
+        # New sessions are appended.
+        columns.update(self.repo.session_statistics)
+        self.assertIs(dates, columns.dates)
+        self.assertEqual(len(entries), len(columns))
+        # Removed sessions rebuild the cache.
+        columns.update(OrderedDict([(e.date, e) for e in entries[1:]]))
+        self.assertIsNot(dates, columns.dates)
+        self.assertEqual(len(entries) - 1, len(columns))
+        self.assertEqual(entries[1].date.epoch(), columns.dates[0])
+
+    def test_session_statistics_columns_metric(self):
+        columns = self.repo.session_statistics_columns
+        dates = [d for d, _unused in columns.rows()]
+        sampled = list(columns.rows(points=6, metric='sourcefilesize'))
+        self.assertEqual(6, len(sampled))
+        # First and last sessions are kept.
+        self.assertEqual(dates[0], sampled[0][0])
+        self.assertEqual(dates[-1], sampled[-1][0])
+        # The biggest change is kept.
+        self.assertIn(1414937803, [d for d, _unused in sampled])
+
+    def test_session_statistics_columns_aggregate(self):
+        columns = self.repo.session_statistics_columns
+        data = list(columns.aggregate('month', 'sum'))
+        self.assertEqual([1414800000, 1451606400, 1454284800], [d for d, _unused in data])
+        # Number of errors and new files by month.
+        self.assertEqual(
+            [sum(e.newfiles for e in self.repo.session_statistics.values() if e.date.epoch() < 1451606400), 6, 6],
+            [v[SESSION_STATISTICS_ATTRS.index('newfiles')] for _unused, v in data])
+        data = list(columns.aggregate('month', 'max'))
+        self.assertEqual([19, 22, 25], [v[SESSION_STATISTICS_ATTRS.index('sourcefiles')] for _unused, v in data])
+
+    def test_session_statistics_columns_aggregate_tzoffset(self):
+        columns = self.repo.session_statistics_columns
+        # Periods begin at midnight in the given timezone (UTC-5).
+        data = list(columns.aggregate('day', 'avg', tzoffset=300))
+        self.assertEqual(1414818000, data[0][0])
+        self.assertEqual(0, (data[0][0] - 300 * 60) % 86400)
+        self.assertEqual(len(set(d for d, _unused in data)), len(data))
+
+    def test_session_statistics_columns_aggregate_week(self):
+        columns = self.repo.session_statistics_columns
+        # Weeks begin on Sunday.
+        for date, _unused in columns.aggregate('week'):
+            self.assertEqual(6, time.gmtime(date).tm_wday)
+
 
 class SessionStatisticsEntryTest(unittest.TestCase):
 
@@ -381,6 +699,26 @@ class RdiffTimeTest(unittest.TestCase):
         t3 = RdiffTime('2014-11-05T16:04:30-05:00')
         self.assertEqual(1415221470, t3.epoch())
 
+    def test_hash(self):
+        """Check if dates with the same epoch are equals."""
+        self.assertEqual(
+            {RdiffTime(1415221470)},
+            {RdiffTime('2014-11-05T16:04:30-05:00'), RdiffTime(1415221470)})
+
+    def test_parse(self):
+        """Check if parsed dates are shared."""
+        t1 = RdiffTime.parse('2014-11-05T16:04:30-05:00')
+        self.assertEqual(1415221470, t1.epoch())
+        self.assertIs(t1, RdiffTime.parse('2014-11-05T16:04:30-05:00'))
+        with self.assertRaises(ValueError):
+            RdiffTime.parse('invalid')
+
+    def test_set_time(self):
+        t1 = RdiffTime(1415221470)
+        t1.set_time(0, 0, 0)
+        self.assertEqual(1415145600, t1.epoch())
+        self.assertEqual(RdiffTime('2014-11-05T00:00:00Z'), t1)
+
     def test_int(self):
         """Check if int(RdiffTime) return expected value."""
         self.assertEqual(1415221470, int(RdiffTime(1415221470)))
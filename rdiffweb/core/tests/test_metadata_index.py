@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the metadata index.
+"""
+
+from __future__ import unicode_literals
+
+from future.utils import native_str
+import os
+import pkg_resources
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from mock import patch
+
+from rdiffweb.core.librdiff import RdiffRepo
+from rdiffweb.core.metadata_index import IncrementsIndex, _INCREMENTS_PERSIST_MIN
+
+
+class MetadataIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # Extract 'testcases.tar.gz'
+        testcases = pkg_resources.resource_filename('rdiffweb.tests', 'testcases.tar.gz')  # @UndefinedVariable
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        tarfile.open(testcases).extractall(native_str(self.temp_dir))
+        self.index_dir = os.path.join(self.temp_dir, 'index')
+        self.data_path = os.path.join(self.temp_dir, 'testcases', 'rdiff-backup-data').encode('utf8')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir.encode('utf8'), True)
+
+    def _repo(self, index_dir=None):
+        return RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8', index_dir=index_dir)
+
+    def test_backup_dates(self):
+        # Same result with or without the index.
+        expected = self._repo().backup_dates
+        self.assertTrue(expected)
+        self.assertEqual(expected, self._repo(self.index_dir).backup_dates)
+        self.assertEqual(1, len(os.listdir(self.index_dir)))
+        # Then read from index.
+        self.assertEqual(expected, self._repo(self.index_dir).backup_dates)
+
+    def test_session_statistics(self):
+        expected = self._repo().session_statistics
+        self._repo(self.index_dir).session_statistics
+        # Session statistics should be read from index without opening files.
+        with patch('rdiffweb.core.librdiff.SessionStatisticsEntry._load') as mock_load:
+            stats = self._repo(self.index_dir).session_statistics
+            self.assertEqual(list(expected.keys()), list(stats.keys()))
+            for date, entry in stats.items():
+                self.assertEqual(expected[date].sourcefilesize, entry.sourcefilesize)
+                self.assertEqual(expected[date].errors, entry.errors)
+            self.assertFalse(mock_load.called)
+
+    def test_read_without_listdir(self):
+        self._repo(self.index_dir).backup_dates
+        with patch('rdiffweb.core.metadata_index.os.listdir') as mock_listdir:
+            self._repo(self.index_dir).backup_dates
+            self.assertFalse(mock_listdir.called)
+
+    def test_refresh_with_new_file(self):
+        repo = self._repo(self.index_dir)
+        count = len(repo.backup_dates)
+        # Add a new backup
+        with open(os.path.join(self.data_path, b'mirror_metadata.2030-01-01T00:00:00-05:00.snapshot.gz'), 'wb'):
+            pass
+        os.utime(self.data_path, (0, 0))
+        self.assertEqual(count + 1, len(self._repo(self.index_dir).backup_dates))
+
+
+class IncrementsIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # Extract 'testcases.tar.gz'
+        testcases = pkg_resources.resource_filename('rdiffweb.tests', 'testcases.tar.gz')  # @UndefinedVariable
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        tarfile.open(testcases).extractall(native_str(self.temp_dir))
+        self.index_dir = os.path.join(self.temp_dir, 'index')
+        self.increments_path = os.path.join(self.temp_dir, 'testcases', 'rdiff-backup-data', 'increments', 'Revisions').encode('utf8')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir.encode('utf8'), True)
+
+    def _repo(self, index_dir=None):
+        return RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8', index_dir=index_dir)
+
+    def test_get_path(self):
+        repo = self._repo()
+        increments = repo.get_path(b'Revisions/Data')._increments
+        self.assertEqual(4, len(increments))
+        self.assertEqual([b'Data'] * 4, [e.filename for e in increments])
+        self.assertEqual([e.date for e in increments], [repo._extract_date(e.name) for e in increments])
+        # Directory is not listed again.
+        with patch('rdiffweb.core.metadata_index.scandir') as mock_scandir:
+            self.assertEqual(4, len(repo.get_path(b'Revisions/Data')._increments))
+            self.assertFalse(mock_scandir.called)
+
+    def test_get_path_with_new_increment(self):
+        repo = self._repo()
+        self.assertEqual(4, len(repo.get_path(b'Revisions/Data')._increments))
+        with open(os.path.join(self.increments_path, b'Data.2030-01-01T00:00:00-05:00.diff.gz'), 'wb'):
+            pass
+        os.utime(self.increments_path, (0, 0))
+        self.assertEqual(5, len(repo.get_path(b'Revisions/Data')._increments))
+
+    def test_persisted(self):
+        # Create many increments to be persisted.
+        for i in range(_INCREMENTS_PERSIST_MIN):
+            with open(os.path.join(self.increments_path, b'File%d.2014-11-05T16:05:07-05:00.diff.gz' % i), 'wb'):
+                pass
+        expected = self._repo(self.index_dir).get_path(b'Revisions').dir_entries
+        self.assertTrue([f for f in os.listdir(self.index_dir) if f.endswith('.increments.db')])
+        # Read from index without listing the directory.
+        with patch.object(IncrementsIndex, '_list', side_effect=IncrementsIndex._list, autospec=True) as mock_list:
+            entries = self._repo(self.index_dir).get_path(b'Revisions').dir_entries
+            self.assertNotIn(self.increments_path, [c[0][1] for c in mock_list.call_args_list])
+        self.assertEqual(
+            sorted((e.path, e.change_dates) for e in expected),
+            sorted((e.path, e.change_dates) for e in entries))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
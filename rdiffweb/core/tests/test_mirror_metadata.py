@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the file tree index of mirror_metadata.
+"""
+
+from __future__ import unicode_literals
+
+from future.utils import native_str
+import gzip
+import io
+import os
+import pkg_resources
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from mock import patch
+
+from rdiffweb.core.librdiff import RdiffRepo
+from rdiffweb.core.mirror_metadata import FileInfo, FileTreeIndex, \
+    parse_mirror_metadata
+
+
+def _record(path, size=None, mtime=1, file_type=b'reg'):
+    data = b'File ' + path + b'\n  Type ' + file_type + b'\n'
+    if size is not None:
+        data += b'  Size %d\n' % size
+    return data + b'  ModTime %d\n  Permissions 420\n' % mtime
+
+
+class ParseMirrorMetadataTest(unittest.TestCase):
+
+    def test_parse(self):
+        data = (
+            b'File .\n  Type dir\n  ModTime 1454448609\n  Permissions 493\n'
+            b'File my\\\\dir\n  Type dir\n  ModTime 1454448609\n'
+            b'File my\\\\dir/new\\nline\n  Type reg\n  Size 26\n'
+            b'  SHA1Digest d04720a5d928c058b70d20c13606333de90fb079\n  ModTime 1425069969\n'
+            b'File deleted\n  Type None\n')
+        self.assertEqual([
+            FileInfo(b'', 'dir', None, 1454448609, None),
+            FileInfo(b'my\\dir', 'dir', None, 1454448609, None),
+            FileInfo(b'my\\dir/new\nline', 'reg', 26, 1425069969, 'd04720a5d928c058b70d20c13606333de90fb079'),
+            FileInfo(b'deleted', None, None, None, None),
+        ], list(parse_mirror_metadata(io.BytesIO(data))))
+
+    def test_parse_empty(self):
+        self.assertEqual([], list(parse_mirror_metadata(io.BytesIO(b''))))
+
+
+class FileTreeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_').encode('utf8')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, True)
+
+    def _write(self, name, *records):
+        with gzip.open(os.path.join(self.temp_dir, name), 'wb') as f:
+            f.write(b'File .\n  Type dir\n  ModTime 1\n')
+            for r in records:
+                f.write(r)
+        return name
+
+    def _paths(self, index, date):
+        return [(x.path, x.size) for x in index.tree(date)]
+
+    def test_update(self):
+        # First backup.
+        index = FileTreeIndex(self.temp_dir, os.path.join(self.temp_dir, b'index', b'tree.db'))
+        snap1 = self._write(b'mirror_metadata.10.snapshot.gz', _record(b'a', 1), _record(b'b', 2))
+        index.update([(10, snap1)])
+        self.assertEqual([10], index.dates())
+        self.assertEqual([(b'', None), (b'a', 1), (b'b', 2)], self._paths(index, 10))
+
+        # Second backup replace the previous snapshot by a diff.
+        snap2 = self._write(b'mirror_metadata.20.snapshot.gz', _record(b'a', 1), _record(b'c', 3))
+        diff1 = self._write(b'mirror_metadata.10.diff.gz', _record(b'b', 2), _record(b'c', file_type=b'None'))
+        os.remove(os.path.join(self.temp_dir, snap1))
+        index.update([(10, diff1), (20, snap2)])
+        self.assertEqual([10, 20], index.dates())
+        self.assertEqual([(b'', None), (b'a', 1), (b'b', 2)], self._paths(index, 10))
+        self.assertEqual([(b'', None), (b'a', 1), (b'c', 3)], self._paths(index, 20))
+        # Date between two backups.
+        self.assertEqual([(b'', None), (b'a', 1), (b'b', 2)], self._paths(index, 15))
+        self.assertEqual([], index.tree(5))
+        # Unchanged files are stored once.
+        self.assertEqual(4, index._connect().execute('SELECT COUNT(*) FROM files').fetchone()[0])
+
+        # Index is persisted.
+        index.close()
+        index = FileTreeIndex(self.temp_dir, os.path.join(self.temp_dir, b'index', b'tree.db'))
+        with patch.object(FileTreeIndex, '_read') as mock_read:
+            index.update([(10, diff1), (20, snap2)])
+            self.assertFalse(mock_read.called)
+        self.assertEqual(FileInfo(b'c', 'reg', 3, 1, None), index.get(20, b'c'))
+        self.assertIsNone(index.get(10, b'c'))
+
+        # Remove older backup.
+        index.update([(20, snap2)])
+        self.assertEqual([20], index.dates())
+        self.assertEqual([], index.tree(10))
+        self.assertEqual([(b'', None), (b'a', 1), (b'c', 3)], self._paths(index, 20))
+
+    def test_update_with_snapshots(self):
+        snap1 = self._write(b'mirror_metadata.10.snapshot.gz', _record(b'a', 1), _record(b'b', 2))
+        diff2 = self._write(b'mirror_metadata.20.diff.gz', _record(b'a', 5), _record(b'd', file_type=b'None'))
+        snap3 = self._write(b'mirror_metadata.30.snapshot.gz', _record(b'a', 4), _record(b'd', 3))
+        index = FileTreeIndex(self.temp_dir)
+        index.update([(10, snap1), (20, diff2), (30, snap3)])
+        self.assertEqual([(b'', None), (b'a', 1), (b'b', 2)], self._paths(index, 10))
+        self.assertEqual([(b'', None), (b'a', 5)], self._paths(index, 20))
+        self.assertEqual([(b'', None), (b'a', 4), (b'd', 3)], self._paths(index, 30))
+
+    def test_listdir(self):
+        snap1 = self._write(
+            b'mirror_metadata.10.snapshot.gz',
+            _record(b'dir', file_type=b'dir'), _record(b'dir/a', 1), _record(b'dir/sub', file_type=b'dir'),
+            _record(b'dir/sub/b', 2), _record(b'c', 3))
+        index = FileTreeIndex(self.temp_dir)
+        index.update([(10, snap1)])
+        self.assertEqual([b'c', b'dir'], [x.path for x in index.listdir(10)])
+        self.assertEqual([b'dir/a', b'dir/sub'], [x.path for x in index.listdir(10, b'dir')])
+        self.assertEqual([], index.listdir(10, b'c'))
+
+    def test_last_versions(self):
+        snap1 = self._write(b'mirror_metadata.10.snapshot.gz', _record(b'a', 1), _record(b'b', 2))
+        snap2 = self._write(b'mirror_metadata.20.snapshot.gz', _record(b'a', 5))
+        index = FileTreeIndex(self.temp_dir)
+        index.update([(10, snap1), (20, snap2)])
+        found = index.last_versions([b'a', b'b', b'c'])
+        # Deleted files are found with their last size.
+        self.assertEqual({b'a': 5, b'b': 2}, dict((k, v.size) for k, v in found.items()))
+        self.assertEqual({}, index.last_versions([]))
+
+
+class RepoFileTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        # Extract 'testcases.tar.gz'
+        testcases = pkg_resources.resource_filename('rdiffweb.tests', 'testcases.tar.gz')  # @UndefinedVariable
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        tarfile.open(testcases).extractall(native_str(self.temp_dir))
+        self.repo = RdiffRepo(self.temp_dir, b'testcases', encoding='utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir.encode('utf8'), True)
+
+    def test_file_tree(self):
+        tree = self.repo.file_tree
+        self.assertEqual([d.epoch() for d in self.repo.backup_dates], tree.dates())
+        last = tree.dates()[-1]
+        # Paths are unquoted.
+        self.assertIn(b'Char ;090 to quote', [x.path for x in tree.listdir(last)])
+        self.assertEqual(
+            FileInfo(b'Revisions/Data', 'reg', 9, 1425069973, '4d0cc214afe3ae18202134c4c78a8e5a8057088b'),
+            tree.get(last, b'Revisions/Data'))
+        # Revisions/Data doesn't exist in the first backup.
+        self.assertIsNone(tree.get(tree.dates()[0], b'Revisions/Data'))
+
+    def test_file_tree_matches_mirror(self):
+        # Files of the last backup are found in the mirror once quoted.
+        last = self.repo.file_tree.dates()[-1]
+        files = [x for x in self.repo.file_tree.tree(last) if x.type == 'reg']
+        self.assertTrue(files)
+        for info in files:
+            fn = os.path.join(self.repo.full_path, self.repo.quote(info.path))
+            self.assertEqual(info.size, os.path.getsize(fn))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2018 Patrik Dufresne Service Logiciel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import unittest
+
+from rdiffweb.core.quoting import quote, unquote, unquote_all
+
+
+class QuotingTest(unittest.TestCase):
+
+    def test_unquote(self):
+        self.assertEqual(b'Char ;090 to quote', unquote(b'Char ;059090 to quote'))
+        self.assertEqual(b'2017-01-03T06:32:03-05:00', unquote(b'2017-01-03T06;05832;05803-05;05800'))
+        # Not quoted.
+        name = b'my_filename.txt'
+        self.assertIs(name, unquote(name))
+        # Invalid value are kept as-is.
+        self.assertEqual(b'a;999b;12', unquote(b'a;999b;12'))
+
+    def test_unquote_many(self):
+        self.assertEqual(b':' * 20, unquote(b';058' * 20))
+
+    def test_unquote_all(self):
+        self.assertEqual(
+            [b'a:b', b'c', b'd;e'],
+            unquote_all([b'a;058b', b'c', b'd;059e']))
+
+    def test_quote(self):
+        self.assertEqual(b';065b;058c;059d', quote(b'Ab:c;d', b'A-Z:'))
+        self.assertEqual(b'Ab:c;d', quote(b'Ab:c;d', b''))
+        self.assertEqual(b'Ab:c;d', unquote(quote(b'Ab:c;d', b'A-Z:')))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -23,9 +23,10 @@ Created on Dec 26, 2015
 
 from __future__ import unicode_literals
 
+import time
 import unittest
 
-from rdiffweb.core.rdw_helpers import quote_url, unquote_url
+from rdiffweb.core.rdw_helpers import quote_url, unquote_url, LRUCache
 
 
 class Test(unittest.TestCase):
@@ -41,6 +42,58 @@ class Test(unittest.TestCase):
         self.assertEqual(b'this is some path', unquote_url(b'this%20is%20some%20path'))
 
 
+class LRUCacheTest(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        # Adding a third item discard the least recently used.
+        cache['c'] = 3
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_pop(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        self.assertEqual(1, cache.pop('a'))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.pop('a'))
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=1)
+        cache['a'] = 1
+        self.assertEqual(1, cache.get('a'))
+        time.sleep(1.1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_contains(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertIn('a', cache)
+        self.assertNotIn('c', cache)
+        # Membership test doesn't mark the item as recently used.
+        cache['c'] = 3
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+
+    def test_contains_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=1)
+        cache['a'] = 1
+        self.assertIn('a', cache)
+        time.sleep(1.1)
+        self.assertNotIn('a', cache)
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0)
+        cache['a'] = 1
+        self.assertIsNone(cache.get('a'))
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -27,6 +27,7 @@ from __future__ import unicode_literals
 
 import io
 import os
+import shutil
 import sys
 import tarfile
 import tempfile
@@ -35,8 +36,10 @@ import unittest
 from zipfile import ZipFile
 
 from future.builtins import str
+from mock import patch
 
-from rdiffweb.core.restore import restore, call_restore
+from rdiffweb.core.restore import restore, call_restore, ARCHIVERS, \
+    _FilenameLookup, _LineReader, _TempWindow
 from rdiffweb.test import AppTestCase
 
 
@@ -217,6 +220,16 @@ class RestoreTest(AppTestCase):
         finally:
             os.remove(filename)
 
+    def test_restore_pipe_zip_file_with_workers(self):
+        """
+        Check creation of zip using multiple threads.
+        """
+        rfd, wfd = os.pipe()
+        # Run archiver
+        restore_async(self.path, restore_as_of=1454448640, dest=io.open(wfd, 'wb'), encoding='utf-8', kind='zip', workers=4)
+        # Check result.
+        self.assertInZip(ZIP_EXPECTED, io.open(rfd, 'rb'))
+
     def test_restore_zip_file(self):
         """
         Check creation of a zipfile.
@@ -301,6 +314,16 @@ class RestoreTest(AppTestCase):
         # Check result.
         self.assertInTar(TAR_EXPECTED, io.open(rfd, 'rb'), mode='r|gz')
 
+    def test_restore_pipe_tar_gz_file_with_workers(self):
+        """
+        Check creation of tar.gz using multiple threads.
+        """
+        rfd, wfd = os.pipe()
+        # Run archiver
+        restore_async(self.path, restore_as_of=1454448640, dest=io.open(wfd, 'wb'), encoding='utf-8', kind='tar.gz', workers=4)
+        # Check result.
+        self.assertInTar(TAR_EXPECTED, io.open(rfd, 'rb'), mode='r|gz')
+
     def test_restore_tar_gz_file(self):
         """
         Check creation of tar.gz.
@@ -315,6 +338,31 @@ class RestoreTest(AppTestCase):
         finally:
             os.remove(filename)
 
+    @unittest.skipUnless('tar.zst' in ARCHIVERS, 'zstandard is not installed')
+    def test_restore_pipe_tar_zst_file(self):
+        """
+        Check creation of tar.zst.
+        """
+        import zstandard
+        rfd, wfd = os.pipe()
+        # Run archiver
+        restore_async(self.path, restore_as_of=1454448640, dest=io.open(wfd, 'wb'), encoding='utf-8', kind='tar.zst', workers=2, level=5)
+        # Check result.
+        reader = zstandard.ZstdDecompressor().stream_reader(io.open(rfd, 'rb'))
+        self.assertInTar(TAR_EXPECTED, reader, mode='r|')
+
+    @unittest.skipUnless('tar.lz4' in ARCHIVERS, 'lz4 is not installed')
+    def test_restore_pipe_tar_lz4_file(self):
+        """
+        Check creation of tar.lz4.
+        """
+        import lz4.frame
+        rfd, wfd = os.pipe()
+        # Run archiver
+        restore_async(self.path, restore_as_of=1454448640, dest=io.open(wfd, 'wb'), encoding='utf-8', kind='tar.lz4')
+        # Check result.
+        self.assertInTar(TAR_EXPECTED, lz4.frame.LZ4FrameFile(io.open(rfd, 'rb')), mode='r|')
+
     def test_restore_pipe_tar_bz2_file(self):
         """
         Check creation of tar.gz.
@@ -325,6 +373,16 @@ class RestoreTest(AppTestCase):
         # Check result.
         self.assertInTar(TAR_EXPECTED, io.open(rfd, 'rb') , mode='r|bz2')
 
+    def test_restore_pipe_zip_with_temp_window(self):
+        """
+        Check creation of zip when rdiff-backup get suspended.
+        """
+        rfd, wfd = os.pipe()
+        # Run archiver
+        restore_async(self.path, restore_as_of=1454448640, dest=io.open(wfd, 'wb'), encoding='utf-8', kind='zip', temp_window=1024)
+        # Check result.
+        self.assertInZip(ZIP_EXPECTED, io.open(rfd, 'rb'))
+
     def test_restore_tar_bz2_file(self):
         """
         Check creation of tar.bz2.
@@ -340,6 +398,146 @@ class RestoreTest(AppTestCase):
             os.remove(filename)
 
 
+# Restore nested directories. Set the mode of `a/b` once `a/g` is archived
+# like rdiff-backup does when a directory is completed.
+FAKE_RDIFF_BACKUP = """#!/bin/sh
+PATH=/usr/local/bin:/usr/bin:/bin
+dest="$5"
+mkdir -p "$dest/a/b"
+echo "Processing changed file a"
+echo "Processing changed file a/b"
+echo data > "$dest/a/b/f1"
+echo "Processing changed file a/b/f1"
+echo data > "$dest/a/g"
+echo "Processing changed file a/g"
+while [ -e "$dest/a/g" ]; do sleep 0.05; done
+chmod 700 "$dest/a/b" || echo "error: a/b was deleted"
+"""
+
+
+class RestoreTempWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        script = os.path.join(self.temp_dir, 'rdiff-backup')
+        with open(script, 'w') as f:
+            f.write(FAKE_RDIFF_BACKUP)
+        os.chmod(script, 0o700)
+        patcher = patch('rdiffweb.core.restore.spawn.find_executable', return_value=script)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, True)
+
+    def test_restore_nested_directories(self):
+        messages = []
+        dest = io.BytesIO()
+        restore(b'/backup/a', restore_as_of=1454448640, dest=dest, encoding='utf-8', kind='zip', log=messages.append, temp_window=1024)
+        # Completed directories are not deleted while rdiff-backup is running.
+        self.assertEqual([], [m for m in messages if 'error' in m])
+        dest.seek(0)
+        self.assertEqual(
+            ['a/', 'a/b/', 'a/b/f1', 'a/g'],
+            sorted(ZipFile(dest).namelist()))
+
+
+class FilenameLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_').encode('ascii')
+        os.makedirs(os.path.join(self.temp_dir, b'DIR\xe9', b'sub'))
+        open(os.path.join(self.temp_dir, b'DIR\xe9', b'sub', b'Data\xe8'), 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, True)
+
+    def test_lookup(self):
+        lookup = _FilenameLookup(self.temp_dir)
+        self.assertEqual(
+            (os.path.join(self.temp_dir, b'DIR\xe9'), b'DIR\xe9'),
+            lookup.lookup(b'DIR\xe9'))
+
+    def test_lookup_with_invalid_encoding(self):
+        lookup = _FilenameLookup(self.temp_dir)
+        fullpath, arcname = lookup.lookup('DIR\ufffd/sub/Data\ufffd'.encode('utf-8'))
+        self.assertEqual(b'DIR\xe9/sub/Data\xe8', arcname)
+        self.assertEqual(os.path.join(self.temp_dir, arcname), fullpath)
+
+    def test_lookup_with_quoted_name(self):
+        lookup = _FilenameLookup(self.temp_dir)
+        fullpath, arcname = lookup.lookup('DIR\ufffd/sub/;068ata\ufffd'.encode('utf-8'))
+        self.assertEqual(b'DIR\xe9/sub/Data\xe8', arcname)
+        self.assertEqual(os.path.join(self.temp_dir, arcname), fullpath)
+
+    def test_lookup_with_cache(self):
+        lookup = _FilenameLookup(self.temp_dir)
+        lookup.lookup('DIR\ufffd/sub'.encode('utf-8'))
+        with patch('rdiffweb.core.restore.os.listdir') as mock_listdir:
+            lookup.lookup('DIR\ufffd/sub'.encode('utf-8'))
+            self.assertFalse(mock_listdir.called)
+
+    def test_lookup_not_found(self):
+        lookup = _FilenameLookup(self.temp_dir)
+        self.assertEqual((None, None), lookup.lookup(b'DIR/sub'))
+
+
+class LineReaderTest(unittest.TestCase):
+
+    def test_readline(self):
+        rfd, wfd = os.pipe()
+        with io.open(rfd, 'rb') as r, io.open(wfd, 'wb', buffering=0) as w:
+            reader = _LineReader(r)
+            w.write(b'line1\nline2\nline')
+            self.assertEqual(b'line1\n', reader.readline())
+            self.assertEqual(b'line2\n', reader.readline(timeout=0.1))
+            self.assertIsNone(reader.readline(timeout=0.1))
+            w.close()
+            self.assertEqual(b'line', reader.readline())
+            self.assertEqual(b'', reader.readline())
+
+
+class TempWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_').encode('utf-8')
+        patcher = patch('rdiffweb.core.restore.psutil.Process')
+        self.process = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        patcher = patch('rdiffweb.core.restore.TEMP_WINDOW_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, True)
+
+    def _write(self, name, size):
+        fn = os.path.join(self.temp_dir, name)
+        with open(fn, 'wb') as f:
+            f.write(b'0' * size)
+        return fn
+
+    def test_update(self):
+        window = _TempWindow(1, 1000, self.temp_dir)
+        os.mkdir(os.path.join(self.temp_dir, b'dir'))
+        self._write(b'dir/a', 600)
+        window.update()
+        self.assertFalse(window.paused)
+        # Suspend when the files waiting to be archived exceed the window.
+        b = self._write(b'dir/b', 600)
+        window.update()
+        self.assertTrue(window.paused)
+        self.process.suspend.assert_called_once_with()
+        # Resume once half of the window is archived.
+        os.remove(b)
+        window.update()
+        self.assertTrue(window.paused)
+        os.remove(os.path.join(self.temp_dir, b'dir/a'))
+        window.update()
+        self.assertFalse(window.paused)
+        self.process.resume.assert_called_once_with()
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the queue of restore jobs.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import cherrypy
+from mock import patch
+
+from rdiffweb.core.restore_queue import RestoreQueue, DONE, FAILED, QUEUED, RUNNING
+
+
+class MockStore(object):
+    """
+    Keep the leases in memory. Each instance represent a different worker
+    sharing the same leases.
+    """
+
+    def __init__(self, leases):
+        self.leases = leases
+
+    def acquire_lease(self, name, ttl=3600):
+        owner = self.leases.setdefault(name, self)
+        return owner is self
+
+    def release_lease(self, name):
+        if self.leases.get(name) is self:
+            del self.leases[name]
+            return True
+        return False
+
+
+class MockApp(object):
+
+    def __init__(self, cfg, leases=None):
+        self.cfg = {k.lower(): v for k, v in cfg.items()}
+        self.store = MockStore({} if leases is None else leases)
+
+
+def fake_spawn_restore(path, restore_as_of, encoding, kind, output, **kwargs):
+    """
+    Replace rdiffweb-restore by a process writing the path into the archive.
+    Wait for `path.go` to exists before completing.
+    """
+    return subprocess.Popen([
+        'sh', '-c', 'printf "%s" "$1" > "$2"; while [ ! -e "$1.go" ]; do sleep 0.05; done',
+        'sh', path, output])
+
+
+class RestoreQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        patcher = patch('rdiffweb.core.restore_queue.spawn_restore', side_effect=fake_spawn_restore)
+        self.spawn_restore = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        # Let the restore processes complete.
+        for name in ['a', 'b', 'c']:
+            self._release(self._path(name))
+        shutil.rmtree(self.temp_dir, True)
+
+    def _queue(self, leases=None, **cfg):
+        cfg['RestoreCacheDir'] = self.cache_dir
+        return RestoreQueue(cherrypy.engine, MockApp(cfg, leases))
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir, name).encode('utf-8')
+
+    def _release(self, path):
+        open(path + b'.go', 'wb').close()
+
+    def test_submit(self):
+        queue = self._queue()
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job.state)
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+        self.assertEqual(DONE, job.state)
+        with open(job.archive, 'rb') as f:
+            self.assertEqual(self._path('a'), f.read())
+        # Same restore should be served from cache.
+        self.assertIs(job, queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip'))
+        self.assertEqual(1, self.spawn_restore.call_count)
+
+    def test_submit_from_previous_run(self):
+        job = self._queue().submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+        # A new queue should not trust the archive found in cache.
+        job = self._queue().submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self.assertTrue(job.wait(5))
+        self.assertEqual(DONE, job.state)
+        self.assertEqual(2, self.spawn_restore.call_count)
+
+    def test_cache_dir_permissions(self):
+        job = self._queue().submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+        self.assertEqual(0o700, os.stat(self.cache_dir).st_mode & 0o777)
+        self.assertEqual(0o600, os.stat(job.archive).st_mode & 0o777)
+
+    def test_cache_dir_insecure(self):
+        # Refuse to use a directory accessible by other users.
+        os.mkdir(self.cache_dir)
+        os.chmod(self.cache_dir, 0o777)
+        job = self._queue().submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(FAILED, job.state)
+        self.assertEqual(0, self.spawn_restore.call_count)
+
+    def test_cache_size(self):
+        # With a quota of 1 MiB, the oldest archive is evicted.
+        queue = self._queue(RestoreCacheSize='1')
+        job1 = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertTrue(job1.wait(5))
+        with open(job1.archive, 'wb') as f:
+            f.write(b'0' * 1024 * 1024)
+        job2 = queue.submit('admin', self._path('b'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job2.state)
+        self.assertFalse(os.path.exists(job1.archive))
+        # While the cache is full, the restore is not queued.
+        with open(job2.part, 'ab') as f:
+            f.write(b'0' * 1024 * 1024)
+        self.assertIsNone(queue.submit('admin', self._path('c'), 1454448640, 'utf-8', 'zip'))
+        self._release(self._path('b'))
+        self.assertTrue(job2.wait(5))
+
+    def test_cache_size_workers(self):
+        # Archives of other workers are evicted too.
+        queue = self._queue(RestoreCacheSize='1')
+        queue._check_cache_dir()
+        other = subprocess.Popen(['sleep', '5'])
+        self.addCleanup(other.kill)
+        archive = os.path.join(queue.cache_dir, ('%s.%s.zip' % ('0' * 40, other.pid)).encode('ascii'))
+        with open(archive, 'wb') as f:
+            f.write(b'0' * 1024 * 1024)
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job.state)
+        self.assertFalse(os.path.exists(archive))
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+
+    def test_submit_evicted(self):
+        # Archive evicted by another worker is restored again.
+        queue = self._queue()
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+        os.remove(job.archive)
+        job2 = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self.assertIsNot(job, job2)
+        self.assertTrue(job2.wait(5))
+        self.assertEqual(DONE, job2.state)
+
+    def test_cache_disabled(self):
+        queue = self._queue(RestoreCacheSize='0')
+        self.assertIsNone(queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip'))
+
+    def test_max_jobs(self):
+        queue = self._queue(RestoreMaxJobs='1')
+        job1 = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        job2 = queue.submit('bob', self._path('b'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job1.state)
+        self.assertEqual(QUEUED, job2.state)
+        self.assertEqual(1, queue.position(job2))
+        # Once the first job is completed, the next one start.
+        self._release(self._path('a'))
+        self.assertTrue(job1.wait(5))
+        self.assertEqual(RUNNING, job2.state)
+        self._release(self._path('b'))
+        self.assertTrue(job2.wait(5))
+
+    def test_max_jobs_per_user(self):
+        queue = self._queue(RestoreMaxJobs='2', RestoreMaxJobsPerUser='1')
+        job1 = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        job2 = queue.submit('admin', self._path('b'), 1454448640, 'utf-8', 'zip')
+        job3 = queue.submit('bob', self._path('c'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job1.state)
+        self.assertEqual(QUEUED, job2.state)
+        self.assertEqual(RUNNING, job3.state)
+        for name in ['a', 'b', 'c']:
+            self._release(self._path(name))
+        for job in [job1, job2, job3]:
+            self.assertTrue(job.wait(5))
+
+    def test_max_jobs_workers(self):
+        # Limits are shared by the workers.
+        leases = {}
+        queue1 = self._queue(leases, RestoreMaxJobs='1')
+        queue2 = self._queue(leases, RestoreMaxJobs='1')
+        job1 = queue1.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        job2 = queue2.submit('bob', self._path('b'), 1454448640, 'utf-8', 'zip')
+        self.assertEqual(RUNNING, job1.state)
+        self.assertEqual(QUEUED, job2.state)
+        # Once the first job is completed, the slot is released.
+        self._release(self._path('a'))
+        self.assertTrue(job1.wait(5))
+        self.assertEqual({}, leases)
+        self.assertIs(job2, queue2.submit('bob', self._path('b'), 1454448640, 'utf-8', 'zip'))
+        self.assertEqual(RUNNING, job2.state)
+        self._release(self._path('b'))
+        self.assertTrue(job2.wait(5))
+
+    def test_cleanup_workers(self):
+        # Running archive of another worker is kept.
+        queue = self._queue()
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        other = subprocess.Popen(['sleep', '5'])
+        self.addCleanup(other.kill)
+        running = os.path.join(queue.cache_dir, ('%s.%s.zip.part' % (job.key, other.pid)).encode('ascii'))
+        open(running, 'wb').close()
+        # Archive of a dead worker is removed.
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        stale = os.path.join(queue.cache_dir, ('%s.%s.zip.part' % (job.key, dead.pid)).encode('ascii'))
+        open(stale, 'wb').close()
+        queue.cleanup()
+        self.assertTrue(os.path.exists(running))
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(job.part))
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+
+    def test_follow(self):
+        queue = self._queue()
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertEqual(self._path('a'), b''.join(job.follow()))
+
+    def test_cleanup(self):
+        queue = self._queue(RestoreCacheTTL='0')
+        job = queue.submit('admin', self._path('a'), 1454448640, 'utf-8', 'zip')
+        self._release(self._path('a'))
+        self.assertTrue(job.wait(5))
+        queue.cleanup()
+        self.assertFalse(os.path.exists(job.archive))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the sessions stored in database.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdiffweb.core.sessions import DbSession
+from rdiffweb.core.store_sqlite import SQLiteBackend
+
+
+class DbSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        self.db = SQLiteBackend(os.path.join(self.temp_dir, 'rdw.db'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir, True)
+
+    def _session(self, id=None):
+        return DbSession(id, database=self.db, clean_freq=0)
+
+    def test_save_load(self):
+        session = self._session()
+        session.acquire_lock()
+        session['user'] = 'admin'
+        session.save()
+        self.assertFalse(session.locked)
+        # Session should be available to another process.
+        other = self._session(session.id)
+        self.assertFalse(other.missing)
+        self.assertEqual('admin', other['user'])
+        self.assertEqual(1, len(other))
+
+    def test_save_concurrent(self):
+        session = self._session()
+        session['user'] = 'admin'
+        session['lang'] = 'en'
+        session['theme'] = 'default'
+        session.save()
+        # Two requests from the same session handled by two processes.
+        first = self._session(session.id)
+        second = self._session(session.id)
+        first['user'] = 'bob'
+        del first['theme']
+        second['lang'] = 'fr'
+        first.save()
+        second.save()
+        # Changes of both requests are kept.
+        other = self._session(session.id)
+        self.assertEqual({'user': 'bob', 'lang': 'fr'}, dict(other.items()))
+
+    def test_missing(self):
+        session = self._session('invalid')
+        self.assertTrue(session.missing)
+        self.assertNotEqual('invalid', session.id)
+
+    def test_delete(self):
+        session = self._session()
+        session['user'] = 'admin'
+        session.save()
+        session.delete()
+        self.assertTrue(self._session(session.id).missing)
+
+    def test_clean_up(self):
+        session = self._session()
+        session['user'] = 'admin'
+        session.save()
+        session.clean_up()
+        self.assertEqual(1, len(session))
+        # Expire the session.
+        session.now = lambda: datetime.datetime.now() + datetime.timedelta(days=1)
+        session.clean_up()
+        self.assertEqual(0, len(session))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the background computation of repositories status.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+import cherrypy
+from mock import MagicMock
+
+from rdiffweb.core.status_refresher import StatusRefresher
+
+
+class MockApp(object):
+
+    def __init__(self, cfg, repos):
+        self.cfg = {k.lower(): v for k, v in cfg.items()}
+        self.store = MagicMock()
+        self.store.repos.side_effect = lambda: iter(repos)
+
+
+class StatusRefresherTest(unittest.TestCase):
+
+    def _repos(self, count):
+        return [MagicMock(name='repo%s' % i) for i in range(count)]
+
+    def test_refresh_all(self):
+        repos = self._repos(10)
+        refresher = StatusRefresher(cherrypy.engine, MockApp({}, repos))
+        self.assertEqual(10, refresher.refresh_all())
+        for repo in repos:
+            repo.refresh_status.assert_called_once_with()
+
+    def test_refresh_all_with_error(self):
+        repos = self._repos(3)
+        repos[0].refresh_status.side_effect = OSError()
+        refresher = StatusRefresher(cherrypy.engine, MockApp({}, repos))
+        refresher.refresh_all()
+        repos[2].refresh_status.assert_called_once_with()
+
+    def test_start_stop(self):
+        repos = self._repos(10)
+        done = threading.Event()
+        repos[-1].refresh_status.side_effect = lambda: done.set()
+        refresher = StatusRefresher(cherrypy.engine, MockApp({'StatusRefreshWorkers': '3'}, repos))
+        refresher.start()
+        try:
+            self.assertTrue(done.wait(5))
+            # Refresh again on demand.
+            done.clear()
+            refresher.refresh()
+            self.assertTrue(done.wait(5))
+        finally:
+            refresher.stop()
+        for repo in repos:
+            self.assertEqual(2, repo.refresh_status.call_count)
+
+    def test_start_without_lease(self):
+        # Status is refreshed by another process.
+        repos = self._repos(3)
+        app = MockApp({}, repos)
+        called = threading.Event()
+
+        def acquire_lease(name, ttl):
+            called.set()
+            return False
+        app.store.acquire_lease.side_effect = acquire_lease
+        refresher = StatusRefresher(cherrypy.engine, app)
+        refresher.start()
+        try:
+            self.assertTrue(called.wait(5))
+        finally:
+            refresher.stop()
+        app.store.acquire_lease.assert_called_with('StatusRefresher', ttl=300)
+        for repo in repos:
+            repo.refresh_status.assert_not_called()
+
+    def test_start_disabled(self):
+        refresher = StatusRefresher(cherrypy.engine, MockApp({'StatusRefreshInterval': '0'}, []))
+        refresher.start()
+        self.assertIsNone(refresher._thread)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
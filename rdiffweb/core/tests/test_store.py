@@ -32,14 +32,14 @@ import logging
 import os
 import unittest
 
-from mock import MagicMock
+from mock import MagicMock, patch
 from mockldap import MockLdap
 import pkg_resources
 
 from rdiffweb.core import RdiffError, authorizedkeys
 from rdiffweb.core.librdiff import AccessDeniedError
 from rdiffweb.core.store import IUserChangeListener, ADMIN_ROLE, USER_ROLE,\
-    MAINTAINER_ROLE
+    MAINTAINER_ROLE, RepoObject
 from rdiffweb.test import AppTestCase
 
 
@@ -268,6 +268,67 @@ class StoreTest(AppTestCase):
         self.assertEqual('annik', data[0].owner)
         self.assertEqual('laptop', data[0].name)
 
+    def test_repos_with_paging(self):
+        user_obj = self.app.store.add_user('annik')
+        for name in ['repo1', 'repo2', 'repo3']:
+            user_obj.add_repo(name)
+        data = list(self.app.store.repos(limit=2, offset=1))
+        self.assertEqual(['repo2', 'repo3'], [r.name for r in data])
+        self.assertEqual(3, self.app.store.count_repos())
+
+    def test_repos_with_criteria(self):
+        user_obj = self.app.store.add_user('annik')
+        user_obj.add_repo('missing')
+        # Status is unknown until computed in background.
+        with patch.object(RepoObject, 'refresh_status') as mock_refresh:
+            self.assertEqual([], list(self.app.store.repos(criteria='failed')))
+            self.assertEqual(['missing'], [r.name for r in self.app.store.repos(criteria='unknown')])
+            self.assertEqual(1, self.app.store.count_repos(criteria='unknown'))
+            self.assertFalse(mock_refresh.called)
+        # Status is computed and kept in database.
+        self.app.status_refresher.refresh_all()
+        self.assertEqual(['missing'], [r.name for r in self.app.store.repos(criteria='failed')])
+        self.assertEqual([], list(self.app.store.repos(criteria='ok')))
+        self.assertEqual('failed', self.app.store._database.findone('repos', repopath='missing')['status'])
+        self.assertEqual(1, self.app.store.count_repos(criteria='failed'))
+
+    def test_repo_status_from_database(self):
+        user_obj = self.app.store.add_user('annik')
+        user_obj.add_repo('missing')
+        # Status never recorded is computed.
+        repo_obj = user_obj.get_repo('missing')
+        self.assertEqual('failed', repo_obj.status[0])
+        self.assertEqual('failed', self.app.store._database.findone('repos', repopath='missing')['status'])
+        # Status recorded by any process is read from database.
+        self.app.store._database.update('repos', userid=user_obj.userid, repopath='missing', status='in_progress')
+        repo_obj = user_obj.get_repo('missing')
+        with patch.object(RepoObject, 'refresh_status') as mock_refresh:
+            self.assertEqual('in_progress', repo_obj.status[0])
+            self.assertFalse(mock_refresh.called)
+
+    def test_repo_clear_cache_generation(self):
+        user_obj = self.app.store.add_user('annik')
+        user_obj.add_repo('missing')
+        state = user_obj.get_repo('missing')._state
+        self.assertIs(state, user_obj.get_repo('missing')._state)
+        # Data is discarded when cleared by this process.
+        user_obj.get_repo('missing').clear_cache()
+        self.assertEqual(1, self.app.store._database.findone('repos', repopath='missing')['generation'])
+        state = user_obj.get_repo('missing')._state
+        self.assertIs(state, user_obj.get_repo('missing')._state)
+        # Data is discarded when cleared by another process.
+        self.app.store._database.increment_generation(user_obj.userid, 'missing')
+        self.assertIsNot(state, user_obj.get_repo('missing')._state)
+
+    def test_repos_single_query(self):
+        user_obj = self.app.store.add_user('annik')
+        user_obj.add_repo('laptop')
+        user_obj.add_repo('desktop')
+        with patch.object(self.app.store._database, 'findone') as mock_findone:
+            data = list(self.app.store.repos())
+            self.assertEqual(['annik', 'annik'], [r.owner for r in data])
+            self.assertFalse(mock_findone.called)
+
     def test_search(self):
         """
         Check if search is working.
@@ -722,6 +783,55 @@ class RepoObjectTest(AppTestCase):
         with self.assertRaises(ValueError):
             repo_obj.keepdays = "invalid"
 
+    def test_update_backups(self):
+        userobj = self.app.store.get_user(self.USERNAME)
+        repo_obj = userobj.get_repo(self.REPO)
+        repo_obj.update_backups()
+        self.assertEqual(len(repo_obj.backup_dates), self.app.store.count_backups(userobj))
+        backups = list(self.app.store.backups(userobj, limit=1))
+        self.assertEqual(repo_obj.backup_dates[0], backups[0]['date'])
+        self.assertEqual(repo_obj, backups[0]['repo'])
+        # Nothing is read until rdiff-backup-data is modified.
+        with patch.object(RepoObject, 'get_history_entries') as mock_entries:
+            userobj.get_repo(self.REPO).update_backups()
+            self.assertFalse(mock_entries.called)
+
+    def test_update_backups_deleted(self):
+        userobj = self.app.store.get_user(self.USERNAME)
+        repo_obj = userobj.get_repo(self.REPO)
+        repoid = repo_obj._get_attr('repoid')
+        self.app.store._database.insert('backups', repoid=repoid, backupdate=1000, size=0, errors=0, errorexcerpt='')
+        repo_obj.update_backups()
+        # Backups removed from the repository are deleted.
+        self.assertEqual(len(repo_obj.backup_dates), self.app.store.count_backups(userobj, repo_obj))
+        repo_obj.delete()
+        self.assertEqual(0, self.app.store._database.count('backups'))
+
+    def test_update_backups_concurrent(self):
+        userobj = self.app.store.get_user(self.USERNAME)
+        repo_obj = userobj.get_repo(self.REPO)
+        repoid = repo_obj._get_attr('repoid')
+        # Backup recorded by another process in the meantime.
+        self.app.store._database.insert('backups', repoid=repoid, backupdate=repo_obj.backup_dates[1].epoch(), size=0, errors=0, errorexcerpt='')
+        with patch.object(self.app.store._database, 'find_backups', return_value=[]):
+            repo_obj.update_backups()
+        self.assertEqual(len(repo_obj.backup_dates), self.app.store.count_backups(userobj, repo_obj))
+
+    def test_update_backups_interrupted(self):
+        userobj = self.app.store.get_user(self.USERNAME)
+        repo_obj = userobj.get_repo(self.REPO)
+        backup_dates = list(repo_obj.backup_dates)
+        # Simulate a backup interrupted after the last one.
+        data_path = os.path.join(repo_obj.full_path, b'rdiff-backup-data')
+        with open(os.path.join(data_path, b'current_mirror.2016-02-03T10:00:00-05:00.data'), 'wb') as f:
+            f.write(b'PID 999999\n')
+        open(os.path.join(data_path, b'mirror_metadata.2016-02-03T10:00:00-05:00.snapshot.gz'), 'wb').close()
+        repo_obj = userobj.get_repo(self.REPO)
+        self.assertEqual('interrupted', repo_obj.status[0])
+        repo_obj.update_backups()
+        # Completed backups are recorded.
+        self.assertEqual(len(backup_dates), self.app.store.count_backups(userobj, repo_obj))
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the PostgreSQL backend. Require a database defined by
+the environment variable `RDIFFWEB_TEST_POSTGRESQL_URI`. All the tables of
+this database are deleted.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import threading
+import unittest
+
+from rdiffweb.core.store_postgresql import PostgreSQLBackend, psycopg2
+
+URI = os.environ.get('RDIFFWEB_TEST_POSTGRESQL_URI')
+
+
+@unittest.skipUnless(psycopg2 and URI, 'require psycopg2 and RDIFFWEB_TEST_POSTGRESQL_URI')
+class PostgreSQLBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = PostgreSQLBackend(URI, pool_size=2)
+
+    def tearDown(self):
+        self.db._rowcount('DROP TABLE IF EXISTS users, repos, sshkeys, sessions, leases, backups, schema_version')
+        self.db.close()
+
+    def test_insert_find(self):
+        self.db.insert('users', username='kim')
+        record = self.db.findone('users', username='kim')
+        self.assertEqual('kim', record['username'])
+        self.assertEqual(10, record['role'])
+        self.assertEqual(1, self.db.count('users'))
+        self.assertIsNone(self.db.findone('users', username='invalid'))
+
+    def test_update_delete(self):
+        self.db.insert('users', username='kim')
+        self.assertEqual(1, self.db.update('users', username='kim', useremail='kim@example.com'))
+        self.assertEqual('kim@example.com', self.db.findone('users', username='kim')['useremail'])
+        self.assertEqual(1, self.db.delete('users', username='kim'))
+        self.assertEqual(0, self.db.count('users'))
+
+    def test_search(self):
+        self.db.insert('users', username='annik')
+        self.db.insert('users', username='kim')
+        self.assertEqual(2, len(self.db.search('users', 'K', 'username')))
+
+    def test_create_trgm_indexes_after_upgrade(self):
+        if not self.db._fetchall("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"):
+            self.skipTest('require pg_trgm extension')
+        # Indexes missing because pg_trgm was not available.
+        self.db._rowcount('DROP INDEX idx_users_username_trgm, idx_users_useremail_trgm, idx_repos_repopath_trgm')
+        self.db.close()
+        self.db = PostgreSQLBackend(URI, pool_size=2)
+        indexes = [r['indexname'] for r in self.db._fetchall("SELECT indexname FROM pg_indexes WHERE indexname LIKE '%_trgm'")]
+        self.assertEqual(3, len(indexes))
+
+    def test_find_repos(self):
+        self.db.insert('users', username='annik')
+        userid = self.db.findone('users', username='annik')['userid']
+        self.db.insert('repos', userid=userid, repopath='laptop')
+        self.db.insert('repos', userid=userid, repopath='desktop')
+        repos = self.db.find_repos(limit=1, offset=1)
+        self.assertEqual(['desktop'], [r['repopath'] for r in repos])
+        self.assertEqual('annik', repos[0]['username'])
+        self.assertEqual(1, self.db.count_repos(search='lap'))
+
+    def test_find_backups(self):
+        self.db.insert('users', username='annik')
+        userid = self.db.findone('users', username='annik')['userid']
+        self.db.insert('repos', userid=userid, repopath='laptop')
+        repoid = self.db.findone('repos', repopath='laptop')['repoid']
+        self.db.insert('backups', repoid=repoid, backupdate=100, size=2 ** 40, errors=0, errorexcerpt='')
+        self.db.insert('backups', repoid=repoid, backupdate=200, size=0, errors=1, errorexcerpt='failed')
+        backups = self.db.find_backups(userid=userid, reverse=True)
+        self.assertEqual([200, 100], [r['backupdate'] for r in backups])
+        self.assertEqual(2 ** 40, backups[1]['size'])
+        self.assertEqual(1, self.db.count_backups(userid=userid, errors=True))
+        self.assertEqual(1, self.db.delete_backups(userid=userid, before=200))
+
+    def test_insert_duplicate_repo(self):
+        self.db.insert('repos', userid=1, repopath='laptop')
+        with self.assertRaises(self.db.IntegrityError):
+            self.db.insert('repos', userid=1, repopath='laptop')
+
+    def test_transaction_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.insert('users', username='kim')
+                raise ValueError()
+        self.assertIsNone(self.db.findone('users', username='kim'))
+
+    def test_acquire_lease(self):
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        self.assertFalse(self.db.acquire_lease('RemoveOlder', 'host:2', 3600))
+
+    def test_insert_ignore(self):
+        self.assertEqual(1, self.db.insert_ignore('leases', name='RemoveOlder', owner='host:1', expirationtime=0))
+        # Existing record is kept.
+        self.assertEqual(0, self.db.insert_ignore('leases', name='RemoveOlder', owner='host:2', expirationtime=0))
+        self.assertEqual('host:1', self.db.findone('leases', name='RemoveOlder')['owner'])
+
+    def test_release_lease(self):
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        self.assertFalse(self.db.release_lease('RemoveOlder', 'host:2'))
+        self.assertTrue(self.db.release_lease('RemoveOlder', 'host:1'))
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:2', 3600))
+
+    def test_concurrent_access(self):
+        errors = []
+
+        def insert(name):
+            try:
+                self.db.insert('users', username=name)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=insert, args=('user%s' % i,)) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(10, self.db.count('users'))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
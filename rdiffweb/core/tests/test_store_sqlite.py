@@ -23,9 +23,17 @@ Created on Oct 17, 2015
 
 from __future__ import unicode_literals
 
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
 import unittest
 
+from mock import patch
+
 from rdiffweb.core import RdiffError
+from rdiffweb.core.store_sqlite import SQLiteBackend
 from rdiffweb.test import AppTestCase
 
 
@@ -93,6 +101,41 @@ class SQLiteBackendTest(AppTestCase):
         repos = list(self.db.search('repos', 'annik', 'username'))
         self.assertEqual(2, len(repos))
 
+    def test_find_repos(self):
+        annik = self.app.store.add_user('annik')
+        annik.add_repo('coucou1')
+        annik.add_repo('repo1')
+        kim = self.app.store.add_user('kim')
+        kim.add_repo('coucou2')
+        # Records contains the user and the repo.
+        repos = self.db.find_repos(search='cou')
+        self.assertEqual(['annik', 'kim'], [r['username'] for r in repos])
+        self.assertEqual(['coucou1', 'coucou2'], [r['repopath'] for r in repos])
+        self.assertEqual(2, self.db.count_repos(search='cou'))
+        # With paging
+        repos = self.db.find_repos(limit=1, offset=1)
+        self.assertEqual(['repo1'], [r['repopath'] for r in repos])
+        # With status
+        self.assertEqual(3, self.db.count_repos(status=''))
+        self.assertEqual(0, self.db.count_repos(status='ok'))
+
+    def test_search_with_full_text(self):
+        self.app.store.add_user('annik')
+        self.app.store.add_user('kim')
+        self.assertTrue(self.db._fts)
+        users = list(self.db.search('users', 'NNI', 'username'))
+        self.assertEqual(['annik'], [u['username'] for u in users])
+        # Index updated with the record.
+        self.db.update('users', username='kim', useremail='kim@example.com')
+        users = list(self.db.search('users', 'example', 'username', 'useremail'))
+        self.assertEqual(['kim'], [u['username'] for u in users])
+
+    def test_insert_duplicate_repo(self):
+        annik = self.app.store.add_user('annik')
+        annik.add_repo('repo1')
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.insert('repos', userid=annik.userid, repopath='repo1')
+
     def test_insert(self):
         self.db.insert('users', username='kim')
         userid = self.db.findone('users', username='kim')['userid']
@@ -108,6 +151,150 @@ class SQLiteBackendTest(AppTestCase):
         
         self.assertEquals("This should be a very long clob with sshkeys", data.get('key'))
 
+    def test_connection_reused(self):
+        self.assertIs(self.db._connect(), self.db._connect())
+
+    def test_connection_per_thread(self):
+        conns = []
+        t = threading.Thread(target=lambda: conns.append(self.db._connect()))
+        t.start()
+        t.join()
+        self.assertIsNot(self.db._connect(), conns[0])
+
+    def test_journal_mode(self):
+        self.assertEqual('wal', self.db._fetchall('PRAGMA journal_mode')[0]['journal_mode'])
+
+    def test_transaction(self):
+        with self.db.transaction():
+            self.db.insert('users', username='kim')
+            with self.db.transaction():
+                self.db.insert('users', username='bob')
+        self.assertIsNotNone(self.db.findone('users', username='kim'))
+        self.assertIsNotNone(self.db.findone('users', username='bob'))
+
+    def test_transaction_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.insert('users', username='kim')
+                raise ValueError()
+        self.assertIsNone(self.db.findone('users', username='kim'))
+
+    def test_acquire_lease(self):
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        # Lease is renewed by the owner.
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        # Lease is refused to other owner.
+        self.assertFalse(self.db.acquire_lease('RemoveOlder', 'host:2', 3600))
+        self.assertTrue(self.db.acquire_lease('NotificationPlugin', 'host:2', 3600))
+
+    def test_insert_ignore(self):
+        self.assertEqual(1, self.db.insert_ignore('leases', name='RemoveOlder', owner='host:1', expirationtime=0))
+        # Existing record is kept.
+        self.assertEqual(0, self.db.insert_ignore('leases', name='RemoveOlder', owner='host:2', expirationtime=0))
+        self.assertEqual('host:1', self.db.findone('leases', name='RemoveOlder')['owner'])
+
+    def test_release_lease(self):
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', 3600))
+        # Lease is only released by the owner.
+        self.assertFalse(self.db.release_lease('RemoveOlder', 'host:2'))
+        self.assertTrue(self.db.release_lease('RemoveOlder', 'host:1'))
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:2', 3600))
+
+    def test_acquire_lease_expired(self):
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:1', -1))
+        self.assertTrue(self.db.acquire_lease('RemoveOlder', 'host:2', 3600))
+        self.assertEqual('host:2', self.db.findone('leases', name='RemoveOlder')['owner'])
+
+    def test_find_backups(self):
+        annik = self.app.store.add_user('annik')
+        annik.add_repo('laptop')
+        annik.add_repo('desktop')
+        laptop = self.db.findone('repos', repopath='laptop')['repoid']
+        desktop = self.db.findone('repos', repopath='desktop')['repoid']
+        self.db.insert('backups', repoid=laptop, backupdate=100, size=10, errors=0, errorexcerpt='')
+        self.db.insert('backups', repoid=desktop, backupdate=200, size=20, errors=1, errorexcerpt='failed')
+        self.db.insert('backups', repoid=laptop, backupdate=300, size=30, errors=0, errorexcerpt='')
+        backups = self.db.find_backups(userid=annik.userid)
+        self.assertEqual([100, 200, 300], [r['backupdate'] for r in backups])
+        self.assertEqual(['laptop', 'desktop', 'laptop'], [r['repopath'] for r in backups])
+        # With criteria
+        self.assertEqual(2, self.db.count_backups(repoid=laptop))
+        self.assertEqual(['failed'], [r['errorexcerpt'] for r in self.db.find_backups(errors=True)])
+        self.assertEqual(2, self.db.count_backups(start=150, end=300))
+        # With paging
+        self.assertEqual([200], [r['backupdate'] for r in self.db.find_backups(reverse=True, limit=1, offset=1)])
+        # Delete
+        self.assertEqual(1, self.db.delete_backups(repoid=laptop, before=300))
+        self.assertEqual(2, self.db.delete_backups(userid=annik.userid))
+        self.assertEqual(0, self.db.count('backups'))
+
+
+class SQLiteBackendMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_db_')
+        self.db_file = os.path.join(self.temp_dir, 'rdiffweb.tmp.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, True)
+
+    def test_migrate_unversioned_database(self):
+        # Create a database as created by previous version.
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("""create table users (
+UserID integer primary key autoincrement,
+Username varchar (50) unique NOT NULL,
+Password varchar (40) NOT NULL DEFAULT "",
+UserRoot varchar (255) NOT NULL DEFAULT "",
+IsAdmin tinyint NOT NULL DEFAULT FALSE,
+UserEmail varchar (255) NOT NULL DEFAULT "",
+RestoreFormat tinyint NOT NULL DEFAULT TRUE)""")
+        conn.execute("""create table repos (
+RepoID integer primary key autoincrement,
+UserID int(11) NOT NULL,
+RepoPath varchar (255) NOT NULL,
+MaxAge tinyint NOT NULL DEFAULT 0)""")
+        conn.execute("INSERT INTO users (Username, IsAdmin) VALUES ('admin', 1)")
+        conn.execute("INSERT INTO repos (UserID, RepoPath) VALUES (1, 'laptop')")
+        conn.execute("INSERT INTO repos (UserID, RepoPath, MaxAge) VALUES (1, 'laptop', 3)")
+        conn.execute("INSERT INTO repos (UserID, RepoPath, MaxAge) VALUES (1, 'laptop', 5)")
+        conn.execute("INSERT INTO repos (UserID, RepoPath) VALUES (1, 'desktop')")
+        conn.commit()
+        conn.close()
+        # Open database
+        db = SQLiteBackend(self.db_file)
+        self.assertEqual(6, db._fetchall('PRAGMA user_version')[0]['user_version'])
+        self.assertEqual(0, db.findone('users', username='admin')['role'])
+        # Duplicate repositories are merged into the oldest one.
+        self.assertEqual(2, db.count('repos'))
+        repo = db.findone('repos', repopath='laptop')
+        self.assertEqual(1, repo['repoid'])
+        self.assertEqual(3, repo['maxage'])
+        # Existing records are indexed.
+        self.assertEqual(1, len(db.search('users', 'adm', 'username')))
+        indexes = [r['name'] for r in db._fetchall("SELECT name FROM sqlite_master WHERE type='index'")]
+        self.assertIn('idx_repos_userid_repopath', indexes)
+
+    def test_migrate_once(self):
+        SQLiteBackend(self.db_file)
+        with patch.object(SQLiteBackend, '_migrate_1') as mock_migrate:
+            SQLiteBackend(self.db_file)
+            self.assertFalse(mock_migrate.called)
+
+    def test_create_fts_after_upgrade(self):
+        # Full text search not supported when the database was migrated.
+        with patch.object(SQLiteBackend, '_create_fts'):
+            db = SQLiteBackend(self.db_file)
+            db.insert('users', username='annik')
+            self.assertFalse(db._fts)
+            db.close()
+        # Tables are created when SQLite supports it.
+        db = SQLiteBackend(self.db_file)
+        self.assertTrue(db._fts)
+        self.assertEqual(1, len(db.search('users', 'nni', 'username')))
+        db.insert('users', username='kim')
+        self.assertEqual(1, len(db.search('users', 'kim', 'username')))
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module used to test the watcher of user roots.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cherrypy
+from mock import MagicMock
+
+from rdiffweb.core.librdiff import DoesNotExistError
+from rdiffweb.core.watcher import Inotify, RepoWatcher, IN_CREATE, _libc
+
+
+class MockApp(object):
+
+    def __init__(self, cfg, user_root):
+        self.cfg = {k.lower(): v for k, v in cfg.items()}
+        self.store = MagicMock()
+        self.user = MagicMock()
+        self.user.username = 'admin'
+        self.user.user_root = user_root
+        self.store.users.side_effect = lambda: iter([self.user])
+        self.store.get_user.return_value = self.user
+
+
+def wait_for(func, timeout=5):
+    t = time.time() + timeout
+    while not func() and time.time() < t:
+        time.sleep(0.05)
+    return func()
+
+
+@unittest.skipIf(_libc is None, 'inotify not available')
+class RepoWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_')
+        self.app = MockApp({'WatchRepos': 'true'}, self.temp_dir)
+        self.watcher = RepoWatcher(cherrypy.engine, self.app)
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.temp_dir, True)
+
+    def _path(self, *args):
+        return os.path.join(self.temp_dir, *args).encode('utf-8')
+
+    def test_inotify_read(self):
+        inotify = Inotify()
+        try:
+            wd = inotify.add_watch(self.temp_dir.encode('utf-8'), IN_CREATE)
+            self.assertEqual([], inotify.read(0))
+            open(self._path('file'), 'w').close()
+            self.assertEqual([(wd, IN_CREATE, b'file')], inotify.read(1))
+        finally:
+            inotify.close()
+
+    def test_disabled(self):
+        watcher = RepoWatcher(cherrypy.engine, MockApp({}, self.temp_dir))
+        watcher.start()
+        self.assertIsNone(watcher._thread)
+
+    def test_existing_repo(self):
+        os.makedirs(self._path('laptop', 'rdiff-backup-data'))
+        self.app.user.get_repo.side_effect = DoesNotExistError()
+        self.watcher.start()
+        self.assertTrue(wait_for(lambda: self.app.user.add_repo.called))
+        self.app.user.add_repo.assert_called_once_with(b'laptop')
+
+    def test_new_repo(self):
+        self.app.user.get_repo.side_effect = DoesNotExistError()
+        self.watcher.start()
+        self.assertTrue(wait_for(lambda: self.app.store.users.called))
+        time.sleep(0.1)
+        os.makedirs(self._path('home', 'laptop'))
+        time.sleep(0.1)
+        os.makedirs(self._path('home', 'laptop', 'rdiff-backup-data'))
+        self.assertTrue(wait_for(lambda: self.app.user.add_repo.called))
+        self.app.user.add_repo.assert_called_once_with(b'home/laptop')
+
+    def test_backup_completed(self):
+        os.makedirs(self._path('laptop', 'rdiff-backup-data'))
+        repo_obj = self.app.user.get_repo.return_value
+        self.watcher.start()
+        self.assertTrue(wait_for(lambda: self.app.user.get_repo.called))
+        time.sleep(0.1)
+        open(self._path('laptop', 'rdiff-backup-data', 'current_mirror.2016-02-02T16:30:40-05:00.data'), 'w').close()
+        self.assertTrue(wait_for(lambda: repo_obj.refresh_status.called))
+        self.assertTrue(repo_obj.clear_cache.called)
+        self.assertFalse(self.app.user.add_repo.called)
+
+    def test_user_root_changed(self):
+        os.makedirs(self._path('old', 'laptop', 'rdiff-backup-data'))
+        os.makedirs(self._path('new'))
+        self.app.user.user_root = self._path('old').decode('utf-8')
+        self.app.user.get_repo.side_effect = DoesNotExistError()
+        self.watcher.start()
+        self.assertTrue(wait_for(lambda: self.app.user.add_repo.called))
+        # Only the new user root should be watched.
+        self.app.user.user_root = self._path('new').decode('utf-8')
+        self.watcher.user_attr_changed(self.app.user, {'user_root': self.app.user.user_root})
+        paths = [watch[2] for watch in self.watcher._watches.values()]
+        self.assertEqual([self._path('new')], paths)
+        self.app.user.add_repo.reset_mock()
+        os.makedirs(self._path('old', 'desktop', 'rdiff-backup-data'))
+        os.makedirs(self._path('new', 'desktop', 'rdiff-backup-data'))
+        self.assertTrue(wait_for(lambda: self.app.user.add_repo.called))
+        time.sleep(0.2)
+        self.app.user.add_repo.assert_called_once_with(b'desktop')
+
+    def test_without_lease(self):
+        # User roots are watched by another process.
+        os.makedirs(self._path('laptop', 'rdiff-backup-data'))
+        self.app.store.acquire_lease.return_value = False
+        self.watcher.start()
+        self.assertTrue(wait_for(lambda: self.app.store.acquire_lease.called))
+        time.sleep(0.1)
+        self.assertFalse(self.app.store.users.called)
+        self.assertIsNone(self.watcher._inotify)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
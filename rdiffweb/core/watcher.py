@@ -0,0 +1,333 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2019 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Watch the user roots using inotify (Linux only).
+
+The directories of every user root are watched up to `MAX_DEPTH` to add the
+new repositories to the store as soon as `rdiff-backup-data` is created.
+The `rdiff-backup-data` directories are watched to discard the repository
+data shared between requests and to refresh the status when a backup starts
+or completes. When multiple processes share the same database, only the
+process holding the lease watches the user roots; the other processes are
+notified through the generation of the repositories stored in the database.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+from future.utils.surrogateescape import encodefilename
+
+from rdiffweb.core.config import BoolOption
+from rdiffweb.core.librdiff import RDIFF_BACKUP_DATA, DoesNotExistError
+from rdiffweb.core.store import IUserChangeListener, MAX_DEPTH, SEP
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
+
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events watched in the user root.
+_DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+
+# Events watched in rdiff-backup-data.
+_DATA_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | IN_ONLYDIR
+
+_EVENT = struct.Struct(str('iIII'))
+
+# Number of seconds the lease of the watcher is kept without being renewed.
+_LEASE_TTL = 60
+
+
+class Inotify(object):
+    """
+    Minimal wrapper of the inotify API.
+    """
+
+    def __init__(self):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path, mask):
+        wd = _libc.inotify_add_watch(self.fd, ctypes.c_char_p(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd):
+        if _libc.inotify_rm_watch(self.fd, ctypes.c_int(wd)) < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def read(self, timeout=None):
+        """
+        Return the list of events as tuple (wd, mask, name). Return an empty
+        list if no event is received before `timeout`.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _unused, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RepoWatcher(SimplePlugin, IUserChangeListener):
+    """
+    Plugin watching the user roots to keep the repositories up to date.
+    """
+
+    _enabled = BoolOption("WatchRepos", False)
+
+    def __init__(self, bus, app):
+        SimplePlugin.__init__(self, bus)
+        IUserChangeListener.__init__(self, app)
+        self._inotify = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.RLock()
+        # Watch descriptor -> (username, user root, path, is rdiff-backup-data)
+        self._watches = {}
+
+    def start(self):
+        if not self._enabled or self._thread:
+            return
+        if _libc is None:
+            logger.warning("inotify is not available, repositories are not watched")
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join(10)
+        self._thread = None
+
+    def user_attr_changed(self, userobj, attrs={}):
+        """Watch the new user root instead of the previous one."""
+        if 'user_root' not in attrs:
+            return
+        with self._lock:
+            if self._inotify:
+                self._unwatch_user(userobj.username)
+                self._watch_user(userobj)
+
+    def user_deleted(self, user):
+        with self._lock:
+            if self._inotify:
+                self._unwatch_user(user)
+
+    def _acquire_lease(self):
+        """
+        Return True if this process is elected to watch the user roots.
+        """
+        try:
+            return self.app.store.acquire_lease(self.__class__.__name__, ttl=_LEASE_TTL)
+        except Exception:
+            logger.warning("fail to acquire lease for [%s]", self.__class__.__name__, exc_info=1)
+            return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._acquire_lease():
+                self._stopped.wait(_LEASE_TTL / 3)
+                continue
+            try:
+                self._watch()
+            except Exception:
+                logger.exception("fail to watch user roots")
+                self._stopped.wait(_LEASE_TTL / 3)
+
+    def _watch(self):
+        """
+        Watch the user roots until the plugin is stopped or the lease is
+        acquired by another process.
+        """
+        with self._lock:
+            self._inotify = Inotify()
+        try:
+            self._watch_users()
+            renewed = time.time()
+            while not self._stopped.is_set():
+                if time.time() - renewed > _LEASE_TTL / 3:
+                    if not self._acquire_lease():
+                        logger.info("user roots are watched by another process")
+                        return
+                    renewed = time.time()
+                for wd, mask, name in self._inotify.read(1):
+                    try:
+                        self._handle(wd, mask, name)
+                    except Exception:
+                        logger.warning("fail to handle event on [%r]", name, exc_info=1)
+        finally:
+            with self._lock:
+                self._inotify.close()
+                self._inotify = None
+                self._watches.clear()
+
+    def _watch_users(self):
+        for userobj in self.app.store.users():
+            self._watch_user(userobj)
+
+    def _watch_user(self, userobj):
+        user_root = userobj.user_root
+        if not user_root:
+            return
+        user_root = encodefilename(user_root).rstrip(SEP) or SEP
+        self._scan(userobj.username, user_root, user_root)
+
+    def _unwatch_user(self, username):
+        """
+        Stop watching the directories of the given user.
+        """
+        with self._lock:
+            for wd, watch in list(self._watches.items()):
+                if watch[0] != username:
+                    continue
+                del self._watches[wd]
+                try:
+                    self._inotify.rm_watch(wd)
+                except OSError:
+                    # Directory was deleted.
+                    pass
+
+    def _add_watch(self, path, mask, username, user_root, is_data):
+        try:
+            wd = self._inotify.add_watch(path, mask)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.warning("fail to watch [%r], increase fs.inotify.max_user_watches", path)
+            else:
+                logger.debug("fail to watch [%r]", path, exc_info=1)
+            return
+        with self._lock:
+            self._watches[wd] = (username, user_root, path, is_data)
+
+    def _scan(self, username, user_root, top):
+        """
+        Watch the directories found in `top` and add the repositories.
+        """
+        for root, dirs, unused_files in os.walk(top):
+            self._add_watch(root, _DIR_MASK, username, user_root, False)
+            if RDIFF_BACKUP_DATA in dirs:
+                self._add_repo(username, user_root, root)
+                # Do not look for repositories inside a repository.
+                del dirs[:]
+            if root.count(SEP) - user_root.count(SEP) >= MAX_DEPTH:
+                del dirs[:]
+
+    def _add_repo(self, username, user_root, path):
+        self._add_watch(os.path.join(path, RDIFF_BACKUP_DATA), _DATA_MASK, username, user_root, True)
+        repopath = self._repopath(user_root, path)
+        userobj = self.app.store.get_user(username)
+        if not userobj:
+            return
+        try:
+            userobj.get_repo(repopath)
+        except DoesNotExistError:
+            logger.info("add repository [%r] to user [%s]", repopath, username)
+            userobj.add_repo(repopath)
+
+    def _repopath(self, user_root, path):
+        repopath = os.path.relpath(path, start=user_root)
+        # Handle special scenario when the repo is the user_root
+        return b'' if repopath == b'.' else repopath
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("too many changes, scanning user roots again")
+            self._watch_users()
+            return
+        with self._lock:
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                return
+            watch = self._watches.get(wd)
+        if watch is None:
+            return
+        username, user_root, path, is_data = watch
+        if is_data:
+            self._data_changed(username, user_root, os.path.dirname(path), name)
+        elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            if name == RDIFF_BACKUP_DATA:
+                self._add_repo(username, user_root, path)
+            elif path.count(SEP) - user_root.count(SEP) < MAX_DEPTH:
+                self._scan(username, user_root, os.path.join(path, name))
+
+    def _data_changed(self, username, user_root, path, name):
+        """
+        Called when rdiff-backup-data is modified.
+        """
+        userobj = self.app.store.get_user(username)
+        if not userobj:
+            return
+        try:
+            repo_obj = userobj.get_repo(self._repopath(user_root, path))
+        except DoesNotExistError:
+            return
+        repo_obj.clear_cache()
+        # Backup started or completed.
+        if name.startswith(b'current_mirror'):
+            repo_obj.refresh_status()
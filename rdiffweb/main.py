@@ -23,9 +23,13 @@ import getopt
 import logging
 import logging.config
 import logging.handlers
+import os
+import signal
+import socket
 import sys
 import tempfile
 import threading
+import time
 import traceback
 
 import cherrypy
@@ -146,6 +150,91 @@ def setup_logging(log_file, log_access_file, level):
         cherrypy_error.addHandler(handler)
 
 
+def bind_socket(host, port):
+    """
+    Called by `start()` to create the listening socket shared by the worker
+    processes. Should be called before opening any file to get file
+    descriptor 3 as expected by systemd socket activation. Only IPv4 is
+    supported because the HTTP server expects an AF_INET socket.
+    """
+    try:
+        family, socktype, proto, _unused, sockaddr = socket.getaddrinfo(
+            host, port, socket.AF_INET, socket.SOCK_STREAM)[0]
+    except socket.gaierror:
+        raise ValueError("ServerHost must be an IPv4 address when running multiple workers: %s" % host)
+    sock = socket.socket(family, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(sockaddr)
+    sock.listen(socket.SOMAXCONN)
+    if sock.fileno() != 3:
+        try:
+            os.fstat(3)
+        except OSError:
+            os.dup2(sock.fileno(), 3)
+        else:
+            raise RuntimeError("file descriptor 3 is already in use")
+    return sock
+
+
+def start_workers(workers, sock):
+    """
+    Called by `start()` to fork the worker processes sharing the same
+    listening socket. Return in the worker processes. The master process
+    restarts the worker exiting unexpectedly and stops the workers when
+    receiving SIGTERM or SIGINT. SIGHUP restarts the workers.
+    """
+    logger.info("listening on %s with %s workers", sock.getsockname(), workers)
+
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
+                signal.signal(signum, signal.SIG_DFL)
+            # Workers are getting the socket as file descriptor 3 according
+            # to systemd socket activation.
+            os.environ[nativestr('LISTEN_PID')] = nativestr(os.getpid())
+            os.environ[nativestr('LISTEN_FDS')] = nativestr('1')
+            return True
+        children.add(pid)
+        return False
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def restart(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, restart)
+
+    for _unused in range(workers):
+        if spawn():
+            return
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError:
+            # Interrupted by a signal.
+            continue
+        children.discard(pid)
+        if stopping:
+            continue
+        logger.info("worker [%s] exited with status [%s], restarting", pid, status)
+        # Avoid restarting the workers in a tight loop.
+        time.sleep(1)
+        if spawn():
+            return
+    logger.info("STOP")
+    sys.exit(0)
+
+
 def start():
     """Start rdiffweb deamon."""
     # Parse command line options
@@ -157,6 +246,7 @@ def start():
             'log-file=',
             'log-access-file=',
             'config=',
+            'workers=',
         ])[0]
     for option, value in opts:
         if option in ['-d', '--debug']:
@@ -167,6 +257,8 @@ def start():
             args['log_access_file'] = value
         elif option in ['-f', '--config']:
             args['config'] = value
+        elif option in ['--workers']:
+            args['workers'] = value
 
     # Open config file before opening the apps.
     configfile = args.get('config', '/etc/rdiffweb/rdw.conf')
@@ -180,18 +272,35 @@ def start():
         environment = cfg.get('environment', 'production')
         log_level = cfg.get('loglevel', 'INFO')
 
+    # Get configuration
+    serverHost = nativestr(cfg.get("serverhost", "127.0.0.1"))
+    serverPort = int(cfg.get("serverport", "8080"))
+    workers = int(args.get('workers', None) or cfg.get("serverworkers", "1"))
+
+    # Workers get the socket using systemd socket activation as supported by
+    # the HTTP server of CherryPy 8.0 and later.
+    if workers > 1 and int(cherrypy.__version__.split('.')[0]) < 8:
+        raise ValueError("ServerWorkers requires CherryPy 8.0 or later")
+
+    # Bind the socket shared by the workers before opening the log files.
+    sock = bind_socket(serverHost, serverPort) if workers > 1 else None
+
     # Configure logging
     setup_logging(
         log_file=log_file,
         log_access_file=log_access_file,
         level=log_level)
 
+    # Fork the workers before creating the app. Sessions must be shared by
+    # the workers.
+    if workers > 1:
+        if cfg.setdefault('sessionstorage', 'database') != 'database':
+            logger.warning("SessionStorage should be `database` when running multiple workers")
+        start_workers(workers, sock)
+
     # Create App.
     app = rdw_app.RdiffwebApp(cfg)
 
-    # Get configuration
-    serverHost = nativestr(cfg.get("serverhost", "127.0.0.1"))
-    serverPort = int(cfg.get("serverport", "8080"))
     # Get SSL configuration (if any)
     sslCertificate = cfg.get("sslcertificate")
     sslPrivateKey = cfg.get("sslprivatekey")
@@ -213,10 +322,16 @@ def start():
     # Add a custom signal handler
     cherrypy.engine.signal_handler.handlers['SIGUSR2'] = debug_dump_mem
     cherrypy.engine.signal_handler.handlers['SIGABRT'] = debug_dump_thread
+    # Workers are restarted by the master process on SIGHUP.
+    if workers > 1:
+        cherrypy.engine.signal_handler.handlers['SIGHUP'] = cherrypy.engine.exit
 
     # Start deamons
     RemoveOlder(cherrypy.engine, app).subscribe()
     NotificationPlugin(cherrypy.engine, app).subscribe()
+    app.restore_queue.subscribe()
+    app.status_refresher.subscribe()
+    app.repo_watcher.subscribe()
 
     # Start web server
     cherrypy.quickstart(app)
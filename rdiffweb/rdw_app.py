@@ -48,7 +48,11 @@ from rdiffweb.core import i18n  # @UnusedImport
 from rdiffweb.core import rdw_templating
 from rdiffweb.core.config import Option
 from rdiffweb.core.librdiff import DoesNotExistError, AccessDeniedError
+from rdiffweb.core.restore_queue import RestoreQueue
+from rdiffweb.core.sessions import DbSession
+from rdiffweb.core.status_refresher import StatusRefresher
 from rdiffweb.core.store import Store
+from rdiffweb.core.watcher import RepoWatcher
 
 
 # Define the logger
@@ -95,6 +99,8 @@ class RdiffwebApp(Application):
     
     _tempdir = Option('TempDir')
 
+    _session_storage = Option('SessionStorage')
+
     def __init__(self, cfg={}):
         self.cfg = {k.lower(): v for k, v in cfg.items()}
         
@@ -103,6 +109,7 @@ class RdiffwebApp(Application):
 
         # Get some config
         session_path = self.cfg.get("sessiondir", None)
+        session_storage = self._session_storage or ('file' if session_path else 'ram')
 
         # Initialise the application
         config = {
@@ -119,7 +126,7 @@ class RdiffwebApp(Application):
                 'tools.proxy.on':  CP_PROXY,
                 'error_page.default': self.error_page,
                 'request.error_response': self.error_response,
-                'tools.sessions.storage_type': 'file' if session_path else 'ram',
+                'tools.sessions.storage_type': 'ram' if session_storage == 'database' else session_storage,
                 'tools.sessions.storage_path': session_path,
             },
         }
@@ -148,6 +155,22 @@ class RdiffwebApp(Application):
         self.store = Store(self)
         self.store.create_admin_user()
 
+        # Store the sessions in database to share them between processes.
+        if session_storage == 'database':
+            session_config = self.config[native_str('/')]
+            del session_config['tools.sessions.storage_type']
+            session_config['tools.sessions.storage_class'] = DbSession
+            session_config['tools.sessions.database'] = self.store._database
+
+        # create the queue of restore jobs.
+        self.restore_queue = RestoreQueue(cherrypy.engine, self)
+
+        # create the background computation of repositories status.
+        self.status_refresher = StatusRefresher(cherrypy.engine, self)
+
+        # create the watcher of user roots.
+        self.repo_watcher = RepoWatcher(cherrypy.engine, self)
+
     @property
     def currentuser(self):
         """
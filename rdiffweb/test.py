@@ -57,6 +57,7 @@ class MockRdiffwebApp(RdiffwebApp):
         # database in memory
         self.database_dir = tempfile.mkdtemp(prefix='rdiffweb_tests_db_')
         default_config['SQLiteDBFile'] = os.path.join(self.database_dir, 'rdiffweb.tmp.db')
+        default_config['RestoreCacheDir'] = os.path.join(self.database_dir, 'restore')
 
         # Call parent constructor
         RdiffwebApp.__init__(self, cfg=default_config)
@@ -190,7 +190,12 @@ tests_require=[
     "mockldap>=0.2.6",
     "pytest<5.0.0",
 ]
-extras_require={'tox': tests_require}
+extras_require={
+    'tox': tests_require,
+    'zstd': ['zstandard'],
+    'lz4': ['lz4'],
+    'postgresql': ['psycopg2'],
+}
 
 long_description_content_type = long_description = None
 with open(os.path.join(os.path.dirname(__file__), 'README.md'), encoding='utf-8') as f: